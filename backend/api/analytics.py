@@ -0,0 +1,139 @@
+import csv
+import json
+
+from django.db import connections
+from django.db.models import Count, DateField
+from django.db.models.functions import TruncWeek
+
+from recipes.models import (
+    Ingredient,
+    RecipeIngredient,
+    RecipeShoppingList,
+    RecipeTag,
+    Tag
+)
+
+DEMAND_COLUMNS = ('week', 'tag', 'ingredient', 'unit', 'amount', 'carts')
+DEMAND_CHUNK_SIZE = 2000
+ALL_TAGS = ''
+
+
+def active_carts(since=None):
+    """Записи списков покупок активных пользователей и рецептов."""
+    carts = RecipeShoppingList.objects.filter(
+        user__is_active=True, recipe__is_active=True
+    )
+    if since is not None:
+        carts = carts.filter(created__gte=since)
+    return carts
+
+
+def demand_rows(carts, chunk_size=DEMAND_CHUNK_SIZE):
+    """
+    Спрос на ингредиенты по неделям добавления в список покупок
+    и тегам рецептов: кортежи в порядке DEMAND_COLUMNS.
+    Записи carts сначала группируются в базе до (рецепт, неделя, число
+    записей), и только эти строки соединяются с ингредиентами и тегами,
+    так что объём соединения зависит от числа рецептов и недель,
+    а не пользователей. Итог читается курсором пачками по chunk_size,
+    как QuerySet.iterator(), - отчёт целиком в памяти не собирается.
+    Рецепт с несколькими тегами входит в спрос каждого тега; строки
+    с пустым tag - итог по всем рецептам.
+    """
+    connection = connections[carts.db]
+    quote = connection.ops.quote_name
+    weeks, params = carts.order_by().annotate(
+        week=TruncWeek('created', output_field=DateField())
+    ).values('recipe_id', 'week').annotate(
+        carts=Count('id')
+    ).query.sql_with_params()
+
+    def column(alias, model, name):
+        return f'{alias}.{quote(model._meta.get_field(name).column)}'
+
+    name = column('i', Ingredient, 'name')
+    unit = column('i', Ingredient, 'unit')
+    slug = column('t', Tag, 'slug')
+    totals = (
+        f'SUM({column("a", RecipeIngredient, "amount")} * w.carts), '
+        f'SUM(w.carts) FROM weeks w '
+        f'JOIN {quote(RecipeIngredient._meta.db_table)} a '
+        f'ON {column("a", RecipeIngredient, "recipe")} = w.recipe_id '
+        f'JOIN {quote(Ingredient._meta.db_table)} i '
+        f'ON {column("i", Ingredient, "id")} = '
+        f'{column("a", RecipeIngredient, "ingredient")}'
+    )
+    sql = (
+        f'WITH weeks (recipe_id, week, carts) AS ({weeks}) '
+        f'SELECT w.week, %s, {name}, {unit}, {totals} '
+        f'GROUP BY w.week, {name}, {unit} '
+        f'UNION ALL '
+        f'SELECT w.week, {slug}, {name}, {unit}, {totals} '
+        f'JOIN {quote(RecipeTag._meta.db_table)} rt '
+        f'ON {column("rt", RecipeTag, "recipe")} = w.recipe_id '
+        f'JOIN {quote(Tag._meta.db_table)} t '
+        f'ON {column("t", Tag, "id")} = {column("rt", RecipeTag, "tag")} '
+        f'GROUP BY w.week, {slug}, {name}, {unit} '
+        f'ORDER BY 1, 2, 3, 4'
+    )
+    week_field = DateField()
+    with connection.chunked_cursor() as cursor:
+        cursor.execute(sql, (*params, ALL_TAGS))
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                return
+            for week, *row in rows:
+                yield (week_field.to_python(week), *row)
+
+
+def to_columns(rows):
+    """Строки отчёта по столбцам: {столбец: [значения]}."""
+    columns = {name: [] for name in DEMAND_COLUMNS}
+    for row in rows:
+        for name, value in zip(DEMAND_COLUMNS, row):
+            columns[name].append(value)
+    return columns
+
+
+def ingredient_demand(carts, chunk_size=DEMAND_CHUNK_SIZE):
+    """Отчёт demand_rows целиком по столбцам."""
+    return to_columns(demand_rows(carts, chunk_size))
+
+
+def write_csv(rows, stream):
+    """CSV построчно, возвращает число строк отчёта."""
+    count = 0
+    for line in iter_csv(rows):
+        stream.write(line)
+        count += 1
+    return count - 1
+
+
+class Echo:
+    """Буфер для csv.writer: запись возвращает строку."""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(rows):
+    """Строки CSV по одной для StreamingHttpResponse."""
+    writer = csv.writer(Echo())
+    yield writer.writerow(DEMAND_COLUMNS)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def write_columns(rows, stream):
+    """JSON по столбцам, как снимок каталога ингредиентов."""
+    columns = to_columns(rows)
+    columns['week'] = [week.isoformat() for week in columns['week']]
+    json.dump(columns, stream, ensure_ascii=False, separators=(',', ':'))
+    return len(columns['week'])
+
+
+WRITERS = {
+    'csv': write_csv,
+    'columns': write_columns,
+}
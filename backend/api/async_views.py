@@ -0,0 +1,213 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections
+from django.urls import URLPattern
+from django.utils.cache import get_conditional_response
+
+from .cache import get_recipe_fragments, get_user_sets
+from .fieldsets import get_fieldset
+from .mixins import get_etag, set_validators
+from .representations import RECIPE_DETAIL_FIELDS
+
+CONDITIONAL_HEADERS = (
+    'HTTP_IF_NONE_MATCH',
+    'HTTP_IF_MODIFIED_SINCE',
+    'HTTP_IF_MATCH',
+    'HTTP_IF_UNMODIFIED_SINCE',
+)
+
+_executor = None
+
+
+def get_executor():
+    """
+    Общий пул потоков для параллельных шагов на всё время жизни
+    процесса. Потоки и их постоянные соединения переиспользуются
+    между запросами, а не открываются в потоках каждого цикла событий.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(settings.ASYNC_DB_THREADS,
+                                       thread_name_prefix='async-db')
+    return _executor
+
+
+def _closing(func):
+    """
+    Шаг в потоке пула между границами, как запрос воркера:
+    соединение потока проверяется по возрасту и ошибкам до и после.
+    """
+    def wrapper():
+        close_old_connections()
+        try:
+            return func()
+        finally:
+            close_old_connections()
+    return wrapper
+
+
+async def gather(parallel, *funcs):
+    """
+    Выполнение независимых синхронных функций без аргументов.
+    При parallel каждая работает в потоке общего пула get_executor()
+    с его постоянным соединением с базой, иначе - по очереди
+    в потоке запроса.
+    """
+    if not parallel or len(funcs) < 2:
+        return [await sync_to_async(func)() for func in funcs]
+    executor = get_executor()
+    return await asyncio.gather(*(
+        sync_to_async(_closing(func), thread_sensitive=False,
+                      executor=executor)()
+        for func in funcs
+    ))
+
+
+def _initial(view, request):
+    """
+    Аутентификация, права и выбор реплики. Внутри открытой транзакции
+    запросы должны идти через её соединение, поэтому параллельность
+    отключается.
+    """
+    view.initial(request)
+    return not connections[DEFAULT_DB_ALIAS].in_atomic_block
+
+
+async def conditional(view, request, parallel, render, *prefetch):
+    """
+    Условный GET: валидаторы вычисляются вместе с независимыми
+    шагами prefetch, результаты шагов передаются в render.
+    Если клиент прислал валидаторы, вероятен ответ 304, поэтому
+    шаги выполняются только после проверки.
+    """
+    if any(name in request.META for name in CONDITIONAL_HEADERS):
+        (validators,) = await gather(parallel, view.get_validators)
+        results = None
+    else:
+        validators, *results = await gather(
+            parallel, view.get_validators, *prefetch
+        )
+    etag_source, last_modified = validators
+    etag = get_etag(etag_source)
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified
+    )
+    if response is None:
+        if results is None:
+            results = await gather(parallel, *prefetch)
+        (response,) = await gather(False, partial(render, *results))
+    return set_validators(response, etag, last_modified)
+
+
+async def read(view, request, parallel):
+    """list или retrieve вьюсета с ConditionalGetMixin."""
+    handler = getattr(type(view), view.action).__wrapped__
+    return await conditional(view, request, parallel, partial(
+        handler, view, request, *view.args, **view.kwargs
+    ))
+
+
+async def recipe_list(view, request, parallel):
+    """
+    Страница id рецептов выбирается вместе с валидаторами.
+    Фильтры разбираются заранее: их queryset общий для обоих шагов.
+    """
+    await gather(False, view._get_filtered_queryset)
+    return await conditional(
+        view, request, parallel, view._list_response, view._get_page
+    )
+
+
+def _warm_fragment(view):
+    try:
+        get_recipe_fragments([int(view.kwargs[view.lookup_field])])
+    except ValueError:
+        pass
+
+
+async def recipe_retrieve(view, request, parallel):
+    """
+    Полный фрагмент рецепта прогревается вместе с валидаторами.
+    Для неполного набора полей фрагмент не кэшируется, прогревать нечего.
+    """
+    handler = type(view).retrieve.__wrapped__
+    prefetch = ()
+    if get_fieldset(request, RECIPE_DETAIL_FIELDS) is None:
+        prefetch = (partial(_warm_fragment, view),)
+    return await conditional(
+        view, request, parallel,
+        lambda *_: handler(view, request, *view.args, **view.kwargs),
+        *prefetch
+    )
+
+
+async def subscriptions(view, request, parallel):
+    """Страница подписок выбирается вместе с множествами пользователя."""
+    page, _ = await gather(parallel, view._get_subscriptions_page,
+                           partial(get_user_sets, request))
+    (response,) = await gather(
+        False, partial(view._subscriptions_response, page)
+    )
+    return response
+
+
+ASYNC_HANDLERS = {
+    'recipes': {'list': recipe_list, 'retrieve': recipe_retrieve},
+    'tags': {'list': read, 'retrieve': read},
+    'ingredients': {'list': read, 'retrieve': read},
+    'users': {'subscriptions': subscriptions},
+}
+
+
+def async_read_view(sync_view, handlers):
+    """
+    Асинхронное представление поверх представления вьюсета из роутера.
+    GET-действия из handlers выполняются корутинами: независимые
+    запросы идут параллельно, пока поток событий обслуживает другие
+    запросы. Остальные методы передаются синхронному вьюсету.
+    """
+    actions = dict(sync_view.actions)
+    if 'get' in actions:
+        actions.setdefault('head', actions['get'])
+
+    async def view(request, *args, **kwargs):
+        handler = handlers.get(actions.get(request.method.lower()))
+        if handler is None:
+            return await sync_to_async(sync_view)(request, *args, **kwargs)
+        viewset = sync_view.cls(**sync_view.initkwargs)
+        viewset.action_map = actions
+        viewset.args, viewset.kwargs = args, kwargs
+        request = viewset.initialize_request(request, *args, **kwargs)
+        viewset.request = request
+        viewset.headers = viewset.default_response_headers
+        try:
+            parallel = await sync_to_async(_initial)(viewset, request)
+            response = await handler(viewset, request, parallel)
+        except Exception as exc:
+            response = await sync_to_async(viewset.handle_exception)(exc)
+        return await sync_to_async(viewset.finalize_response)(
+            request, response, *args, **kwargs
+        )
+
+    view.csrf_exempt = True
+    return view
+
+
+def async_read_urls(patterns):
+    """URL роутера с асинхронными представлениями горячих GET-действий."""
+    result = []
+    for pattern in patterns:
+        callback = pattern.callback
+        basename = getattr(callback, 'initkwargs', {}).get('basename')
+        handlers = ASYNC_HANDLERS.get(basename, {})
+        if handlers.keys() & set(getattr(callback, 'actions', {}).values()):
+            pattern = URLPattern(
+                pattern.pattern, async_read_view(callback, handlers),
+                pattern.default_args, pattern.name
+            )
+        result.append(pattern)
+    return result
@@ -0,0 +1,26 @@
+from django.core.cache import cache
+from rest_framework.authentication import TokenAuthentication
+
+TOKEN_KEY = 'auth:token:{}'
+TOKEN_TIMEOUT = 60
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Аутентификация по токену с кэшированием связки токен-пользователь.
+    Запись живёт TOKEN_TIMEOUT секунд и сбрасывается сигналами
+    при удалении токена и изменении пользователя.
+    """
+
+    def authenticate_credentials(self, key):
+        cache_key = TOKEN_KEY.format(key)
+        token = cache.get(cache_key)
+        if token is None:
+            user, token = super().authenticate_credentials(key)
+            cache.set(cache_key, token, TOKEN_TIMEOUT)
+        return token.user, token
+
+
+def invalidate_tokens(keys):
+    """Сброс кэшированных токенов."""
+    cache.delete_many([TOKEN_KEY.format(key) for key in keys])
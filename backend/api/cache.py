@@ -0,0 +1,186 @@
+from django.core.cache import cache
+from django.db import transaction
+
+from recipes.models import FavoriteRecipe, RecipeShoppingList
+from users.models import Follow
+from .replicas import use_primary
+from .representations import (
+    RECIPE_FIELDS,
+    SYNC_RECIPE_FIELDS,
+    USER_FLAG_FIELDS,
+    build_recipes
+)
+
+RECIPE_FRAGMENT_KEY = 'recipe:fragment:{}'
+RECIPE_FRAGMENT_TIMEOUT = 60 * 60 * 24
+
+FAVORITES = 'favorites'
+SHOPPING_CART = 'shopping_cart'
+FOLLOWING = 'following'
+USER_SET_KEY = 'user:{}:{}'
+USER_SET_TIMEOUT = 60 * 60
+USER_SET_MODELS = {
+    FavoriteRecipe: FAVORITES,
+    RecipeShoppingList: SHOPPING_CART,
+    Follow: FOLLOWING,
+}
+USER_SET_QUERIES = {
+    FAVORITES: lambda user: FavoriteRecipe.objects.filter(
+        user=user).order_by().values_list('recipe_id', flat=True),
+    SHOPPING_CART: lambda user: RecipeShoppingList.objects.filter(
+        user=user).order_by().values_list('recipe_id', flat=True),
+    FOLLOWING: lambda user: Follow.objects.filter(
+        user=user).order_by().values_list('author_id', flat=True),
+}
+
+
+def _fragment_keys(recipe_ids):
+    return {RECIPE_FRAGMENT_KEY.format(pk): pk for pk in recipe_ids}
+
+
+def get_recipe_fragments(recipe_ids, fields=None):
+    """
+    Пользовательски-независимые представления рецептов из кэша.
+    Недостающие фрагменты собираются build_recipes из основной базы
+    и кладутся в кэш.
+    При неполном наборе полей fields недостающие фрагменты собираются
+    только из нужных данных и в кэш не попадают.
+    """
+    keys = _fragment_keys(recipe_ids)
+    fragments = {
+        keys[key]: fragment
+        for key, fragment in cache.get_many(keys).items()
+    }
+    missing = [pk for pk in recipe_ids if pk not in fragments]
+    if missing and fields is not None:
+        fragments.update(build_recipes(missing, fields))
+    elif missing:
+        with use_primary():
+            built = build_recipes(missing)
+        cache.set_many(
+            {RECIPE_FRAGMENT_KEY.format(pk): fragment
+             for pk, fragment in built.items()},
+            RECIPE_FRAGMENT_TIMEOUT
+        )
+        fragments.update(built)
+    return fragments
+
+
+def invalidate_recipe_fragments(recipe_ids):
+    """
+    Сброс фрагментов рецептов. Ключи удаляются сразу и повторно
+    после коммита, чтобы параллельный запрос не вернул в кэш
+    данные из ещё не завершённой транзакции.
+    """
+    keys = list(_fragment_keys(set(recipe_ids)))
+    if not keys:
+        return
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def get_user_sets(request):
+    """
+    Множества id избранных рецептов, рецептов в корзине
+    и авторов в подписках текущего пользователя.
+    Кэшируются на пользователя и запоминаются на время запроса.
+    """
+    user = request.user
+    if user.is_anonymous:
+        return {name: frozenset() for name in USER_SET_QUERIES}
+    sets = getattr(request, '_user_sets', None)
+    if sets is not None:
+        return sets
+    keys = {USER_SET_KEY.format(user.id, name): name
+            for name in USER_SET_QUERIES}
+    sets = {keys[key]: value for key, value in cache.get_many(keys).items()}
+    missing = {}
+    for key, name in keys.items():
+        if name not in sets:
+            sets[name] = missing[key] = frozenset(
+                USER_SET_QUERIES[name](user)
+            )
+    if missing:
+        cache.set_many(missing, USER_SET_TIMEOUT)
+    request._user_sets = sets
+    return sets
+
+
+def invalidate_user_sets(user_ids, names=tuple(USER_SET_QUERIES)):
+    """
+    Сброс множеств пользователей. Как и фрагменты рецептов, ключи
+    удаляются сразу и повторно после коммита: множество заново
+    собирается из базы, а не записывается вычисленным, поэтому
+    параллельные записи не теряются, а откаченные не попадают в кэш.
+    """
+    keys = [USER_SET_KEY.format(user_id, name)
+            for user_id in set(user_ids) for name in names]
+    if not keys:
+        return
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def update_user_set(request, name, object_id, add=True):
+    """
+    Изменение множества пользователя после записи: в памяти запроса
+    множество обновляется для ответа, ключ в кэше сбрасывается.
+    """
+    current = get_user_sets(request)[name]
+    updated = current | {object_id} if add else current - {object_id}
+    request._user_sets = {**request._user_sets, name: updated}
+    invalidate_user_sets([request.user.id], (name,))
+
+
+def get_user_sets_signature(request):
+    """
+    Отпечаток множеств пользователя для валидаторов условных запросов.
+    Хэши целых чисел не рандомизируются, поэтому отпечаток
+    совпадает во всех процессах.
+    """
+    if request.user.is_anonymous:
+        return ''
+    sets = get_user_sets(request)
+    return str(hash(tuple(sets[name] for name in USER_SET_QUERIES)))
+
+
+def get_recipes_data(request, recipe_ids, fields=None, user_flags=True):
+    """
+    Представления рецептов для текущего пользователя:
+    кэшированные фрагменты с наложенными флагами избранного,
+    корзины и подписки на автора. fields ограничивает набор полей.
+    Без user_flags флаги не выводятся: такие данные не зависят
+    от пользователя и не устаревают при его действиях.
+    Порядок соответствует recipe_ids, отсутствующие рецепты пропускаются.
+    """
+    recipe_ids = list(recipe_ids)
+    fragments = get_recipe_fragments(recipe_ids, fields)
+    if fields is None:
+        fields = RECIPE_FIELDS if user_flags else SYNC_RECIPE_FIELDS
+    sets = None
+    if user_flags and not USER_FLAG_FIELDS.isdisjoint(fields):
+        sets = get_user_sets(request)
+    data = []
+    for pk in recipe_ids:
+        fragment = fragments.get(pk)
+        if fragment is None:
+            continue
+        recipe = {name: fragment[name] for name in fields}
+        if 'author' in recipe and not user_flags:
+            recipe['author'] = {
+                name: value for name, value in fragment['author'].items()
+                if name != 'is_subscribed'
+            }
+        elif 'author' in recipe:
+            author = fragment['author']
+            recipe['author'] = {
+                **author, 'is_subscribed': author['id'] in sets[FOLLOWING]
+            }
+        if 'is_favorited' in recipe:
+            recipe['is_favorited'] = pk in sets[FAVORITES]
+        if 'is_in_shopping_cart' in recipe:
+            recipe['is_in_shopping_cart'] = pk in sets[SHOPPING_CART]
+        if recipe.get('image'):
+            recipe['image'] = request.build_absolute_uri(recipe['image'])
+        data.append(recipe)
+    return data
@@ -0,0 +1,35 @@
+from rest_framework.exceptions import ValidationError
+
+FIELDS_PARAM = 'fields'
+OMIT_PARAM = 'omit'
+
+
+def _parse(request, param):
+    value = request.query_params.get(param)
+    if value is None:
+        return None
+    return {name.strip() for name in value.split(',') if name.strip()}
+
+
+def get_fieldset(request, available):
+    """
+    Поля ответа по параметрам fields и omit в порядке available.
+    Без параметров возвращает None - полное представление,
+    пустой набор полей - ошибка 400.
+    """
+    fields, omit = _parse(request, FIELDS_PARAM), _parse(request, OMIT_PARAM)
+    if fields is None and omit is None:
+        return None
+    unknown = ((fields or set()) | (omit or set())) - set(available)
+    if unknown:
+        raise ValidationError({
+            FIELDS_PARAM: f'Неизвестные поля: {", ".join(sorted(unknown))}.'
+        })
+    result = tuple(
+        name for name in available
+        if (fields is None or name in fields)
+        and (omit is None or name not in omit)
+    )
+    if not result:
+        raise ValidationError({FIELDS_PARAM: 'Не выбрано ни одного поля.'})
+    return result
@@ -2,6 +2,7 @@ from django_filters.rest_framework import FilterSet, filters
 from rest_framework.filters import SearchFilter
 
 from recipes.models import Ingredient, Recipe, Tag
+from .scores import POPULAR, TRENDING
 
 
 class IngredientFilter(SearchFilter):
@@ -15,7 +16,8 @@ class IngredientFilter(SearchFilter):
 
 class RecipeFilter(FilterSet):
     """Фильтр рецептов по автору, тегу,
-    наличию в избранном и в списке покупок.
+    наличию в избранном и в списке покупок;
+    сортировка по предрассчитанной популярности.
     """
     author = filters.AllValuesMultipleFilter(
         field_name='author__id',
@@ -33,6 +35,12 @@ class RecipeFilter(FilterSet):
         method='get_is_in_shopping_cart',
         label='shopping_cart',
     )
+    ordering = filters.ChoiceFilter(
+        choices=((POPULAR, 'Популярные'),
+                 (TRENDING, 'Популярные за неделю')),
+        method='get_ordering',
+        label='ordering',
+    )
 
     class Meta:
         model = Recipe
@@ -60,3 +68,13 @@ class RecipeFilter(FilterSet):
             return Recipe.objects.filter(
                 shopping__user=self.request.user
             )
+
+    def get_ordering(self, queryset, name, value):
+        """
+        Сортировка по оценке из таблицы RecipeScore
+        через INNER JOIN в точном порядке её индекса.
+        Строка оценки обязательна: она создаётся вместе с рецептом.
+        """
+        return queryset.filter(score__isnull=False).order_by(
+            f'-score__{value}', '-score__recipe_id'
+        )
@@ -0,0 +1,150 @@
+import asyncio
+import io
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import cycle, islice
+from urllib.parse import urlsplit
+
+from django.core.management import BaseCommand
+from django.core.wsgi import get_wsgi_application
+from django.db.backends.signals import connection_created
+from django.test import override_settings
+
+from recipebook.asgi import AsyncReadASGIHandler
+from recipes.models import Recipe, Tag
+
+WSGI = 'wsgi'
+ASGI = 'asgi'
+
+
+class Command(BaseCommand):
+    """
+    Сравнение горячих GET-запросов через WSGI и ASGI в одном процессе
+    на текущей базе: --concurrency клиентов шлют запросы без пауз.
+    WSGI моделирует синхронные воркеры gunicorn с синхронными
+    вьюсетами (recipebook.urls) - одновременно обрабатывается
+    не больше --workers запросов, время ожидания воркера входит
+    в задержку. ASGI - обработчик recipebook.asgi с асинхронными
+    представлениями, все клиенты в одном потоке событий.
+    --db-latency добавляет к каждому запросу к базе задержку сети
+    до отдельного сервера PostgreSQL. Для каждой стороны выводится
+    и число новых соединений с базой.
+    """
+    help = 'Пропускная способность чтения через WSGI и ASGI'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--db-latency', type=float, default=2.0,
+                            help='Задержка запроса к базе, мс')
+        parser.add_argument('--urls', default='')
+
+    def get_urls(self, urls):
+        if urls:
+            return urls.split(',')
+        recipe_id = Recipe.objects.values_list('id', flat=True).first()
+        tag_id = Tag.objects.values_list('id', flat=True).first()
+        result = ['/api/recipes/', '/api/tags/', '/api/ingredients/?name=a']
+        if recipe_id is not None:
+            result.append(f'/api/recipes/{recipe_id}/')
+        if tag_id is not None:
+            result.append(f'/api/tags/{tag_id}/')
+        return result
+
+    def run_wsgi(self, urls, workers, concurrency):
+        application = get_wsgi_application()
+        free_workers = threading.Semaphore(workers)
+
+        def request(url):
+            path, _, query = url.partition('?')
+            environ = {
+                'REQUEST_METHOD': 'GET', 'PATH_INFO': path,
+                'QUERY_STRING': query, 'SERVER_NAME': 'localhost',
+                'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+                'HTTP_HOST': 'localhost', 'wsgi.url_scheme': 'http',
+                'wsgi.input': io.BytesIO(), 'wsgi.errors': io.StringIO(),
+            }
+            started = time.perf_counter()
+            with free_workers:
+                response = application(environ, lambda *args: None)
+                b''.join(response)
+                response.close()
+            return time.perf_counter() - started
+
+        with ThreadPoolExecutor(concurrency) as pool:
+            return list(pool.map(request, urls))
+
+    async def run_asgi(self, urls, concurrency):
+        application = AsyncReadASGIHandler()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            pass
+
+        async def request(url):
+            parts = urlsplit(url)
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'},
+                'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+                'path': parts.path, 'raw_path': parts.path.encode(),
+                'query_string': parts.query.encode(), 'root_path': '',
+                'headers': [(b'host', b'localhost')],
+                'client': ('127.0.0.1', 0), 'server': ('localhost', 80),
+            }
+            async with semaphore:
+                started = time.perf_counter()
+                await application(scope, receive, send)
+                return time.perf_counter() - started
+
+        return await asyncio.gather(*map(request, urls))
+
+    def report(self, name, timings, elapsed, connects):
+        timings = sorted(timings)
+        self.stdout.write(
+            f'{name}: {len(timings) / elapsed:.0f} запросов/с, '
+            f'среднее {sum(timings) / len(timings) * 1000:.1f} мс, '
+            f'p50 {timings[len(timings) // 2] * 1000:.1f} мс, '
+            f'p95 {timings[int(len(timings) * 0.95)] * 1000:.1f} мс, '
+            f'p99 {timings[int(len(timings) * 0.99)] * 1000:.1f} мс, '
+            f'соединений {connects}'
+        )
+
+    def handle(self, *args, **options):
+        latency = options['db_latency'] / 1000
+
+        def delay(execute, sql, params, many, context):
+            time.sleep(latency)
+            return execute(sql, params, many, context)
+
+        connects = []
+
+        def add_delay(sender, connection, **kwargs):
+            connects.append(threading.current_thread().name)
+            if latency and delay not in connection.execute_wrappers:
+                connection.execute_wrappers.append(delay)
+
+        connection_created.connect(add_delay)
+        try:
+            with override_settings(ALLOWED_HOSTS=['*'], DEBUG=False):
+                urls = self.get_urls(options['urls'])
+                self.run_wsgi(urls, 1, 1)
+                urls = list(islice(cycle(urls), options['requests']))
+                for name in (WSGI, ASGI):
+                    connects.clear()
+                    started = time.perf_counter()
+                    if name == WSGI:
+                        timings = self.run_wsgi(urls, options['workers'],
+                                                options['concurrency'])
+                    else:
+                        timings = asyncio.run(
+                            self.run_asgi(urls, options['concurrency'])
+                        )
+                    self.report(name, timings,
+                                time.perf_counter() - started, len(connects))
+        finally:
+            connection_created.disconnect(add_delay)
@@ -0,0 +1,153 @@
+import random
+import tracemalloc
+from datetime import timedelta
+from time import perf_counter
+
+from django.core.management import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models.functions import Mod
+from django.utils import timezone
+
+from api.analytics import active_carts, demand_rows, iter_csv
+from recipes.models import (
+    Ingredient,
+    Recipe,
+    RecipeIngredient,
+    RecipeShoppingList,
+    RecipeTag,
+    Tag
+)
+from users.models import User
+
+INGREDIENTS_PER_RECIPE = 8
+BENCH_BATCH_SIZE = 5000
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    """
+    Время и пиковая память отчёта о спросе на ингредиенты
+    на синтетических списках покупок: потоковая выдача CSV, как в админке.
+    Данные создаются во временной транзакции и откатываются.
+    Время меряется отдельно от памяти: tracemalloc замедляет Python.
+    Команда завершается ошибкой, если отчёт не уложился в --max-seconds
+    или --max-memory. Цифры имеют смысл на той же СУБД, что и в продакшене.
+    """
+    help = 'Время отчёта о спросе на ингредиенты'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100000)
+        parser.add_argument('--carts', type=int, default=5,
+                            help='Рецептов в списке покупок пользователя')
+        parser.add_argument('--recipes', type=int, default=1000)
+        parser.add_argument('--weeks', type=int, default=12)
+        parser.add_argument('--max-seconds', type=float, default=10,
+                            help='Допустимое время отчёта')
+        parser.add_argument('--max-memory', type=float, default=50,
+                            help='Допустимая пиковая память отчёта, МБ')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(**options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def create_carts(self, users, carts, recipes, weeks):
+        rng = random.Random(0)
+        author = User.objects.create_user(
+            email='demand@example.com', username='demand',
+            first_name='Бенчмарк', last_name='Бенчмарков',
+            password='benchmark'
+        )
+        tags = Tag.objects.bulk_create(
+            Tag(name=f'demand tag {i}', color=f'#DE00{i:02d}',
+                slug=f'demand-tag-{i}')
+            for i in range(3)
+        )
+        ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f'demand ingredient {i}', unit='г')
+            for i in range(100)
+        )
+        recipe_ids = [recipe.id for recipe in Recipe.objects.bulk_create(
+            Recipe(author=author, name=f'demand recipe {i}',
+                   image='recipes/images/bench.png', text='Описание',
+                   cooking_time=30)
+            for i in range(recipes)
+        )]
+        RecipeTag.objects.bulk_create(
+            RecipeTag(recipe_id=recipe_id, tag=tags[i % len(tags)])
+            for i, recipe_id in enumerate(recipe_ids)
+        )
+        RecipeIngredient.objects.bulk_create(
+            (RecipeIngredient(recipe_id=recipe_id,
+                              ingredient=ingredients[(i + j) % 100],
+                              amount=j + 1)
+             for i, recipe_id in enumerate(recipe_ids)
+             for j in range(INGREDIENTS_PER_RECIPE)),
+            batch_size=BENCH_BATCH_SIZE,
+        )
+        User.objects.bulk_create(
+            (User(email=f'demand{i}@example.com', username=f'demand{i}',
+                  first_name='Бенчмарк', last_name='Бенчмарков',
+                  password='!')
+             for i in range(users)),
+            batch_size=BENCH_BATCH_SIZE,
+        )
+        user_ids = User.objects.filter(
+            email__endswith='@example.com', username__startswith='demand'
+        ).exclude(id=author.id).values_list('id', flat=True)
+        RecipeShoppingList.objects.bulk_create(
+            (RecipeShoppingList(user_id=user_id, recipe_id=recipe_id)
+             for user_id in user_ids.iterator()
+             for recipe_id in rng.sample(recipe_ids, carts)),
+            batch_size=BENCH_BATCH_SIZE,
+        )
+        now = timezone.now()
+        days = RecipeShoppingList.objects.filter(
+            user_id__in=user_ids
+        ).annotate(day=Mod('id', weeks * 7))
+        for day in range(weeks * 7):
+            days.filter(day=day).update(created=now - timedelta(days=day))
+
+    def stream(self):
+        """Отчёт потоком, как в админке: (строк CSV, символов)."""
+        lines = size = 0
+        for line in iter_csv(demand_rows(active_carts())):
+            lines += 1
+            size += len(line)
+        return lines, size
+
+    def run(self, users, carts, recipes, weeks, max_seconds, max_memory,
+            **options):
+        started = perf_counter()
+        self.create_carts(users, carts, recipes, weeks)
+        self.stdout.write(
+            f'{connection.vendor}: {users} пользователей, '
+            f'{users * carts} записей списков покупок '
+            f'(подготовка {perf_counter() - started:.1f} с)'
+        )
+        started = perf_counter()
+        lines, size = self.stream()
+        elapsed = perf_counter() - started
+        tracemalloc.start()
+        try:
+            self.stream()
+            peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        finally:
+            tracemalloc.stop()
+        self.stdout.write(
+            f'demand_rows + iter_csv: {elapsed:.2f} с, '
+            f'пик памяти {peak:.1f} МБ, {lines - 1} строк, {size} символов'
+        )
+        if elapsed > max_seconds or peak > max_memory:
+            raise CommandError(
+                f'Цель не достигнута: {max_seconds} с, {max_memory} МБ'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Цель достигнута: {max_seconds} с, {max_memory} МБ'
+        ))
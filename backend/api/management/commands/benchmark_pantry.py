@@ -0,0 +1,69 @@
+import random
+import sys
+import time
+from itertools import accumulate
+
+from django.core.management import BaseCommand
+
+from api.pantry import PantryIndex
+
+INGREDIENTS = 2200
+TAGS = 10
+
+
+class Command(BaseCommand):
+    """
+    Время построения индекса ингредиентов и поиска «что приготовить»
+    на синтетических каталогах разного размера. Популярность
+    ингредиентов распределена по закону Ципфа, как у соли и сахара.
+    """
+    help = 'Время поиска рецептов по имеющимся ингредиентам'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,10000,100000')
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--pantry', type=int, default=15)
+        parser.add_argument('--max-missing', type=int, default=2)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        weights = list(accumulate(
+            1 / rank for rank in range(1, INGREDIENTS + 1)
+        ))
+        for size in map(int, options['sizes'].split(',')):
+            rows = [
+                (recipe_id,
+                 rng.choices(range(INGREDIENTS), cum_weights=weights,
+                             k=rng.randint(3, 12)),
+                 [rng.randrange(TAGS)])
+                for recipe_id in range(1, size + 1)
+            ]
+            started = time.perf_counter()
+            index = PantryIndex.from_rows(rows)
+            build = time.perf_counter() - started
+            memory = sum(
+                sys.getsizeof(bits) for bitsets in
+                (index.ingredients, index.tags, index.sizes)
+                for bits in bitsets.values()
+            ) + index.recipe_ids.itemsize * len(index.recipe_ids)
+            timings = []
+            found = 0
+            for number in range(options['queries']):
+                pantry = rng.choices(range(INGREDIENTS), cum_weights=weights,
+                                     k=options['pantry'])
+                tag_ids = [rng.randrange(TAGS)] if number % 2 else None
+                started = time.perf_counter()
+                matches = index.search(pantry, options['max_missing'],
+                                       tag_ids)
+                matches[0:6]
+                found += len(matches)
+                timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            self.stdout.write(
+                f'{size} рецептов: построение {build * 1000:.0f} мс, '
+                f'память {memory / 2 ** 20:.1f} МБ, '
+                f'найдено в среднем {found / len(timings):.0f}, '
+                f'поиск p50 {timings[len(timings) // 2]:.2f} мс, '
+                f'p95 {timings[int(len(timings) * 0.95)]:.2f} мс'
+            )
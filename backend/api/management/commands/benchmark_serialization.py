@@ -0,0 +1,119 @@
+from timeit import repeat
+
+from django.core.management import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api.cache import get_recipes_data
+from api.renderers import FastJSONRenderer
+from api.representations import build_recipes
+from api.serializers import RecipeSerializer
+from recipes.models import (
+    Ingredient,
+    Recipe,
+    RecipeIngredient,
+    RecipeTag,
+    Tag
+)
+from users.models import User
+
+INGREDIENTS_PER_RECIPE = 8
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    """
+    Сравнение сериализации списка рецептов через RecipeSerializer
+    и быстрый путь build_recipes. Данные создаются во временной
+    транзакции и откатываются.
+    """
+    help = 'Время сериализации на 1000 рецептов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options['recipes'], options['repeat'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def create_recipes(self, count):
+        author = User.objects.create_user(
+            email='benchmark@example.com', username='benchmark',
+            first_name='Бенчмарк', last_name='Бенчмарков',
+            password='benchmark'
+        )
+        tags = Tag.objects.bulk_create(
+            Tag(name=f'bench tag {i}', color=f'#00000{i}',
+                slug=f'bench-tag-{i}')
+            for i in range(3)
+        )
+        ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f'bench ingredient {i}', unit='г')
+            for i in range(100)
+        )
+        recipes = Recipe.objects.bulk_create(
+            Recipe(author=author, name=f'bench recipe {i}',
+                   image='recipes/images/bench.png',
+                   text='Описание рецепта ' * 20, cooking_time=30)
+            for i in range(count)
+        )
+        RecipeTag.objects.bulk_create(
+            RecipeTag(recipe=recipe, tag=tags[i % len(tags)])
+            for i, recipe in enumerate(recipes)
+        )
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(
+                recipe=recipe,
+                ingredient=ingredients[(i + j) % len(ingredients)],
+                amount=j + 1
+            )
+            for i, recipe in enumerate(recipes)
+            for j in range(INGREDIENTS_PER_RECIPE)
+        )
+        return author, [recipe.id for recipe in recipes]
+
+    def run(self, count, repeat_count):
+        author, recipe_ids = self.create_recipes(count)
+        request = Request(APIRequestFactory().get(
+            '/api/recipes/', SERVER_NAME='localhost'
+        ))
+        request.user = author
+
+        def serializer_path():
+            recipes = Recipe.objects.filter(id__in=recipe_ids).select_related(
+                'author'
+            ).prefetch_related('tags', 'recipeingredient_set__ingredient')
+            return JSONRenderer().render(RecipeSerializer(
+                recipes, many=True, context={'request': request}
+            ).data)
+
+        def build_path():
+            return FastJSONRenderer().render(
+                list(build_recipes(recipe_ids).values())
+            )
+
+        def fast_path():
+            return FastJSONRenderer().render(
+                get_recipes_data(request, recipe_ids)
+            )
+
+        scale = 1000 / count
+        for name, func in (('RecipeSerializer + JSONRenderer',
+                            serializer_path),
+                           ('build_recipes + FastJSONRenderer', build_path),
+                           ('get_recipes_data + FastJSONRenderer '
+                            '(тёплый кэш)', fast_path)):
+            best = min(repeat(func, number=1, repeat=repeat_count))
+            self.stdout.write(
+                f'{name}: {best * scale * 1000:.1f} мс на 1000 рецептов'
+            )
@@ -0,0 +1,107 @@
+import random
+import time
+
+from django.core.management import BaseCommand
+from django.db import transaction
+
+from api.similarity import band_keys, find_similar, minhash
+from recipes.models import Recipe, RecipeBand, RecipeSignature
+from users.models import User
+
+BATCH_SIZE = 5000
+INGREDIENTS = 2200
+INGREDIENTS_PER_RECIPE = 8
+VARIANTS_PER_CLUSTER = 20
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    """
+    Время поиска похожих рецептов по LSH-индексу в базе.
+    Синтетический каталог - группы вариаций базовых наборов
+    ингредиентов - создаётся во временной транзакции и откатывается.
+    """
+    help = 'Время поиска похожих рецептов на большом каталоге'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=100_000)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options['recipes'], options['queries'],
+                         random.Random(options['seed']))
+                raise Rollback
+        except Rollback:
+            pass
+
+    def ingredient_sets(self, count, rng):
+        base = None
+        for number in range(count):
+            if number % VARIANTS_PER_CLUSTER == 0:
+                base = rng.sample(range(1, INGREDIENTS + 1),
+                                  INGREDIENTS_PER_RECIPE)
+            variant = list(base)
+            for _ in range(rng.randrange(4)):
+                variant[rng.randrange(len(variant))] = rng.randrange(
+                    1, INGREDIENTS + 1
+                )
+            yield variant
+
+    def create_catalog(self, count, rng):
+        author = User.objects.create_user(
+            email='benchmark@example.com', username='benchmark',
+            first_name='Бенчмарк', last_name='Бенчмарков',
+            password='benchmark'
+        )
+        recipe_ids = []
+        sets = self.ingredient_sets(count, rng)
+        for start in range(0, count, BATCH_SIZE):
+            recipes = Recipe.objects.bulk_create(
+                Recipe(author=author, name=f'bench recipe {number}',
+                       image='recipes/images/bench.png', text='',
+                       cooking_time=30)
+                for number in range(start, min(start + BATCH_SIZE, count))
+            )
+            signatures = [(recipe.id, minhash(next(sets)))
+                          for recipe in recipes]
+            RecipeSignature.objects.bulk_create(
+                RecipeSignature(recipe_id=recipe_id,
+                                signature=signature.tobytes())
+                for recipe_id, signature in signatures
+            )
+            RecipeBand.objects.bulk_create(
+                (RecipeBand(recipe_id=recipe_id, key=key)
+                 for recipe_id, signature in signatures
+                 for key in band_keys(signature)),
+                batch_size=BATCH_SIZE
+            )
+            recipe_ids.extend(recipe.id for recipe in recipes)
+        return recipe_ids
+
+    def run(self, count, queries, rng):
+        started = time.perf_counter()
+        recipe_ids = self.create_catalog(count, rng)
+        self.stdout.write(
+            f'Каталог из {count} рецептов проиндексирован за '
+            f'{time.perf_counter() - started:.1f} с'
+        )
+        timings = []
+        found = 0
+        for recipe_id in rng.sample(recipe_ids, min(queries, count)):
+            started = time.perf_counter()
+            found += len(find_similar(recipe_id, 6))
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        self.stdout.write(
+            f'Поиск похожих ({len(timings)} запросов, '
+            f'в среднем {found / len(timings):.1f} результатов): '
+            f'p50 {timings[len(timings) // 2]:.2f} мс, '
+            f'p95 {timings[int(len(timings) * 0.95)]:.2f} мс, '
+            f'max {timings[-1]:.2f} мс'
+        )
@@ -0,0 +1,40 @@
+import sys
+import time
+
+from django.core.management import BaseCommand
+
+from api.transfer import TRANSFER_BATCH_SIZE, export_recipes
+
+
+class Command(BaseCommand):
+    """
+    Выгрузка рецептов в JSONL для переноса между окружениями.
+    Изображения копируются в каталог --images.
+    """
+    help = 'Выгрузка рецептов в JSONL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл JSONL или - для stdout')
+        parser.add_argument('--images', default=None,
+                            help='Каталог для файлов изображений')
+        parser.add_argument('--batch-size', type=int,
+                            default=TRANSFER_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        total = 0
+        output = (sys.stdout if options['path'] == '-'
+                  else open(options['path'], 'w', encoding='utf-8'))
+        try:
+            for count in export_recipes(output, options['images'],
+                                        options['batch_size']):
+                total += count
+                self.stderr.write(f'Выгружено рецептов: {total}')
+        finally:
+            if output is not sys.stdout:
+                output.close()
+        elapsed = time.monotonic() - started
+        self.stderr.write(self.style.SUCCESS(
+            f'Выгружено {total} рецептов за {elapsed:.1f} с '
+            f'({total / max(elapsed, 1e-9):.0f} рецептов/с)'
+        ))
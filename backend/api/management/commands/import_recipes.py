@@ -0,0 +1,47 @@
+import time
+
+from django.core.management import BaseCommand
+
+from api.transfer import TRANSFER_BATCH_SIZE, import_recipes
+
+
+class Command(BaseCommand):
+    """
+    Загрузка рецептов из JSONL, выгруженного export_recipes.
+    Пачка пишется в одной транзакции; после сбоя загрузку можно
+    продолжить с --offset, равным последней записанной строке.
+    """
+    help = 'Загрузка рецептов из JSONL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл JSONL')
+        parser.add_argument('--images', required=True,
+                            help='Каталог с файлами изображений')
+        parser.add_argument('--offset', type=int, default=0,
+                            help='Число уже обработанных строк')
+        parser.add_argument('--batch-size', type=int,
+                            default=TRANSFER_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        created = skipped = 0
+        with open(options['path'], encoding='utf-8') as stream:
+            for line, count, errors in import_recipes(
+                stream, options['images'], options['offset'],
+                options['batch_size']
+            ):
+                created += count
+                skipped += len(errors)
+                for number, reason in errors:
+                    self.stderr.write(f'Строка {number}: {reason}')
+                elapsed = time.monotonic() - started
+                self.stdout.write(
+                    f'Строка {line}: создано {created}, '
+                    f'пропущено {skipped}, '
+                    f'{created / max(elapsed, 1e-9):.0f} рецептов/с '
+                    f'(продолжить: --offset {line})'
+                )
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано {created} рецептов, пропущено {skipped} '
+            f'за {time.monotonic() - started:.1f} с'
+        ))
@@ -0,0 +1,42 @@
+import time
+from datetime import timedelta
+
+from django.core.management import BaseCommand
+from django.utils import timezone
+
+from api.analytics import WRITERS, active_carts, demand_rows
+
+
+class Command(BaseCommand):
+    """
+    Отчёт о спросе на ингредиенты по спискам покупок всех
+    активных пользователей с разбивкой по неделям и тегам.
+    """
+    help = 'Спрос на ингредиенты по спискам покупок'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default='-',
+                            help='Файл отчёта или - для stdout')
+        parser.add_argument('--format', choices=sorted(WRITERS),
+                            default='csv')
+        parser.add_argument('--weeks', type=int, default=0,
+                            help='Только последние N недель')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        since = None
+        if options['weeks']:
+            since = timezone.now() - timedelta(weeks=options['weeks'])
+        rows = demand_rows(active_carts(since))
+        write = WRITERS[options['format']]
+        if options['output'] == '-':
+            self.stdout.ending = ''
+            count = write(rows, self.stdout)
+        else:
+            with open(options['output'], 'w', encoding='utf-8',
+                      newline='') as output:
+                count = write(rows, output)
+        self.stderr.write(self.style.SUCCESS(
+            f'Строк отчёта: {count} '
+            f'за {time.monotonic() - started:.1f} с'
+        ))
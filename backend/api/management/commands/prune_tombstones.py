@@ -0,0 +1,18 @@
+from django.core.management import BaseCommand
+
+from api.sync import TOMBSTONE_RETENTION, prune_tombstones
+
+
+class Command(BaseCommand):
+    """
+    Удаление старых записей об удалениях. Клиенты с курсором
+    старше срока хранения получают 410 и загружают данные заново.
+    """
+    help = 'Удаление записей об удалениях старше срока хранения'
+
+    def handle(self, *args, **options):
+        count = prune_tombstones()
+        self.stdout.write(self.style.SUCCESS(
+            f'Удалено записей: {count} '
+            f'(старше {TOMBSTONE_RETENTION.days} дней)'
+        ))
@@ -0,0 +1,49 @@
+from django.core.management import BaseCommand, CommandError
+
+from api.purge import PURGE_BATCH_SIZE, purge_recipes, purge_user
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    """
+    Удаление скрытых рецептов и деактивированных пользователей
+    пачками, если фоновая задача не справилась. Пользователи
+    удаляются только явно по --user: деактивация сама по себе
+    не означает запроса на удаление.
+    """
+    help = 'Удаление ожидающих удаления рецептов и пользователей'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', action='store_true',
+                            help='Все скрытые рецепты')
+        parser.add_argument('--user', type=int, action='append',
+                            default=[], help='id деактивированного '
+                                             'пользователя')
+        parser.add_argument('--batch-size', type=int,
+                            default=PURGE_BATCH_SIZE)
+
+    def progress(self, deleted):
+        if not deleted:
+            return
+        self.stdout.write(', '.join(
+            f'{label}: {count}' for label, count in sorted(deleted.items())
+        ))
+
+    def handle(self, *args, **options):
+        if not options['recipes'] and not options['user']:
+            raise CommandError('Укажите --recipes или --user.')
+        batch_size = options['batch_size']
+        if options['recipes']:
+            recipe_ids = Recipe.all_objects.filter(
+                is_active=False
+            ).values_list('id', flat=True)
+            self.progress(purge_recipes(recipe_ids, batch_size,
+                                        self.progress))
+        for user_id in options['user']:
+            deleted = purge_user(user_id, batch_size, self.progress)
+            if not deleted:
+                raise CommandError(
+                    f'Пользователь {user_id} не найден или активен.'
+                )
+            self.progress(deleted)
+        self.stdout.write(self.style.SUCCESS('Удаление завершено'))
@@ -0,0 +1,18 @@
+from django.core.management import BaseCommand
+
+from api.similarity import rebuild_index
+from recipes.models import RecipeSignature
+
+
+class Command(BaseCommand):
+    """Перестройка MinHash/LSH-индекса похожих рецептов."""
+    help = 'Перестройка индекса похожих рецептов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        rebuild_index(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Проиндексировано рецептов: {RecipeSignature.objects.count()}'
+        ))
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management import BaseCommand
+from django.db import close_old_connections
+
+from api.scores import refresh_scores
+
+
+class Command(BaseCommand):
+    """
+    Пересчёт оценок популярности рецептов.
+    С --interval работает как фоновый процесс и повторяет
+    пересчёт каждые interval секунд.
+    """
+    help = 'Пересчёт популярных рецептов и популярных за неделю'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=int, default=0)
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+            count = refresh_scores()
+            self.stdout.write(self.style.SUCCESS(
+                f'Оценки пересчитаны: {count} рецептов с активностью '
+                f'за {time.monotonic() - started:.1f} с'
+            ))
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
+            close_old_connections()
@@ -0,0 +1,91 @@
+import hashlib
+from functools import wraps
+
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from rest_framework.permissions import SAFE_METHODS
+
+from .replicas import (
+    has_replicas,
+    is_pinned,
+    pin_to_primary,
+    start_replica_reads,
+    stop_replica_reads
+)
+
+
+def get_etag(source):
+    return quote_etag(hashlib.md5(source.encode()).hexdigest())
+
+
+def set_validators(response, etag, last_modified):
+    """Заголовки валидаторов для ответов 200 и 304."""
+    if response.status_code in (200, 304):
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        patch_vary_headers(response, ('Authorization',))
+    return response
+
+
+def conditional_get(handler):
+    """
+    Условный GET-запрос для обработчика вьюсета.
+    Валидаторы view.get_validators() вычисляются до выборки данных:
+    при совпадении If-None-Match/If-Modified-Since отдаётся 304
+    без основного запроса и сериализации.
+    """
+    @wraps(handler)
+    def wrapper(view, request, *args, **kwargs):
+        etag_source, last_modified = view.get_validators()
+        etag = get_etag(etag_source)
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is None:
+            response = handler(view, request, *args, **kwargs)
+        return set_validators(response, etag, last_modified)
+    return wrapper
+
+
+class ConditionalGetMixin:
+    """
+    Условные GET-запросы для list и retrieve.
+    Вьюсет определяет get_validators(), возвращающий пару
+    (строка-источник ETag, время изменения в секундах или None).
+    """
+
+    def get_validators(self):
+        raise NotImplementedError
+
+    @conditional_get
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @conditional_get
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+
+class ReplicaReadMixin:
+    """
+    Безопасные запросы читают из реплики. Запрос с записью
+    закрепляет пользователя за основной базой на REPLICA_STICKY_SECONDS,
+    чтобы он сразу видел свои изменения. Реплика включается после
+    аутентификации, поэтому токен читается из основной базы.
+    """
+    _replica_token = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if (request.method in SAFE_METHODS and has_replicas()
+                and not is_pinned(request.user)):
+            self._replica_token = start_replica_reads()
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        stop_replica_reads(self._replica_token)
+        self._replica_token = None
+        if (request.method not in SAFE_METHODS and has_replicas()
+                and request.user.is_authenticated):
+            pin_to_primary(request.user)
+        return super().finalize_response(request, response, *args, **kwargs)
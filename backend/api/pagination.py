@@ -0,0 +1,46 @@
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+from .sync import decode_cursor, encode_cursor
+
+
+class FeedPagination(BasePagination):
+    """
+    Keyset-пагинация ленты подписок по (pub_date, id рецепта)
+    в порядке убывания: cursor - позиция последнего рецепта страницы.
+    Строки страницы выбирает функция fetch(position, limit),
+    которая передаётся вместо queryset.
+    """
+    cursor_query_param = 'cursor'
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'limit'
+    max_page_size = 100
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def paginate_queryset(self, fetch, request, view=None):
+        self.request = request
+        cursor = request.query_params.get(self.cursor_query_param)
+        position = decode_cursor(cursor) if cursor else None
+        limit = self.get_page_size(request)
+        rows = fetch(position, limit)
+        self.next_position = rows[limit - 1] if len(rows) > limit else None
+        return [recipe_id for _, recipe_id in rows[:limit]]
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(), self.cursor_query_param,
+            encode_cursor(*self.next_position)
+        )
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
@@ -0,0 +1,299 @@
+import threading
+from array import array
+from collections import defaultdict
+from datetime import timedelta
+
+from django.utils import timezone
+
+from recipes.models import Recipe, RecipeIngredient, RecipeTag, Tombstone
+from recipes.versions import RECIPES, get_version
+from .replicas import use_primary
+from .sync import TOMBSTONE_RETENTION
+
+SYNC_MARGIN = timedelta(minutes=1)
+COMPACT_RATIO = 2
+
+
+def bitset(positions, size):
+    """Битовое множество позиций - целое число Python."""
+    data = bytearray((size + 7) // 8)
+    for position in positions:
+        data[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(data, 'little')
+
+
+def iter_positions(bits):
+    """Позиции установленных битов по возрастанию."""
+    data = bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+    for index, byte in enumerate(data):
+        while byte:
+            low = byte & -byte
+            yield index * 8 + low.bit_length() - 1
+            byte ^= low
+
+
+def popcount(bits):
+    return bin(bits).count('1')
+
+
+def _add(counter, bits):
+    """Прибавление единицы по позициям bits к битово-срезовому счётчику."""
+    carry = bits
+    for level, plane in enumerate(counter):
+        counter[level] = plane ^ carry
+        carry &= plane
+        if not carry:
+            return
+    if carry:
+        counter.append(carry)
+
+
+def _equal(counter, value, mask):
+    """Позиции из mask, где счётчик равен value."""
+    if value >> len(counter):
+        return 0
+    for level, plane in enumerate(counter):
+        mask &= plane if value >> level & 1 else ~plane
+        if not mask:
+            break
+    return mask
+
+
+class PantryIndex:
+    """
+    Инвертированный индекс рецептов по ингредиентам.
+    Каждому рецепту выделяется позиция; для ингредиентов, тегов
+    и числа ингредиентов рецепта хранятся битовые множества позиций,
+    для позиций - компактный массив id рецептов.
+    Изменённый рецепт получает новую позицию, старая гасится в alive.
+    """
+
+    def __init__(self, version=None, synced_at=None):
+        self.version = version
+        self.synced_at = synced_at
+        self.recipe_ids = array('q')
+        self.positions = {}
+        self.ingredients = defaultdict(int)
+        self.tags = defaultdict(int)
+        self.sizes = defaultdict(int)
+        self.alive = 0
+
+    @classmethod
+    def from_rows(cls, rows, version=None, synced_at=None):
+        """
+        Построение индекса из строк (recipe_id, id ингредиентов, id тегов):
+        битовые множества собираются один раз, без поразрядных добавлений.
+        """
+        index = cls(version, synced_at)
+        ingredients = defaultdict(list)
+        tags = defaultdict(list)
+        sizes = defaultdict(list)
+        for position, (recipe_id, ingredient_ids, tag_ids) in enumerate(
+            rows
+        ):
+            ingredient_ids = set(ingredient_ids)
+            index.recipe_ids.append(recipe_id)
+            index.positions[recipe_id] = position
+            for ingredient_id in ingredient_ids:
+                ingredients[ingredient_id].append(position)
+            for tag_id in set(tag_ids):
+                tags[tag_id].append(position)
+            sizes[len(ingredient_ids)].append(position)
+        size = len(index.recipe_ids)
+        for target, source in ((index.ingredients, ingredients),
+                               (index.tags, tags),
+                               (index.sizes, sizes)):
+            for key, positions in source.items():
+                target[key] = bitset(positions, size)
+        index.alive = (1 << size) - 1
+        return index
+
+    def copy(self):
+        index = PantryIndex(self.version, self.synced_at)
+        index.recipe_ids = array('q', self.recipe_ids)
+        index.positions = dict(self.positions)
+        index.ingredients = self.ingredients.copy()
+        index.tags = self.tags.copy()
+        index.sizes = self.sizes.copy()
+        index.alive = self.alive
+        return index
+
+    def add(self, recipe_id, ingredient_ids, tag_ids):
+        self.remove(recipe_id)
+        ingredient_ids = set(ingredient_ids)
+        position = len(self.recipe_ids)
+        bit = 1 << position
+        self.recipe_ids.append(recipe_id)
+        self.positions[recipe_id] = position
+        for ingredient_id in ingredient_ids:
+            self.ingredients[ingredient_id] |= bit
+        for tag_id in set(tag_ids):
+            self.tags[tag_id] |= bit
+        self.sizes[len(ingredient_ids)] |= bit
+        self.alive |= bit
+
+    def remove(self, recipe_id):
+        position = self.positions.pop(recipe_id, None)
+        if position is not None:
+            self.alive &= ~(1 << position)
+
+    @property
+    def sparse(self):
+        """Погашенных позиций больше, чем живых: пора перестроить."""
+        return len(self.recipe_ids) > COMPACT_RATIO * len(self.positions)
+
+    def search(self, ingredient_ids, max_missing=0, tag_ids=None):
+        """
+        Рецепты, которым недостаёт не более max_missing ингредиентов
+        из ingredient_ids и есть хотя бы один из них.
+        Совпадения считаются битово-срезовым счётчиком по множествам
+        ингредиентов, затем сравниваются с числом ингредиентов рецепта.
+        tag_ids ограничивает рецепты любым из тегов.
+        """
+        candidates = 0
+        counter = []
+        for ingredient_id in set(ingredient_ids):
+            bits = self.ingredients.get(ingredient_id, 0)
+            if bits:
+                candidates |= bits
+                _add(counter, bits)
+        candidates &= self.alive
+        if tag_ids is not None:
+            tagged = 0
+            for tag_id in tag_ids:
+                tagged |= self.tags.get(tag_id, 0)
+            candidates &= tagged
+        levels = []
+        for missing in range(max_missing + 1):
+            level = 0
+            for size, bits in self.sizes.items():
+                if size - missing > 0 and candidates & bits:
+                    level |= _equal(counter, size - missing,
+                                    candidates & bits)
+            levels.append(level)
+        return PantryMatches(self.recipe_ids, levels)
+
+
+class PantryMatches:
+    """
+    Результат поиска: рецепты по возрастанию числа недостающих
+    ингредиентов, внутри группы - новые первыми.
+    Поддерживает len() и срезы, поэтому пагинируется как queryset;
+    распаковываются только группы, попавшие в срез.
+    """
+
+    def __init__(self, recipe_ids, levels):
+        self.recipe_ids = recipe_ids
+        self.levels = levels
+        self.counts = [popcount(level) for level in levels]
+
+    def __len__(self):
+        return sum(self.counts)
+
+    def __getitem__(self, key):
+        start, stop, _ = key.indices(len(self))
+        result = []
+        offset = 0
+        for missing, (level, count) in enumerate(zip(self.levels,
+                                                     self.counts)):
+            if offset < stop and offset + count > start:
+                ids = sorted((self.recipe_ids[position]
+                              for position in iter_positions(level)),
+                             reverse=True)
+                result.extend(
+                    (recipe_id, missing) for recipe_id in
+                    ids[max(start - offset, 0):stop - offset]
+                )
+            offset += count
+        return result
+
+
+def load_rows(recipe_ids=None):
+    """Строки индекса из базы: два запроса на все рецепты или recipe_ids."""
+    recipes = Recipe.objects.order_by('id')
+    ingredients = RecipeIngredient.objects.order_by()
+    tags = RecipeTag.objects.order_by()
+    if recipe_ids is not None:
+        recipes = recipes.filter(id__in=recipe_ids)
+        ingredients = ingredients.filter(recipe_id__in=recipe_ids)
+        tags = tags.filter(recipe_id__in=recipe_ids)
+    recipe_ingredients = defaultdict(list)
+    for recipe_id, ingredient_id in ingredients.values_list(
+        'recipe_id', 'ingredient_id'
+    ).iterator():
+        recipe_ingredients[recipe_id].append(ingredient_id)
+    recipe_tags = defaultdict(list)
+    for recipe_id, tag_id in tags.values_list('recipe_id', 'tag_id'):
+        recipe_tags[recipe_id].append(tag_id)
+    return [
+        (recipe_id, recipe_ingredients[recipe_id], recipe_tags[recipe_id])
+        for recipe_id in recipes.values_list('id', flat=True).iterator()
+    ]
+
+
+def build_index(version):
+    synced_at = timezone.now()
+    return PantryIndex.from_rows(load_rows(), version, synced_at)
+
+
+def sync_index(index, version):
+    """
+    Досинхронизация копии индекса: переиндексируются рецепты
+    с updated_at позже прошлой синхронизации (с запасом SYNC_MARGIN
+    на долгие транзакции), скрытые и удалённые за это время рецепты
+    по записям Tombstone убираются. Если копия старше срока хранения
+    записей об удалениях, возвращает None.
+    """
+    synced_at = timezone.now()
+    since = index.synced_at - SYNC_MARGIN
+    if since < synced_at - TOMBSTONE_RETENTION:
+        return None
+    changed = list(Recipe.all_objects.filter(
+        updated_at__gte=since
+    ).values_list('id', flat=True))
+    deleted = Tombstone.objects.filter(
+        kind=Tombstone.RECIPE, deleted_at__gte=since
+    ).values_list('object_id', flat=True)
+    index = index.copy()
+    for recipe_id in {*changed, *deleted}:
+        index.remove(recipe_id)
+    for row in load_rows(changed):
+        index.add(*row)
+    index.version, index.synced_at = version, synced_at
+    return index
+
+
+_index = None
+_lock = threading.Lock()
+
+
+def get_index():
+    """
+    Индекс текущего процесса. Версия RECIPES меняется после коммита
+    любых изменений рецептов, их ингредиентов и тегов; при расхождении
+    индекс досинхронизируется или перестраивается целиком
+    по основной базе: отставшая реплика закрепила бы старые данные
+    под новой версией.
+    """
+    global _index
+    version = get_version(RECIPES)
+    index = _index
+    if index is not None and index.version == version:
+        return index
+    with _lock:
+        index = _index
+        if index is not None and index.version == version:
+            return index
+        with use_primary():
+            if index is not None and not index.sparse:
+                index = sync_index(index, version)
+            if index is None or index.sparse:
+                index = build_index(version)
+        _index = index
+    return index
+
+
+def reset_index():
+    global _index
+    with _lock:
+        _index = None
@@ -0,0 +1,188 @@
+import logging
+from collections import Counter
+
+from django.core.cache import cache
+from django.db import IntegrityError, models, transaction
+from django.utils import timezone
+
+from recipes.models import Recipe, RecipeBand, RecipeSignature, Tombstone
+from recipes.versions import RECIPES, bump_version
+from users.models import User
+from .cache import (
+    USER_SET_MODELS,
+    invalidate_recipe_fragments,
+    invalidate_user_sets
+)
+
+logger = logging.getLogger(__name__)
+
+PURGE_BATCH_SIZE = 1000
+PURGE_RETRIES = 3
+PURGE_KEY = 'purge:{}:{}'
+PURGE_TIMEOUT = 60 * 60 * 24
+RECIPES_PURGE = 'recipes'
+USER_PURGE = 'user'
+PURGE_KINDS = (RECIPES_PURGE, USER_PURGE)
+
+
+def deactivate_recipes(recipe_ids):
+    """
+    Скрытие рецептов до фонового удаления: один UPDATE is_active,
+    записи об удалении для синхронизации клиентов, удаление из индекса
+    похожих рецептов и сброс фрагментов. Возвращает id скрытых рецептов.
+    """
+    recipe_ids = list(Recipe.objects.filter(
+        pk__in=recipe_ids
+    ).values_list('id', flat=True))
+    if not recipe_ids:
+        return recipe_ids
+    with transaction.atomic():
+        Recipe.objects.filter(pk__in=recipe_ids).update(
+            is_active=False, updated_at=timezone.now()
+        )
+        Tombstone.objects.bulk_create(
+            Tombstone(kind=Tombstone.RECIPE, object_id=recipe_id)
+            for recipe_id in recipe_ids
+        )
+        RecipeSignature.objects.filter(recipe_id__in=recipe_ids).delete()
+        RecipeBand.objects.filter(recipe_id__in=recipe_ids).delete()
+        transaction.on_commit(lambda: bump_version(RECIPES))
+    invalidate_recipe_fragments(recipe_ids)
+    return recipe_ids
+
+
+def deactivate_user(user):
+    """
+    Деактивация пользователя до фонового удаления: вход
+    по его токенам и его рецепты пропадают сразу.
+    """
+    with transaction.atomic():
+        user.is_active = False
+        user.save(update_fields=('is_active',))
+        deactivate_recipes(user.recipes.values_list('id', flat=True))
+
+
+def _delete_rows(model, queryset, batch_size, deleted, progress):
+    """
+    Удаление строк queryset пачками по batch_size без сборщика ORM:
+    сначала зависимые строки (CASCADE) каждой пачки, затем сама пачка
+    одним DELETE. Каждый DELETE - отдельная короткая транзакция.
+    Если в пачку успела добавиться зависимая строка, пачка
+    повторяется не больше PURGE_RETRIES раз. Удаление строк
+    избранного, корзины и подписок сбрасывает множества их владельцев.
+    """
+    retries = 0
+    while True:
+        pks = list(queryset.values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return
+        _delete_dependents(model, pks, batch_size, deleted, progress)
+        rows = model._base_manager.filter(pk__in=pks)
+        user_ids = ()
+        if model in USER_SET_MODELS:
+            user_ids = set(rows.values_list('user_id', flat=True))
+        try:
+            with transaction.atomic():
+                count = rows._raw_delete(queryset.db)
+        except IntegrityError:
+            retries += 1
+            if retries > PURGE_RETRIES:
+                raise
+            continue
+        invalidate_user_sets(user_ids, (USER_SET_MODELS.get(model),))
+        deleted[model._meta.label] += count
+        if progress is not None:
+            progress(deleted)
+
+
+def _delete_dependents(model, pks, batch_size, deleted, progress):
+    for relation in model._meta.related_objects:
+        if relation.many_to_many or relation.on_delete is not models.CASCADE:
+            continue
+        related = relation.related_model
+        _delete_rows(related, related._base_manager.filter(
+            **{f'{relation.field.name}__in': pks}
+        ), batch_size, deleted, progress)
+
+
+def purge_recipes(recipe_ids, batch_size=PURGE_BATCH_SIZE, progress=None):
+    """
+    Фоновое удаление скрытых рецептов и всех зависимых строк
+    пачками. Возвращает число удалённых строк по моделям.
+    """
+    deleted = Counter()
+    _delete_rows(Recipe, Recipe.all_objects.filter(
+        pk__in=recipe_ids, is_active=False
+    ), batch_size, deleted, progress)
+    bump_version(RECIPES)
+    return deleted
+
+
+def purge_user(user_id, batch_size=PURGE_BATCH_SIZE, progress=None):
+    """
+    Фоновое удаление деактивированного пользователя: рецепты,
+    подписки, избранное и остальные зависимые строки удаляются
+    пачками, оставшиеся мелкие связи - обычным delete().
+    """
+    deleted = Counter()
+    user = User.objects.filter(pk=user_id, is_active=False).first()
+    if user is None:
+        return deleted
+    _delete_dependents(User, [user.pk], batch_size, deleted, progress)
+    _, counts = user.delete()
+    deleted.update(counts)
+    bump_version(RECIPES)
+    return deleted
+
+
+def mark_queued(kind, object_ids):
+    """
+    Удаление поставлено в очередь. Ход удаления хранится
+    под первым из object_ids, остальные объекты ссылаются на него.
+    """
+    object_id, *others = object_ids
+    cache.set_many({
+        PURGE_KEY.format(kind, object_id): {'deleted': {},
+                                            'finished': False},
+        **{PURGE_KEY.format(kind, other): {'batch': object_id}
+           for other in others},
+    }, PURGE_TIMEOUT)
+
+
+def report_progress(kind, object_id):
+    """
+    Функция отчёта о ходе удаления: число удалённых строк
+    по моделям пишется в лог и в кэш (get_progress).
+    """
+    key = PURGE_KEY.format(kind, object_id)
+
+    def progress(deleted, finished=False):
+        cache.set(key, {'deleted': dict(deleted), 'finished': finished},
+                  PURGE_TIMEOUT)
+        logger.info('Удаление %s %s: %s%s', kind, object_id, dict(deleted),
+                    ' - завершено' if finished else '')
+    return progress
+
+
+def get_progress(kind, object_id):
+    """
+    Ход удаления: {'deleted': {модель: строк}, 'finished': bool};
+    None, если удаление не запрашивалось.
+    """
+    progress = cache.get(PURGE_KEY.format(kind, object_id))
+    if progress is not None and 'batch' in progress:
+        progress = cache.get(PURGE_KEY.format(kind, progress['batch']))
+    return progress
+
+
+def format_progress(kind, object_id):
+    """Ход удаления одной строкой для админки."""
+    progress = get_progress(kind, object_id)
+    if progress is None:
+        return None
+    deleted = sum(progress['deleted'].values())
+    if progress['finished']:
+        return f'удалено, строк: {deleted}'
+    if not deleted:
+        return 'в очереди'
+    return f'удаляется, строк: {deleted}'
@@ -0,0 +1,90 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+PRIMARY_KEY = 'db:primary:{}'
+STICKY_SECONDS = 5
+
+_replica = ContextVar('replica', default=None)
+
+
+class ReplicaRouter:
+    """
+    Чтение из реплики, если оно разрешено в текущем контексте
+    (read_from_replica) и нет открытой транзакции на основной базе.
+    Запись, миграции и всё остальное - только основная база.
+    """
+
+    def db_for_read(self, model, **hints):
+        alias = _replica.get()
+        if alias is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+def has_replicas():
+    return bool(getattr(settings, 'DATABASE_REPLICAS', ()))
+
+
+def start_replica_reads():
+    """
+    Направление чтений текущего контекста в случайную реплику
+    из DATABASE_REPLICAS. Возвращает токен для stop_replica_reads
+    или None, если реплик нет.
+    """
+    if not has_replicas():
+        return None
+    return _replica.set(random.choice(settings.DATABASE_REPLICAS))
+
+
+def stop_replica_reads(token):
+    """
+    Возврат к прежнему выбору базы. Значение восстанавливается
+    по токену, а не через reset: в асинхронных представлениях
+    начало и конец запроса выполняются в разных копиях контекста.
+    """
+    if token is not None:
+        _replica.set(None if token.old_value is token.MISSING
+                     else token.old_value)
+
+
+@contextmanager
+def use_primary():
+    """
+    Чтение из основной базы внутри блока. Нужно там, где прочитанное
+    кладётся в долгоживущий кэш: отставшая реплика вернула бы туда
+    данные, уже сброшенные после коммита.
+    """
+    token = _replica.set(None)
+    try:
+        yield
+    finally:
+        _replica.reset(token)
+
+
+def _sticky_seconds():
+    return getattr(settings, 'REPLICA_STICKY_SECONDS', STICKY_SECONDS)
+
+
+def pin_to_primary(user):
+    """После записи пользователь читает из основной базы."""
+    cache.set(PRIMARY_KEY.format(user.id), True, _sticky_seconds())
+
+
+def is_pinned(user):
+    return user.is_authenticated and bool(
+        cache.get(PRIMARY_KEY.format(user.id))
+    )
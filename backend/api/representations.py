@@ -0,0 +1,177 @@
+from collections import defaultdict
+
+from django.db.models import Count, F, Q, Window
+from django.db.models.functions import RowNumber
+
+from recipes.models import Recipe, RecipeIngredient, RecipeTag
+from users.models import User
+
+USER_FIELDS = ('email', 'id', 'username', 'first_name', 'last_name')
+RECIPE_FIELDS = ('id', 'tags', 'author', 'ingredients',
+                 'is_favorited', 'is_in_shopping_cart',
+                 'name', 'image', 'text', 'cooking_time')
+RECIPE_DETAIL_FIELDS = RECIPE_FIELDS + ('views',)
+SHORT_RECIPE_FIELDS = ('name', 'image', 'author', 'cooking_time')
+RECIPE_COLUMNS = ('name', 'image', 'text', 'cooking_time')
+USER_FLAG_FIELDS = frozenset(('author', 'is_favorited',
+                              'is_in_shopping_cart'))
+SYNC_RECIPE_FIELDS = tuple(
+    name for name in RECIPE_FIELDS
+    if name not in ('is_favorited', 'is_in_shopping_cart')
+)
+SUBSCRIPTION_FIELDS = USER_FIELDS + ('is_subscribed', 'recipes_count',
+                                     'recipes')
+
+image_storage = Recipe._meta.get_field('image').storage
+
+
+def image_url(name):
+    """Относительная ссылка на изображение, как у Base64ImageField."""
+    return image_storage.url(name) if name else None
+
+
+def get_authors(author_ids):
+    """Авторы без флага подписки: {id: словарь}."""
+    return {
+        author['id']: {**author, 'is_subscribed': False}
+        for author in User.objects.filter(
+            id__in=author_ids
+        ).order_by().values(*USER_FIELDS)
+    }
+
+
+def get_recipe_tags(recipe_ids):
+    """Теги рецептов в порядке Tag.Meta.ordering: {recipe_id: [...]}."""
+    tags = defaultdict(list)
+    rows = RecipeTag.objects.filter(recipe_id__in=recipe_ids).order_by(
+        'tag__name'
+    ).values_list('recipe_id', 'tag__id', 'tag__name', 'tag__color',
+                  'tag__slug')
+    for recipe_id, tag_id, name, color, slug in rows:
+        tags[recipe_id].append(
+            {'id': tag_id, 'name': name, 'color': color, 'slug': slug}
+        )
+    return tags
+
+
+def get_recipe_ingredients(recipe_ids):
+    """Ингредиенты рецептов в порядке добавления: {recipe_id: [...]}."""
+    ingredients = defaultdict(list)
+    rows = RecipeIngredient.objects.filter(
+        recipe_id__in=recipe_ids
+    ).order_by('pk').values_list('recipe_id', 'ingredient__id',
+                                 'ingredient__name', 'ingredient__unit',
+                                 'amount')
+    for recipe_id, ingredient_id, name, unit, amount in rows:
+        ingredients[recipe_id].append(
+            {'id': ingredient_id, 'name': name, 'unit': unit,
+             'amount': amount}
+        )
+    return ingredients
+
+
+def build_recipes(recipe_ids, fields=RECIPE_FIELDS):
+    """
+    Представления рецептов без сериализаторов DRF: строки .values()
+    собираются в словари, совпадающие с выводом RecipeSerializer
+    без запроса (флаги False, изображение - относительная ссылка).
+    Выбираются только колонки и связи, нужные для полей fields.
+    Возвращает {recipe_id: словарь}.
+    """
+    columns = ['id'] + [name for name in RECIPE_COLUMNS if name in fields]
+    if 'author' in fields:
+        columns.append('author_id')
+    rows = list(Recipe.objects.filter(id__in=recipe_ids).order_by().values(
+        *columns
+    ))
+    if not rows:
+        return {}
+    recipe_ids = [row['id'] for row in rows]
+    authors = get_authors(
+        {row['author_id'] for row in rows}
+    ) if 'author' in fields else {}
+    tags = get_recipe_tags(recipe_ids) if 'tags' in fields else {}
+    ingredients = get_recipe_ingredients(
+        recipe_ids
+    ) if 'ingredients' in fields else {}
+    recipes = {}
+    for row in rows:
+        recipe = {
+            'id': row['id'],
+            'tags': tags.get(row['id'], []),
+            'author': authors.get(row.get('author_id')),
+            'ingredients': ingredients.get(row['id'], []),
+            'is_favorited': False,
+            'is_in_shopping_cart': False,
+            'name': row.get('name'),
+            'image': image_url(row.get('image')),
+            'text': row.get('text'),
+            'cooking_time': row.get('cooking_time'),
+        }
+        if fields is not RECIPE_FIELDS:
+            recipe = {name: recipe[name] for name in fields}
+        recipes[row['id']] = recipe
+    return recipes
+
+
+def build_subscriptions(request, author_ids, following,
+                        fields=SUBSCRIPTION_FIELDS):
+    """
+    Представления подписок как у SubscriptionsSerializer
+    в порядке author_ids; following - id авторов в подписках.
+    Рецепты каждого автора ограничиваются параметром recipes_limit
+    оконной функцией в одном запросе. Рецепты и их количество
+    выбираются, только если входят в fields.
+    """
+    author_ids = list(author_ids)
+    authors = User.objects.filter(id__in=author_ids).order_by()
+    columns = [name for name in USER_FIELDS
+               if name in fields and name != 'id']
+    if 'recipes_count' in fields:
+        authors = authors.annotate(recipes_count=Count(
+            'recipes', filter=Q(recipes__is_active=True)
+        ))
+        columns.append('recipes_count')
+    authors = {
+        author['id']: author for author in authors.values('id', *columns)
+    }
+    author_recipes = defaultdict(list)
+    if 'recipes' in fields:
+        author_recipes = get_author_recipes(request, author_ids)
+    data = []
+    for author_id in author_ids:
+        author = authors[author_id]
+        subscription = {
+            **author,
+            'is_subscribed': author_id in following,
+            'recipes_count': author.get('recipes_count'),
+            'recipes': author_recipes.get(author_id, []),
+        }
+        data.append({name: subscription[name] for name in fields})
+    return data
+
+
+def get_author_recipes(request, author_ids):
+    """Краткие представления рецептов авторов: {author_id: [...]}."""
+    limit = request.query_params.get('recipes_limit')
+    recipes = Recipe.objects.filter(author_id__in=author_ids).annotate(
+        row_number=Window(
+            RowNumber(),
+            partition_by=F('author_id'),
+            order_by=F('pub_date').desc(),
+        )
+    )
+    if limit:
+        recipes = recipes.filter(row_number__lte=int(limit))
+    author_recipes = defaultdict(list)
+    for recipe in recipes.order_by('author_id', 'row_number').values(
+        'name', 'image', 'author_id', 'cooking_time'
+    ):
+        author_recipes[recipe['author_id']].append({
+            'name': recipe['name'],
+            'image': request.build_absolute_uri(image_url(recipe['image']))
+            if recipe['image'] else None,
+            'author': recipe['author_id'],
+            'cooking_time': recipe['cooking_time'],
+        })
+    return author_recipes
@@ -0,0 +1,101 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from recipes.models import (
+    FavoriteRecipe,
+    Recipe,
+    RecipeScore,
+    RecipeShoppingList
+)
+from recipes.versions import SCORES, bump_version
+
+POPULAR = 'popular'
+TRENDING = 'trending'
+TRENDING_WINDOW = timedelta(days=7)
+TRENDING_HALF_LIFE = timedelta(days=2)
+SCORE_SOURCES = (
+    (FavoriteRecipe, 2.0),
+    (RecipeShoppingList, 1.0),
+)
+VIEW_WEIGHT = 0.05
+SCORE_BATCH_SIZE = 1000
+
+
+def compute_scores(now):
+    """
+    Оценки рецептов с активностью: {recipe_id: [popular, trending]}.
+    popular - взвешенное число добавлений в избранное и списки покупок
+    и просмотров,
+    trending - сумма весов добавлений за TRENDING_WINDOW,
+    затухающих вдвое за TRENDING_HALF_LIFE.
+    """
+    scores = defaultdict(lambda: [0.0, 0.0])
+    since = now - TRENDING_WINDOW
+    views = Recipe.objects.filter(views__gt=0).values_list('id', 'views')
+    for recipe_id, count in views.iterator():
+        scores[recipe_id][0] += VIEW_WEIGHT * count
+    for model, weight in SCORE_SOURCES:
+        counts = model.objects.order_by().values('recipe_id').annotate(
+            count=Count('id')
+        ).values_list('recipe_id', 'count')
+        for recipe_id, count in counts:
+            scores[recipe_id][0] += weight * count
+        recent = model.objects.filter(created__gte=since).order_by(
+        ).values_list('recipe_id', 'created')
+        for recipe_id, created in recent.iterator():
+            scores[recipe_id][1] += weight * 0.5 ** (
+                (now - created) / TRENDING_HALF_LIFE
+            )
+    return scores
+
+
+def refresh_scores(now=None):
+    """
+    Пересчёт таблицы оценок: upsert рецептов с активностью,
+    обнуление остальных изменившихся и добавление строк
+    рецептам без оценки, чтобы сортировка шла по индексу.
+    Возвращает число рецептов с ненулевой оценкой.
+    """
+    now = now or timezone.now()
+    scores = compute_scores(now)
+    recipe_ids = sorted(scores)
+    with transaction.atomic():
+        for start in range(0, len(recipe_ids), SCORE_BATCH_SIZE):
+            batch = Recipe.objects.filter(
+                id__in=recipe_ids[start:start + SCORE_BATCH_SIZE]
+            ).values_list('id', flat=True)
+            RecipeScore.objects.bulk_create(
+                (RecipeScore(recipe_id=recipe_id,
+                             popular=scores[recipe_id][0],
+                             trending=scores[recipe_id][1],
+                             refreshed_at=now)
+                 for recipe_id in batch),
+                update_conflicts=True,
+                unique_fields=('recipe',),
+                update_fields=('popular', 'trending', 'refreshed_at'),
+            )
+        RecipeScore.objects.filter(refreshed_at__lt=now).exclude(
+            popular=0, trending=0
+        ).update(popular=0, trending=0, refreshed_at=now)
+        unscored = Recipe.objects.filter(score__isnull=True).values_list(
+            'id', flat=True
+        )
+        RecipeScore.objects.bulk_create(
+            (RecipeScore(recipe_id=recipe_id, refreshed_at=now)
+             for recipe_id in unscored.iterator()),
+            batch_size=SCORE_BATCH_SIZE,
+            ignore_conflicts=True,
+        )
+    transaction.on_commit(lambda: bump_version(SCORES))
+    return len(scores)
+
+
+def create_score(recipe):
+    """Нулевая оценка нового рецепта до следующего пересчёта."""
+    RecipeScore.objects.get_or_create(
+        recipe=recipe, defaults={'refreshed_at': timezone.now()}
+    )
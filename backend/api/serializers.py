@@ -1,3 +1,5 @@
+from decimal import Decimal
+
 from django.db import transaction
 from drf_base64.fields import Base64ImageField
 from djoser.serializers import UserCreateSerializer, UserSerializer
@@ -6,14 +8,19 @@ from rest_framework.exceptions import ValidationError
 from rest_framework.validators import UniqueTogetherValidator
 
 from recipes.models import (
-    FavoriteRecipe,
     Ingredient,
     Recipe,
     RecipeIngredient,
-    RecipeShoppingList,
     Tag
 )
+from tasks.queue import enqueue
 from users.models import Follow, User
+from .cache import FAVORITES, FOLLOWING, SHOPPING_CART, get_user_sets
+from .tasks import index_similarity, warm_recipe_fragments
+
+PLAN_RECIPES_LIMIT = 100
+MAX_ID = 2 ** 63 - 1
+SHOPPING_LIST_FORMATS = ('json', 'txt')
 
 
 class CustomUserCreateSerializer(UserCreateSerializer):
@@ -52,14 +59,14 @@ class CustomUserSerializer(UserSerializer):
         request = self.context.get('request')
         if not request or request.user.is_anonymous:
             return False
-        return obj.following.filter(user=request.user).exists()
+        return obj.id in get_user_sets(request)[FOLLOWING]
 
 
 class TagSerializer(serializers.ModelSerializer):
     """Сериализатор для работы с моделью тегов."""
     class Meta:
         model = Tag
-        fields = ('__all__')
+        fields = ('id', 'name', 'color', 'slug')
         read_only_fields = (fields,)
 
 
@@ -68,7 +75,7 @@ class IngredientSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Ingredient
-        fields = ('__all__')
+        fields = ('id', 'name', 'unit')
         read_only_fields = (fields,)
 
 
@@ -132,16 +139,14 @@ class RecipeSerializer(serializers.ModelSerializer):
         request = self.context.get('request')
         if not request or request.user.is_anonymous:
             return False
-        return FavoriteRecipe.objects.filter(
-            recipe=obj, user=request.user).exists()
+        return obj.id in get_user_sets(request)[FAVORITES]
 
     def get_is_in_shopping_cart(self, obj):
         """Проверка на наличие рецепта в списке покупок."""
         request = self.context.get('request')
         if not request or request.user.is_anonymous:
             return False
-        return RecipeShoppingList.objects.filter(
-            recipe=obj, user=request.user).exists()
+        return obj.id in get_user_sets(request)[SHOPPING_CART]
 
 
 class IngredientAddRecipeSerializer(serializers.ModelSerializer):
@@ -195,6 +200,14 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
             ) for ingredient in ingredients
         )
 
+    def _enqueue_tasks(self, recipe):
+        """
+        Фоновые задачи после коммита: обновление индекса
+        похожих рецептов и прогрев кэша фрагмента.
+        """
+        enqueue(index_similarity, recipe.id)
+        enqueue(warm_recipe_fragments, [recipe.id])
+
     @transaction.atomic
     def create(self, validated_data):
         """"Добавление рецепта."""
@@ -206,17 +219,25 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
                                        **validated_data)
         recipe.tags.set(tags)
         self._add_ingredients(recipe, ingredients)
+        self._enqueue_tasks(recipe)
         return recipe
 
     @transaction.atomic
     def update(self, recipe, validated_data):
-        """"Обновление рецепта."""
+        """
+        Обновление рецепта. Сохраняются только изменённые поля,
+        чтобы не затереть накопленные счётчики просмотров.
+        """
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
         RecipeIngredient.objects.filter(recipe=recipe).delete()
         recipe.tags.set(tags)
         self._add_ingredients(recipe, ingredients)
-        return super().update(recipe, validated_data)
+        for name, value in validated_data.items():
+            setattr(recipe, name, value)
+        recipe.save(update_fields=(*validated_data, 'updated_at'))
+        self._enqueue_tasks(recipe)
+        return recipe
 
     def to_representation(self, recipe):
         """
@@ -250,15 +271,15 @@ class SubscriptionsSerializer(CustomUserSerializer):
         limit = request.query_params.get('recipes_limit')
         context = {'request': request}
         if limit:
-            recipes = obj.recipes.all()[:(int(limit))]
+            recipes = obj.recipes.filter(is_active=True)[:(int(limit))]
         else:
-            recipes = obj.recipes.all()
+            recipes = obj.recipes.filter(is_active=True)
         return RecipeShortSerializer(recipes, many=True,
                                      context=context).data
 
     def get_recipes_count(self, obj):
         """Количество рецептов пользователя."""
-        return obj.recipes.count()
+        return obj.recipes.filter(is_active=True).count()
 
 
 class FollowSerializer(serializers.ModelSerializer):
@@ -292,69 +313,26 @@ class FollowSerializer(serializers.ModelSerializer):
         ]
 
 
-class FavoriteRecipeSerializer(serializers.ModelSerializer):
-    """
-    Сериализатор для работы с моделью рецепта
-    в списке избранного.
-    """
-    user = serializers.PrimaryKeyRelatedField(
-        queryset=User.objects.all(),
-        write_only=True
-    )
-    recipe = serializers.PrimaryKeyRelatedField(
-        queryset=Recipe.objects.all(),
-        write_only=True
+class PortionSerializer(serializers.Serializer):
+    """Рецепт и множитель порций для списка покупок."""
+    id = serializers.IntegerField(min_value=1, max_value=MAX_ID)
+    portions = serializers.DecimalField(
+        max_digits=6, decimal_places=2,
+        min_value=Decimal('0.01'), default=Decimal(1)
     )
 
-    class Meta:
-        model = FavoriteRecipe
-        fields = ('user', 'recipe')
 
-    def validate(self, data):
-        """Валидация при добавлении рецепта в избранное."""
-        user, recipe = data['user'], data['recipe']
-        if FavoriteRecipe.objects.filter(user=user,
-                                         recipe=recipe).exists():
-            raise ValidationError(
-                'Рецепт уже добавлен в избранное!'
-            )
-        return data
-
-    def to_representation(self, instance):
-        """Отображение добавленного в избранное рецепта."""
-        request = self.context.get('request')
-        context = {'request': request}
-        return RecipeSerializer(
-            instance.recipe,
-            context=context
-        ).data
-
-
-class RecipeShoppingListSerializer(serializers.ModelSerializer):
-    """
-    Сериализатор для работы с моделью рецепта
-    в списке покупок.
-    """
-
-    class Meta:
-        model = RecipeShoppingList
-        fields = ('id', 'user', 'recipe')
-
-    def validate(self, data):
-        """Валидация при добавлении рецепта в список покупок."""
-        user, recipe = data['user'], data['recipe']
-        if RecipeShoppingList.objects.filter(user=user,
-                                             recipe=recipe).exists():
-            raise serializers.ValidationError(
-                'Рецепт уже добавлен в список покупок!'
-            )
-        return data
-
-    def to_representation(self, instance):
-        """Отображение добавленного в список покупок рецепта."""
-        request = self.context.get('request')
-        context = {'request': request}
-        return RecipeShortSerializer(
-            instance.recipe,
-            context=context
-        ).data
+class PlannedShoppingListSerializer(serializers.Serializer):
+    """Набор рецептов с порциями и формат списка покупок."""
+    recipes = PortionSerializer(many=True, allow_empty=False,
+                                max_length=PLAN_RECIPES_LIMIT)
+    format = serializers.ChoiceField(choices=SHOPPING_LIST_FORMATS,
+                                     default='json')
+
+    def validate_recipes(self, recipes):
+        """Множители повторяющихся рецептов складываются."""
+        portions = {}
+        for item in recipes:
+            portions[item['id']] = (portions.get(item['id'], 0)
+                                    + item['portions'])
+        return portions
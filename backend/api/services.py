@@ -1,17 +1,343 @@
-from django.db.models import F, Sum
+import hashlib
+from urllib.parse import urlencode
 
-from recipes.models import RecipeIngredient
+from django.core.cache import cache
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models import (
+    Case,
+    Count,
+    DecimalField,
+    ExpressionWrapper,
+    F,
+    Q,
+    Sum,
+    Value,
+    When
+)
+from django_filters.utils import translate_validation
+
+from recipes.models import (
+    FeedEntry,
+    Recipe,
+    RecipeIngredient,
+    RecipeTag,
+    Tag
+)
+from recipes.versions import RECIPES, TAGS, get_versions
+from users.models import Follow
+from .cache import get_user_sets_signature
+from .replicas import use_primary
+
+FEED_FANOUT_LIMIT = 1000
+FEED_BACKFILL_SIZE = 100
+FEED_BATCH_SIZE = 1000
+POPULAR_AUTHORS_KEY = 'feed:popular_authors'
+POPULAR_AUTHORS_TIMEOUT = 60 * 10
+FACETS_KEY = 'facets:tags:{}'
+FACETS_TIMEOUT = 60 * 10
+FACETS_IGNORED_PARAMS = frozenset((
+    'tags', 'page', 'limit', 'fields', 'omit', 'ordering'
+))
+PERSONAL_FILTERS = frozenset(('is_favorited', 'is_in_shopping_cart'))
+FORK_SUFFIX = ' (копия{})'
+FORK_RETRIES = 3
 
 
 def get_ingredients(user):
     """
     Cуммирование одинаковых ингредиентов
-    из разных рецептов для списка покупок.
+    из разных рецептов для списка покупок без скрытых рецептов.
     """
     ingredients = RecipeIngredient.objects.filter(
-        recipe__shopping__user=user).values(
+        recipe__shopping__user=user, recipe__is_active=True).values(
         name=F('ingredient__name'),
         unit=F('ingredient__unit')
     ).annotate(amount=Sum('amount')).values_list(
         'ingredient__name', 'ingredient__unit', 'amount')
     return ingredients
+
+
+def get_planned_ingredients(portions):
+    """
+    Список покупок для набора рецептов без изменения корзины:
+    portions - {recipe_id: множитель порций}. Взвешенная сумма
+    количеств группируется по ингредиенту одним запросом,
+    множители подставляются в него через CASE.
+    Строки (id, название, единица, количество) по названию.
+    """
+    amount_field = DecimalField(max_digits=12, decimal_places=2)
+    multiplier = Case(
+        *(When(recipe_id=recipe_id, then=Value(value))
+          for recipe_id, value in portions.items()),
+        output_field=amount_field,
+    )
+    return RecipeIngredient.objects.filter(
+        recipe_id__in=portions, recipe__is_active=True
+    ).values('ingredient_id').annotate(
+        name=F('ingredient__name'),
+        unit=F('ingredient__unit'),
+        amount=Sum(ExpressionWrapper(F('amount') * multiplier,
+                                     output_field=amount_field)),
+    ).order_by('name', 'ingredient_id').values_list(
+        'ingredient_id', 'name', 'unit', 'amount'
+    )
+
+
+def get_popular_authors():
+    """
+    Авторы, у которых подписчиков больше FEED_FANOUT_LIMIT.
+    Их рецепты не рассылаются по лентам, а подмешиваются при чтении.
+    """
+    authors = cache.get(POPULAR_AUTHORS_KEY)
+    if authors is None:
+        authors = frozenset(Follow.objects.order_by().values(
+            'author_id'
+        ).annotate(followers=Count('id')).filter(
+            followers__gt=FEED_FANOUT_LIMIT
+        ).values_list('author_id', flat=True))
+        cache.set(POPULAR_AUTHORS_KEY, authors, POPULAR_AUTHORS_TIMEOUT)
+    return authors
+
+
+def _add_feed_entries(entries):
+    FeedEntry.objects.bulk_create(
+        entries, batch_size=FEED_BATCH_SIZE, ignore_conflicts=True
+    )
+
+
+def fan_out_recipe(recipe):
+    """
+    Рассылка нового рецепта в ленты подписчиков автора.
+    Для популярных авторов рассылка не выполняется.
+    """
+    followers = Follow.objects.filter(author_id=recipe.author_id)
+    if followers.count() > FEED_FANOUT_LIMIT:
+        cache.delete(POPULAR_AUTHORS_KEY)
+        return
+    _add_feed_entries(
+        FeedEntry(user_id=user_id, recipe=recipe, pub_date=recipe.pub_date)
+        for user_id in followers.values_list('user_id', flat=True)
+    )
+
+
+def backfill_feed(user, author_id):
+    """Последние рецепты автора в ленту нового подписчика."""
+    if author_id in get_popular_authors():
+        return
+    _add_feed_entries(
+        FeedEntry(user=user, recipe_id=recipe_id, pub_date=pub_date)
+        for recipe_id, pub_date in Recipe.objects.filter(
+            author_id=author_id
+        ).order_by('-pub_date').values_list(
+            'id', 'pub_date'
+        )[:FEED_BACKFILL_SIZE]
+    )
+
+
+def prune_feed(user, author_id):
+    """Удаление рецептов автора из ленты отписавшегося пользователя."""
+    FeedEntry.objects.filter(user=user, recipe__author_id=author_id).delete()
+
+
+def add_link(model, user, target, target_id, **values):
+    """
+    Связь пользователя с объектом (избранное, корзина, подписка)
+    одним запросом INSERT ... SELECT ... ON CONFLICT DO NOTHING RETURNING:
+    строка вставляется, только если объект target_id существует,
+    активен (скрытый рецепт, деактивированный пользователь - нет)
+    и связи ещё нет, поэтому двойной клик не упирается
+    в ограничение уникальности. values - значения остальных колонок.
+    Возвращает True, если связь создана.
+    """
+    connection = connections[router.db_for_write(model)]
+    if not connection.features.can_return_columns_from_insert:
+        return _add_link_savepoint(model, user, target, target_id, values)
+    quote = connection.ops.quote_name
+    field = model._meta.get_field(target)
+    target_meta = field.related_model._meta
+    columns = [model._meta.get_field('user').column, field.column]
+    params = [user.id]
+    for name, value in values.items():
+        column = model._meta.get_field(name)
+        columns.append(column.column)
+        params.append(column.get_db_prep_save(value, connection))
+    conditions = [f'{quote(target_meta.pk.column)} = %s']
+    params.append(target_id)
+    for name, value in _active_filter(field.related_model).items():
+        conditions.append(f'{quote(target_meta.get_field(name).column)} = %s')
+        params.append(value)
+    sql = (
+        f'INSERT INTO {quote(model._meta.db_table)} '
+        f'({", ".join(map(quote, columns))}) '
+        f'SELECT %s, {quote(target_meta.pk.column)}'
+        f'{", %s" * len(values)} '
+        f'FROM {quote(target_meta.db_table)} '
+        f'WHERE {" AND ".join(conditions)} '
+        f'ON CONFLICT DO NOTHING '
+        f'RETURNING {quote(model._meta.pk.column)}'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchone() is not None
+
+
+def _active_filter(target_model):
+    """Условие активности объекта связи: {'is_active': True} или {}."""
+    names = {field.name for field in target_model._meta.concrete_fields}
+    return {'is_active': True} if 'is_active' in names else {}
+
+
+def _add_link_savepoint(model, user, target, target_id, values):
+    """Запасной вариант для баз без RETURNING: вставка в точке сохранения."""
+    field = model._meta.get_field(target)
+    target_model = field.related_model
+    if not target_model._base_manager.filter(
+        pk=target_id, **_active_filter(target_model)
+    ).exists():
+        return False
+    try:
+        with transaction.atomic(using=router.db_for_write(model)):
+            model.objects.create(
+                user=user, **{field.attname: target_id}, **values
+            )
+    except IntegrityError:
+        return False
+    return True
+
+
+def _copy_rows(model, field, source_id, target_id):
+    """
+    Копия строк model с field = source_id для target_id
+    одним запросом INSERT ... SELECT, без выборки строк в Python.
+    """
+    connection = connections[router.db_for_write(model)]
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    column = quote(model._meta.get_field(field).column)
+    columns = ', '.join(
+        quote(item.column) for item in model._meta.concrete_fields
+        if not item.primary_key and item.name != field
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} ({column}, {columns}) '
+            f'SELECT %s, {columns} FROM {table} WHERE {column} = %s',
+            [target_id, source_id]
+        )
+
+
+def _fork_name(name):
+    """
+    Свободное название копии: «Название (копия)», «Название (копия 2)»...
+    Занятые названия, включая скрытые рецепты, выбираются одним
+    запросом; название обрезается под max_length с учётом суффикса.
+    """
+    max_length = Recipe._meta.get_field('name').max_length
+    base = name[:max_length - len(FORK_SUFFIX.format(' 999'))]
+    taken = set(Recipe.all_objects.filter(
+        name__startswith=base + FORK_SUFFIX.format('')[:-1]
+    ).values_list('name', flat=True))
+    number = 1
+    while True:
+        candidate = base + FORK_SUFFIX.format(f' {number}' if number > 1
+                                              else '')
+        if candidate not in taken:
+            return candidate
+        number += 1
+
+
+def fork_recipe(recipe, user):
+    """
+    Копия рецепта для user в одной транзакции: строка рецепта
+    создаётся через ORM (сигналы ленты, оценки и версий),
+    ингредиенты и теги копируются запросами INSERT ... SELECT.
+    Изображение общее с исходным рецептом: копируется только путь.
+    Если название копии успели занять, подбирается следующее.
+    """
+    for attempt in range(FORK_RETRIES + 1):
+        try:
+            with transaction.atomic():
+                fork = Recipe.objects.create(
+                    author=user, name=_fork_name(recipe.name),
+                    image=recipe.image.name, text=recipe.text,
+                    cooking_time=recipe.cooking_time
+                )
+                _copy_rows(RecipeIngredient, 'recipe', recipe.id, fork.id)
+                _copy_rows(RecipeTag, 'recipe', recipe.id, fork.id)
+            return fork
+        except IntegrityError:
+            if attempt == FORK_RETRIES:
+                raise
+
+
+def _after(rows, field, position):
+    if position is None:
+        return rows
+    pub_date, recipe_id = position
+    return rows.filter(Q(pub_date__lt=pub_date)
+                       | Q(pub_date=pub_date, **{f'{field}__lt': recipe_id}))
+
+
+def get_feed(user, position=None, limit=FEED_BACKFILL_SIZE):
+    """
+    Страница ленты подписок после position: до limit + 1 пар
+    (pub_date, recipe_id) по убыванию. Записи ленты читаются
+    из FeedEntry по индексу (user, -pub_date, -recipe), рецепты
+    популярных авторов, на которых подписан пользователь, -
+    по индексу (author, -pub_date) рецептов. Обе выборки ограничены
+    limit + 1 строками и сливаются в Python.
+    """
+    sources = [_after(FeedEntry.objects.filter(
+        user=user, recipe__is_active=True
+    ), 'recipe_id', position).order_by(
+        '-pub_date', '-recipe_id'
+    ).values_list('pub_date', 'recipe_id')]
+    popular = get_popular_authors()
+    authors = []
+    if popular:
+        authors = list(Follow.objects.filter(
+            user=user, author_id__in=popular
+        ).values_list('author_id', flat=True))
+    if authors:
+        sources.append(_after(Recipe.objects.filter(
+            author_id__in=authors
+        ), 'id', position).order_by('-pub_date', '-id').values_list(
+            'pub_date', 'id'
+        ))
+    rows = set()
+    for source in sources:
+        rows.update(source[:limit + 1])
+    return sorted(rows, reverse=True)[:limit + 1]
+
+
+def get_tag_facets(request, filterset_class, queryset):
+    """
+    Число рецептов каждого тега при текущих фильтрах, кроме
+    самого фильтра по тегам, - одним сгруппированным запросом.
+    Кэшируется по набору фильтров и версиям рецептов и тегов,
+    для фильтров по избранному и корзине - и по множествам пользователя.
+    Кэшируемые числа считаются по основной базе.
+    """
+    params = request.query_params.copy()
+    for name in FACETS_IGNORED_PARAMS:
+        params.pop(name, None)
+    signature = ''
+    if not PERSONAL_FILTERS.isdisjoint(params):
+        signature = get_user_sets_signature(request)
+    versions = get_versions(RECIPES, TAGS)
+    source = (f'{versions[RECIPES]}:{versions[TAGS]}:{signature}:'
+              f'{urlencode(sorted(params.lists()), doseq=True)}')
+    key = FACETS_KEY.format(hashlib.md5(source.encode()).hexdigest())
+    facets = cache.get(key)
+    if facets is None:
+        filterset = filterset_class(params, queryset=queryset,
+                                    request=request)
+        if not filterset.is_valid():
+            raise translate_validation(filterset.errors)
+        recipes = filterset.qs.order_by().values('id')
+        with use_primary():
+            facets = list(Tag.objects.annotate(count=Count(
+                'recipetag', filter=Q(recipetag__recipe__in=recipes)
+            )).values('id', 'name', 'color', 'slug', 'count'))
+        cache.set(key, facets, FACETS_TIMEOUT)
+    return facets
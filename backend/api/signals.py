@@ -0,0 +1,194 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from recipes.models import (
+    FavoriteRecipe,
+    Ingredient,
+    Recipe,
+    RecipeIngredient,
+    RecipeShoppingList,
+    RecipeTag,
+    Tag,
+    Tombstone
+)
+from recipes.versions import INGREDIENTS, RECIPES, TAGS, bump_version
+from tasks.queue import enqueue
+from users.models import Follow
+from .authentication import invalidate_tokens
+from .cache import (
+    USER_SET_MODELS,
+    invalidate_recipe_fragments,
+    invalidate_user_sets
+)
+from .scores import create_score
+from .tasks import fan_out, warm_ingredient_snapshot
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def recipe_changed(sender, instance, **kwargs):
+    """Сброс фрагмента изменённого рецепта."""
+    invalidate_recipe_fragments([instance.pk])
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def object_deleted(sender, instance, **kwargs):
+    """Запись об удалении для дельта-синхронизации клиентов."""
+    Tombstone.objects.create(
+        kind=sender._meta.model_name, object_id=instance.pk
+    )
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_created(sender, instance, created, **kwargs):
+    """
+    Рассылка нового рецепта в ленты подписчиков автора
+    и его нулевая оценка для сортировки по популярности.
+    """
+    if created:
+        enqueue(fan_out, instance.id)
+        create_score(instance)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+@receiver(post_save, sender=RecipeTag)
+@receiver(post_delete, sender=RecipeTag)
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def recipe_index_changed(sender, **kwargs):
+    """
+    Новая версия рецептов после коммита: процессы досинхронизируют
+    индекс ингредиентов, кэш фасетов тегов перестаёт совпадать.
+    """
+    if kwargs.get('action', 'post_').startswith('pre_'):
+        return
+    transaction.on_commit(lambda: bump_version(RECIPES))
+
+
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+@receiver(post_save, sender=RecipeTag)
+@receiver(post_delete, sender=RecipeTag)
+def recipe_relation_changed(sender, instance, **kwargs):
+    """
+    Сброс фрагмента и обновление updated_at рецепта
+    при изменении его ингредиентов или тегов.
+    """
+    invalidate_recipe_fragments([instance.recipe_id])
+    Recipe.objects.filter(pk=instance.recipe_id).update(
+        updated_at=timezone.now()
+    )
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def recipe_m2m_changed(sender, instance, action, reverse, pk_set,
+                       **kwargs):
+    """Сброс фрагментов при изменении связей через менеджеры M2M."""
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        recipe_ids = [instance.pk]
+    elif pk_set:
+        recipe_ids = pk_set
+    else:
+        return
+    invalidate_recipe_fragments(recipe_ids)
+    Recipe.objects.filter(pk__in=recipe_ids).update(
+        updated_at=timezone.now()
+    )
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def tag_catalog_changed(sender, **kwargs):
+    """Новая версия справочника тегов."""
+    bump_version(TAGS)
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def ingredient_catalog_changed(sender, **kwargs):
+    """
+    Новая версия справочника ингредиентов после коммита: снимок
+    каталога под новой версией не соберётся из незакоммиченных данных.
+    Снимок собирается в фоне, чтобы первый клиент не ждал рендеринга
+    и сжатия.
+    """
+    transaction.on_commit(lambda: bump_version(INGREDIENTS))
+    enqueue(warm_ingredient_snapshot)
+
+
+@receiver(post_save, sender=Tag)
+def tag_changed(sender, instance, created, **kwargs):
+    """Сброс фрагментов рецептов с изменённым тегом."""
+    if created:
+        return
+    invalidate_recipe_fragments(RecipeTag.objects.filter(
+        tag=instance).values_list('recipe_id', flat=True))
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_changed(sender, instance, created, **kwargs):
+    """Сброс фрагментов рецептов с изменённым ингредиентом."""
+    if created:
+        return
+    invalidate_recipe_fragments(RecipeIngredient.objects.filter(
+        ingredient=instance).values_list('recipe_id', flat=True))
+
+
+@receiver(post_save, sender=User)
+def author_changed(sender, instance, created, update_fields, **kwargs):
+    """
+    Сброс фрагментов и обновление updated_at рецептов автора
+    при изменении его данных.
+    """
+    if created or update_fields in (frozenset(('last_login',)),
+                                    frozenset(('password',))):
+        return
+    invalidate_recipe_fragments(instance.recipes.values_list(
+        'id', flat=True))
+    instance.recipes.update(updated_at=timezone.now())
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    """Сброс кэша удалённого токена (выход из системы)."""
+    invalidate_tokens([instance.key])
+
+
+@receiver(post_save, sender=User)
+def user_tokens_changed(sender, instance, created, update_fields, **kwargs):
+    """
+    Сброс кэша токенов пользователя при смене пароля,
+    деактивации и других изменениях.
+    """
+    if created or update_fields == frozenset(('last_login',)):
+        return
+    invalidate_tokens(Token.objects.filter(user=instance).values_list(
+        'key', flat=True))
+
+
+@receiver(post_save, sender=FavoriteRecipe)
+@receiver(post_delete, sender=FavoriteRecipe)
+@receiver(post_save, sender=RecipeShoppingList)
+@receiver(post_delete, sender=RecipeShoppingList)
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def user_set_changed(sender, instance, **kwargs):
+    """
+    Сброс множества пользователя при изменении через ORM:
+    админка и каскадное удаление рецептов и пользователей.
+    """
+    invalidate_user_sets([instance.user_id], (USER_SET_MODELS[sender],))
@@ -0,0 +1,147 @@
+import hashlib
+import random
+import struct
+from array import array
+
+from django.db import transaction
+from django.db.models import Count
+
+from recipes.models import RecipeBand, RecipeIngredient, RecipeSignature
+
+NUM_PERM = 32
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+MERSENNE_PRIME = (1 << 61) - 1
+SIMILAR_CANDIDATES = 200
+INDEX_BATCH_SIZE = 1000
+
+_random = random.Random(NUM_PERM)
+PERMUTATIONS = tuple(
+    (_random.randrange(1, MERSENNE_PRIME), _random.randrange(MERSENNE_PRIME))
+    for _ in range(NUM_PERM)
+)
+
+
+def minhash(ingredient_ids):
+    """
+    MinHash-сигнатура набора ингредиентов: минимумы NUM_PERM
+    универсальных хэш-функций (a * x + b) mod p.
+    Для пустого набора возвращает None.
+    """
+    ingredient_ids = set(ingredient_ids)
+    if not ingredient_ids:
+        return None
+    return array('Q', (
+        min((a * x + b) % MERSENNE_PRIME for x in ingredient_ids)
+        for a, b in PERMUTATIONS
+    ))
+
+
+def band_keys(signature):
+    """
+    Ключи LSH-полос: BANDS полос по ROWS значений сигнатуры.
+    Рецепты с общим ключом - кандидаты в похожие.
+    """
+    keys = []
+    for band in range(BANDS):
+        rows = signature[band * ROWS:(band + 1) * ROWS]
+        digest = hashlib.blake2b(
+            struct.pack(f'<H{ROWS}Q', band, *rows), digest_size=8
+        ).digest()
+        keys.append(int.from_bytes(digest, 'little', signed=True))
+    return keys
+
+
+def estimate_jaccard(first, second):
+    """Оценка коэффициента Жаккара по доле совпавших минимумов."""
+    return sum(a == b for a, b in zip(first, second)) / NUM_PERM
+
+
+def load_signature(data):
+    signature = array('Q')
+    signature.frombytes(bytes(data))
+    return signature
+
+
+def index_recipes(recipe_ingredients):
+    """
+    Запись сигнатур и LSH-полос рецептов.
+    recipe_ingredients - {recipe_id: id ингредиентов}.
+    Прежние записи рецептов заменяются.
+    """
+    signatures = {}
+    for recipe_id, ingredient_ids in recipe_ingredients.items():
+        signature = minhash(ingredient_ids)
+        if signature is not None:
+            signatures[recipe_id] = signature
+    with transaction.atomic():
+        RecipeSignature.objects.filter(
+            recipe_id__in=recipe_ingredients
+        ).delete()
+        RecipeBand.objects.filter(recipe_id__in=recipe_ingredients).delete()
+        RecipeSignature.objects.bulk_create(
+            (RecipeSignature(recipe_id=recipe_id,
+                             signature=signature.tobytes())
+             for recipe_id, signature in signatures.items()),
+            batch_size=INDEX_BATCH_SIZE
+        )
+        RecipeBand.objects.bulk_create(
+            (RecipeBand(recipe_id=recipe_id, key=key)
+             for recipe_id, signature in signatures.items()
+             for key in band_keys(signature)),
+            batch_size=INDEX_BATCH_SIZE
+        )
+
+
+def index_recipe(recipe, ingredient_ids):
+    """Обновление индекса после изменения ингредиентов рецепта."""
+    index_recipes({recipe.id: ingredient_ids})
+
+
+def rebuild_index(batch_size=INDEX_BATCH_SIZE):
+    """Полная перестройка индекса пачками рецептов."""
+    ingredients = RecipeIngredient.objects.filter(
+        recipe__is_active=True
+    ).order_by('recipe_id').values_list('recipe_id', 'ingredient_id')
+    batch = {}
+    for recipe_id, ingredient_id in ingredients.iterator():
+        if recipe_id not in batch and len(batch) >= batch_size:
+            index_recipes(batch)
+            batch = {}
+        batch.setdefault(recipe_id, []).append(ingredient_id)
+    if batch:
+        index_recipes(batch)
+
+
+def find_similar(recipe_id, limit):
+    """
+    Похожие рецепты: кандидаты с общими LSH-полосами,
+    упорядоченные по оценке коэффициента Жаккара.
+    Рецепты вне индекса (до запуска rebuild_similarity) похожих не имеют,
+    скрытые рецепты в кандидаты не попадают.
+    Возвращает список пар (recipe_id, similarity).
+    """
+    row = RecipeSignature.objects.filter(
+        recipe_id=recipe_id
+    ).values_list('signature', flat=True).first()
+    if row is None:
+        return []
+    signature = load_signature(row)
+    candidates = RecipeBand.objects.filter(
+        key__in=band_keys(signature), recipe__is_active=True
+    ).exclude(recipe_id=recipe_id).values('recipe_id').annotate(
+        matches=Count('id')
+    ).order_by('-matches').values_list('recipe_id', flat=True)[
+        :SIMILAR_CANDIDATES
+    ]
+    ranked = sorted(
+        (
+            (candidate_id, estimate_jaccard(signature,
+                                            load_signature(data)))
+            for candidate_id, data in RecipeSignature.objects.filter(
+                recipe_id__in=list(candidates)
+            ).values_list('recipe_id', 'signature')
+        ),
+        key=lambda item: (-item[1], item[0])
+    )
+    return ranked[:limit]
@@ -0,0 +1,103 @@
+import gzip
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.utils.http import quote_etag
+
+from recipes.models import Ingredient
+from recipes.versions import INGREDIENTS, get_version
+from .replicas import use_primary
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+IDENTITY = 'identity'
+GZIP = 'gzip'
+BROTLI = 'br'
+SNAPSHOT_KEY = 'snapshot:ingredients:{}'
+SNAPSHOT_TIMEOUT = 60 * 60 * 24
+
+_snapshot = None
+
+
+def _dumps(data):
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(
+        data, ensure_ascii=False, separators=(',', ':')
+    ).encode()
+
+
+def build_ingredient_snapshot(version):
+    """
+    Каталог ингредиентов по столбцам, отсортированный по названию:
+    id, name и номер единицы измерения в списке units.
+    Тело рендерится и сжимается один раз на версию справочника.
+    """
+    with use_primary():
+        rows = list(Ingredient.objects.order_by('name', 'id').values_list(
+            'id', 'name', 'unit'
+        ))
+    units = sorted({unit for _, _, unit in rows})
+    unit_index = {unit: index for index, unit in enumerate(units)}
+    body = _dumps({
+        'version': version,
+        'units': units,
+        'id': [row[0] for row in rows],
+        'name': [row[1] for row in rows],
+        'unit': [unit_index[row[2]] for row in rows],
+    })
+    digest = hashlib.md5(body).hexdigest()
+    encodings = {
+        IDENTITY: (body, quote_etag(digest)),
+        GZIP: (gzip.compress(body, 9, mtime=0), quote_etag(f'{digest}-gz')),
+    }
+    if brotli is not None:
+        encodings[BROTLI] = (brotli.compress(body),
+                             quote_etag(f'{digest}-br'))
+    return version, encodings
+
+
+def get_ingredient_snapshot():
+    """
+    Снимок текущей версии каталога: {кодировка: (тело, ETag)}.
+    Хранится в памяти процесса и в общем кэше, после изменения
+    справочника собирается заново первым обратившимся процессом.
+    """
+    global _snapshot
+    version = get_version(INGREDIENTS)
+    if _snapshot is None or _snapshot[0] != version:
+        key = SNAPSHOT_KEY.format(version)
+        snapshot = cache.get(key)
+        if snapshot is None:
+            snapshot = build_ingredient_snapshot(version)
+            cache.set(key, snapshot, SNAPSHOT_TIMEOUT)
+        _snapshot = snapshot
+    return _snapshot[1]
+
+
+def choose_encoding(accept_encoding, available):
+    """Лучшая из доступных кодировок, принимаемых клиентом."""
+    accepted = set()
+    for item in accept_encoding.split(','):
+        coding, _, params = item.strip().lower().partition(';')
+        quality = params.strip()
+        if quality.startswith('q='):
+            try:
+                if float(quality[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding.strip())
+    for coding in (BROTLI, GZIP):
+        if coding in available and (coding in accepted or '*' in accepted):
+            return coding
+    return IDENTITY
@@ -0,0 +1,164 @@
+import base64
+import binascii
+from datetime import timedelta
+
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+
+from recipes.models import Ingredient, Recipe, Tag, Tombstone
+from .cache import get_recipes_data
+from .fieldsets import get_fieldset
+from .representations import SYNC_RECIPE_FIELDS
+from .serializers import IngredientSerializer, TagSerializer
+
+CURSOR_PARAM = 'cursor'
+SINCE_PARAM = 'since'
+LIMIT_PARAM = 'limit'
+SYNC_PAGE_SIZE = 100
+SYNC_MAX_PAGE_SIZE = 500
+SYNC_MARGIN = timedelta(minutes=1)
+TOMBSTONE_RETENTION = timedelta(days=90)
+CATALOGS = (
+    ('tags', Tag, TagSerializer, Tombstone.TAG),
+    ('ingredients', Ingredient, IngredientSerializer, Tombstone.INGREDIENT),
+)
+
+
+class SyncExpired(APIException):
+    """Курсор старше срока хранения удалений: нужна полная загрузка."""
+    status_code = status.HTTP_410_GONE
+    default_detail = ('Изменения с этого момента не хранятся, '
+                      'загрузите данные заново без cursor и since.')
+    default_code = 'sync_expired'
+
+
+def encode_cursor(updated_at, recipe_id=0):
+    value = f'{updated_at.isoformat()}|{recipe_id}'
+    return base64.urlsafe_b64encode(value.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        value = base64.urlsafe_b64decode(cursor.encode()).decode()
+        updated_at, recipe_id = value.split('|')
+        updated_at, recipe_id = parse_datetime(updated_at), int(recipe_id)
+    except (binascii.Error, UnicodeError, TypeError, ValueError):
+        updated_at = None
+    if updated_at is None or timezone.is_naive(updated_at):
+        raise ValidationError({CURSOR_PARAM: 'Некорректный курсор.'})
+    return updated_at, recipe_id
+
+
+def _parse_position(request):
+    """
+    Позиция клиента (updated_at, id последнего рецепта):
+    непрозрачный cursor из прошлого ответа или метка времени since
+    в ISO 8601. Без параметров - None, полная загрузка.
+    """
+    cursor = request.query_params.get(CURSOR_PARAM)
+    if cursor:
+        return decode_cursor(cursor)
+    since = request.query_params.get(SINCE_PARAM)
+    if not since:
+        return None
+    try:
+        updated_at = parse_datetime(since)
+    except ValueError:
+        updated_at = None
+    if updated_at is None:
+        raise ValidationError({SINCE_PARAM: 'Ожидается дата в ISO 8601.'})
+    if timezone.is_naive(updated_at):
+        updated_at = timezone.make_aware(updated_at)
+    return updated_at, 0
+
+
+def _parse_limit(request):
+    try:
+        limit = int(request.query_params.get(LIMIT_PARAM, SYNC_PAGE_SIZE))
+    except ValueError:
+        raise ValidationError({LIMIT_PARAM: 'Ожидается целое число.'})
+    return max(1, min(limit, SYNC_MAX_PAGE_SIZE))
+
+
+def _window(queryset, field, since, until):
+    if since is not None:
+        queryset = queryset.filter(**{f'{field}__gt': since})
+    if until is not None:
+        queryset = queryset.filter(**{f'{field}__lte': until})
+    return queryset
+
+
+def _deleted(kind, since, until):
+    if since is None:
+        return []
+    return sorted(set(_window(
+        Tombstone.objects.filter(kind=kind), 'deleted_at', since, until
+    ).values_list('object_id', flat=True)))
+
+
+def get_changes(request):
+    """
+    Изменения рецептов, тегов и ингредиентов после позиции клиента.
+    Рецепты отдаются страницами по (updated_at, id) через составной
+    индекс, справочники и удаления - за тот же интервал времени,
+    что и страница рецептов. На последней странице курсор сдвигается
+    на SYNC_MARGIN назад: строки, закоммиченные позже своей метки
+    updated_at, придут повторно, а не потеряются. Клиент применяет
+    изменения идемпотентно (upsert по id). Флаги избранного, корзины
+    и подписки в рецепты не входят: их изменения не двигают
+    updated_at, клиент получает их из списков пользователя.
+    """
+    position = _parse_position(request)
+    now = timezone.now()
+    if position is not None and position[0] < now - TOMBSTONE_RETENTION:
+        raise SyncExpired()
+    limit = _parse_limit(request)
+    recipes = Recipe.objects.order_by('updated_at', 'id')
+    since = None
+    if position is not None:
+        since, recipe_id = position
+        recipes = recipes.filter(
+            Q(updated_at__gt=since) | Q(updated_at=since, id__gt=recipe_id)
+        )
+    rows = list(recipes.values_list('updated_at', 'id')[:limit + 1])
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if has_more:
+        until = rows[-1][0]
+        cursor = encode_cursor(*rows[-1])
+    else:
+        until = None
+        cursor = encode_cursor(now - SYNC_MARGIN)
+    data = {
+        'recipes': {
+            'updated': get_recipes_data(
+                request, [recipe_id for _, recipe_id in rows],
+                get_fieldset(request, SYNC_RECIPE_FIELDS), user_flags=False
+            ),
+            'deleted': _deleted(Tombstone.RECIPE, since, until),
+        },
+    }
+    for name, model, serializer, kind in CATALOGS:
+        data[name] = {
+            'updated': serializer(
+                _window(model.objects.order_by('id'), 'updated_at',
+                        since, until),
+                many=True
+            ).data,
+            'deleted': _deleted(kind, since, until),
+        }
+    data['cursor'] = cursor
+    data['has_more'] = has_more
+    return data
+
+
+def prune_tombstones(now=None):
+    """Удаление записей об удалениях старше TOMBSTONE_RETENTION."""
+    now = now or timezone.now()
+    deleted, _ = Tombstone.objects.filter(
+        deleted_at__lt=now - TOMBSTONE_RETENTION
+    ).delete()
+    return deleted
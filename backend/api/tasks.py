@@ -0,0 +1,76 @@
+from recipes.models import Recipe, RecipeIngredient
+from tasks.queue import enqueue, task
+from .cache import get_recipe_fragments
+from .purge import (
+    RECIPES_PURGE,
+    USER_PURGE,
+    deactivate_recipes,
+    deactivate_user,
+    mark_queued,
+    purge_recipes,
+    purge_user,
+    report_progress
+)
+from .services import fan_out_recipe
+from .similarity import index_recipes
+from .snapshots import get_ingredient_snapshot
+
+
+@task
+def fan_out(recipe_id):
+    """Рассылка нового рецепта в ленты подписчиков."""
+    recipe = Recipe.objects.only('id', 'author_id', 'pub_date').filter(
+        id=recipe_id
+    ).first()
+    if recipe is not None:
+        fan_out_recipe(recipe)
+
+
+@task
+def index_similarity(recipe_id):
+    """Обновление записи рецепта в индексе похожих рецептов."""
+    index_recipes({recipe_id: list(RecipeIngredient.objects.filter(
+        recipe_id=recipe_id
+    ).values_list('ingredient_id', flat=True))})
+
+
+@task(max_attempts=1)
+def warm_recipe_fragments(recipe_ids):
+    """Прогрев кэша фрагментов изменённых рецептов."""
+    get_recipe_fragments(recipe_ids)
+
+
+@task(max_attempts=1)
+def warm_ingredient_snapshot():
+    """Сборка снимка каталога ингредиентов новой версии."""
+    get_ingredient_snapshot()
+
+
+@task
+def delete_recipes(recipe_ids):
+    """Удаление скрытых рецептов пачками."""
+    progress = report_progress(RECIPES_PURGE, recipe_ids[0])
+    progress(purge_recipes(recipe_ids, progress=progress), finished=True)
+
+
+@task
+def delete_user(user_id):
+    """Удаление деактивированного пользователя пачками."""
+    progress = report_progress(USER_PURGE, user_id)
+    progress(purge_user(user_id, progress=progress), finished=True)
+
+
+def schedule_recipe_deletion(recipe_ids):
+    """Рецепты скрываются сразу, строки удаляются в фоне."""
+    recipe_ids = list(recipe_ids)
+    deactivate_recipes(recipe_ids)
+    if recipe_ids:
+        mark_queued(RECIPES_PURGE, recipe_ids)
+        enqueue(delete_recipes, recipe_ids)
+
+
+def schedule_user_deletion(user):
+    """Пользователь деактивируется сразу, строки удаляются в фоне."""
+    deactivate_user(user)
+    mark_queued(USER_PURGE, [user.pk])
+    enqueue(delete_user, user.pk)
@@ -1,9 +1,115 @@
+import asyncio
+import gzip
+import io
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 from http import HTTPStatus
+from unittest import mock, skipIf
 
-from django.test import Client, TestCase
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import (
+    DEFAULT_DB_ALIAS,
+    DatabaseError,
+    connection,
+    connections,
+    transaction
+)
+from django.test import (
+    AsyncClient,
+    Client,
+    TestCase,
+    TransactionTestCase,
+    override_settings
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+from django.utils import timezone
+from asgiref.sync import async_to_sync, sync_to_async
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
 
-# from recipes.models import Recipe
-# from users.models import User
+from recipes.models import (
+    FavoriteRecipe,
+    FeedEntry,
+    Ingredient,
+    Recipe,
+    RecipeIngredient,
+    RecipeScore,
+    RecipeShoppingList,
+    RecipeTag,
+    Tag,
+    Tombstone
+)
+from recipebook.dbstats import (
+    TrackedConnectionMixin,
+    connection_stats,
+    detach_inherited_connections
+)
+from tasks.models import Task
+from tasks.queue import (
+    LOCK_TIMEOUT,
+    enqueue,
+    heartbeat,
+    requeue_stale,
+    task,
+    work
+)
+from users.models import Follow, User
+from . import async_views
+from .analytics import active_carts, ingredient_demand
+from .cache import (
+    FAVORITES,
+    FOLLOWING,
+    SHOPPING_CART,
+    USER_SET_KEY,
+    get_recipes_data,
+    get_user_sets
+)
+from .counters import view_counter
+from .pantry import PantryIndex, get_index, reset_index
+from .purge import deactivate_recipes, get_progress, purge_recipes
+from .renderers import FastJSONRenderer
+from .replicas import (
+    PRIMARY_KEY,
+    ReplicaRouter,
+    start_replica_reads,
+    stop_replica_reads,
+    use_primary
+)
+from .scores import refresh_scores
+from .representations import RECIPE_FIELDS, build_subscriptions
+from .serializers import RecipeSerializer, SubscriptionsSerializer
+from .similarity import find_similar, rebuild_index
+from .tasks import delete_recipes, delete_user
+from .transfer import IMAGE_UPLOAD_TO, export_recipes, import_recipes
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp()
+IMAGE = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABAgMAAABieywaAAAA'
+    'CVBMVEUAAAD///9fX1/S0ecCAAAACXBIWXMAAA7EAAAOxAGVKw4bAAAACklEQVQImWNo'
+    'AAAAggCByxOyYQAAAABJRU5ErkJggg=='
+)
+
+CALLS = []
+
+
+@task
+def record_call(value):
+    CALLS.append(value)
+
+
+@task(max_attempts=2)
+def always_fail():
+    raise RuntimeError('сбой задачи')
 
 
 class RecipeBookAPITestCase(TestCase):
@@ -39,3 +145,1673 @@ class RecipeBookAPITestCase(TestCase):
     #     self.assertTrue(
     #         Recipe.objects.filter(username='vasya.pupkin').exists()
     #     )
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, TASKS_EAGER=True)
+class RecipeDataTestCase(TestCase):
+    """Общие данные для тестов API рецептов."""
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            email='author@yandex.ru', username='author',
+            first_name='Автор', last_name='Рецептов', password='Qwerty123'
+        )
+        cls.user = User.objects.create_user(
+            email='user@yandex.ru', username='user',
+            first_name='Вася', last_name='Пупкин', password='Qwerty123'
+        )
+        cls.tag = Tag.objects.create(
+            name='Завтрак', color='#E26C2D', slug='breakfast'
+        )
+        cls.ingredient = Ingredient.objects.create(name='соль', unit='г')
+        cls.recipes = []
+        for number in range(3):
+            recipe = Recipe.objects.create(
+                author=cls.author, name=f'Рецепт {number}',
+                image='recipes/images/test.png', text='Описание',
+                cooking_time=10
+            )
+            recipe.tags.set([cls.tag])
+            RecipeIngredient.objects.create(
+                recipe=recipe, ingredient=cls.ingredient, amount=5
+            )
+            cls.recipes.append(recipe)
+        cls.recipe = cls.recipes[0]
+
+    def setUp(self):
+        cache.clear()
+        view_counter.pending.clear()
+        self.addCleanup(lambda: view_counter.pending.clear())
+        patcher = mock.patch.object(view_counter, 'flush_interval', 60 * 60)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.guest_client = APIClient()
+        self.authorized_client = APIClient()
+        self.authorized_client.force_authenticate(self.user)
+
+
+class RecipeFragmentCacheTestCase(RecipeDataTestCase):
+    """Кэш пользовательски-независимых фрагментов рецептов."""
+
+    def test_cache_hit_skips_recipe_queries(self):
+        """Повторная выдача списка не загружает рецепты из базы."""
+        self.guest_client.get('/api/recipes/')
+        with self.assertNumQueries(4):
+            response = self.guest_client.get('/api/recipes/')
+        self.assertEqual(len(response.data['results']), 3)
+
+    def test_user_flags_overlay(self):
+        """Флаги текущего пользователя накладываются на фрагмент."""
+        self.guest_client.get(f'/api/recipes/{self.recipe.id}/')
+        FavoriteRecipe.objects.create(user=self.user, recipe=self.recipe)
+        Follow.objects.create(user=self.user, author=self.author)
+        response = self.authorized_client.get(
+            f'/api/recipes/{self.recipe.id}/'
+        )
+        self.assertTrue(response.data['is_favorited'])
+        self.assertFalse(response.data['is_in_shopping_cart'])
+        self.assertTrue(response.data['author']['is_subscribed'])
+        response = self.guest_client.get(f'/api/recipes/{self.recipe.id}/')
+        self.assertFalse(response.data['is_favorited'])
+        self.assertFalse(response.data['author']['is_subscribed'])
+        self.assertTrue(response.data['image'].startswith('http://'))
+
+    def test_invalidation(self):
+        """Фрагмент сбрасывается при изменении рецепта, тега и автора."""
+        url = f'/api/recipes/{self.recipe.id}/'
+        self.guest_client.get(url)
+        self.tag.name = 'Обед'
+        self.tag.save()
+        response = self.guest_client.get(url)
+        self.assertEqual(response.data['tags'][0]['name'], 'Обед')
+        self.author.first_name = 'Шеф'
+        self.author.save()
+        response = self.guest_client.get(url)
+        self.assertEqual(response.data['author']['first_name'], 'Шеф')
+        RecipeIngredient.objects.filter(recipe=self.recipe).delete()
+        response = self.guest_client.get(url)
+        self.assertEqual(response.data['ingredients'], [])
+
+    def test_missing_recipe(self):
+        """Несуществующий рецепт - 404."""
+        response = self.guest_client.get('/api/recipes/0/')
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+
+class UserSetsCacheTestCase(RecipeDataTestCase):
+    """Кэшированные множества избранного, корзины и подписок."""
+
+    def test_flags_without_queries(self):
+        """Флаги страницы берутся из кэша без запросов к базе."""
+        self.authorized_client.get('/api/recipes/')
+        with self.assertNumQueries(4):
+            self.authorized_client.get('/api/recipes/')
+
+    def test_write_through(self):
+        """Действия пользователя сразу отражаются в флагах."""
+        url = f'/api/recipes/{self.recipe.id}/'
+        self.authorized_client.get(url)
+        self.authorized_client.post(f'{url}favorite/')
+        self.authorized_client.post(f'{url}shopping_cart/')
+        self.authorized_client.post(f'/api/users/{self.author.id}/subscribe/')
+        response = self.authorized_client.get(url)
+        self.assertTrue(response.data['is_favorited'])
+        self.assertTrue(response.data['is_in_shopping_cart'])
+        self.assertTrue(response.data['author']['is_subscribed'])
+        self.authorized_client.delete(f'{url}favorite/')
+        self.authorized_client.delete(
+            f'/api/users/{self.author.id}/subscribe/'
+        )
+        response = self.authorized_client.get(url)
+        self.assertFalse(response.data['is_favorited'])
+        self.assertTrue(response.data['is_in_shopping_cart'])
+        self.assertFalse(response.data['author']['is_subscribed'])
+
+
+class CachedTokenAuthenticationTestCase(RecipeDataTestCase):
+    """Кэширование аутентификации по токену."""
+
+    def setUp(self):
+        super().setUp()
+        response = self.guest_client.post(
+            '/api/auth/token/login/',
+            {'email': self.user.email, 'password': 'Qwerty123'}
+        )
+        self.token_client = APIClient()
+        self.token_client.credentials(
+            HTTP_AUTHORIZATION=f'Token {response.data["auth_token"]}'
+        )
+
+    def test_warm_request_without_auth_queries(self):
+        """Повторный запрос аутентифицируется без обращения к базе."""
+        self.token_client.get('/api/users/me/')
+        with self.assertNumQueries(0):
+            response = self.token_client.get('/api/users/me/')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_logout_revokes_cached_token(self):
+        """После выхода кэшированный токен не действует."""
+        self.token_client.get('/api/users/me/')
+        self.token_client.post('/api/auth/token/logout/')
+        response = self.token_client.get('/api/users/me/')
+        self.assertEqual(response.status_code, HTTPStatus.UNAUTHORIZED)
+
+    def test_deactivation_revokes_cached_token(self):
+        """Деактивированный пользователь теряет доступ сразу."""
+        self.token_client.get('/api/users/me/')
+        self.user.is_active = False
+        self.user.save()
+        response = self.token_client.get('/api/users/me/')
+        self.assertEqual(response.status_code, HTTPStatus.UNAUTHORIZED)
+
+    def test_set_password_refreshes_cached_user(self):
+        """Смена пароля сбрасывает кэшированного пользователя."""
+        self.token_client.get('/api/users/me/')
+        self.token_client.post(
+            '/api/users/set_password/', {'new_password': 'Newpass123'}
+        )
+        with self.assertNumQueries(1):
+            self.token_client.get('/api/users/me/')
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password('Newpass123'))
+
+
+class ConditionalGetTestCase(RecipeDataTestCase):
+    """Ответы 304 по ETag и Last-Modified."""
+
+    def assertNotModified(self, client, url, **headers):
+        response = client.get(url)
+        etag = response['ETag']
+        with self.assertNumQueries(headers.pop('queries', 0)):
+            response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+        return etag
+
+    def test_tags_and_ingredients(self):
+        """Справочники отдают 304 без запросов и меняют ETag."""
+        etag = self.assertNotModified(self.guest_client, '/api/tags/')
+        Tag.objects.create(name='Ужин', color='#8775D2', slug='dinner')
+        self.assertNotEqual(
+            self.guest_client.get('/api/tags/')['ETag'], etag
+        )
+        self.assertNotModified(self.guest_client, '/api/ingredients/?name=с')
+
+    def test_recipe_detail(self):
+        """Рецепт отдаёт 304 и новый ETag после изменения."""
+        url = f'/api/recipes/{self.recipe.id}/'
+        etag = self.assertNotModified(self.guest_client, url, queries=1)
+        last_modified = self.guest_client.get(url)['Last-Modified']
+        response = self.guest_client.get(
+            url, HTTP_IF_MODIFIED_SINCE=last_modified
+        )
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+        self.recipe.text = 'Новое описание'
+        self.recipe.save()
+        response = self.guest_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_user_flags_change_etag(self):
+        """ETag авторизованного пользователя зависит от его флагов."""
+        url = f'/api/recipes/{self.recipe.id}/'
+        etag = self.assertNotModified(self.authorized_client, url, queries=1)
+        self.authorized_client.post(f'{url}favorite/')
+        response = self.authorized_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertFalse(response.has_header('Last-Modified'))
+
+    def test_recipe_list(self):
+        """Список отдаёт 304 и меняет ETag при удалении рецепта."""
+        etag = self.assertNotModified(
+            self.guest_client, '/api/recipes/', queries=2
+        )
+        self.recipes[-1].delete()
+        response = self.guest_client.get(
+            '/api/recipes/', HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+
+class FastReadPathParityTestCase(RecipeDataTestCase):
+    """Быстрый путь чтения совпадает с сериализаторами побайтно."""
+
+    def setUp(self):
+        super().setUp()
+        self.recipe.text = 'Строка\nс переводом\u2028и "кавычками"'
+        self.recipe.save()
+        RecipeIngredient.objects.create(
+            recipe=self.recipe, amount=1,
+            ingredient=Ingredient.objects.create(name='вода', unit='мл')
+        )
+        Tag.objects.create(
+            name='Ужин', color='#8775D2', slug='dinner'
+        ).recipe.add(self.recipe)
+        FavoriteRecipe.objects.create(user=self.user, recipe=self.recipe)
+        Follow.objects.create(user=self.user, author=self.author)
+        self.request = Request(
+            APIRequestFactory().get('/api/users/subscriptions/',
+                                    {'recipes_limit': 2})
+        )
+        self.request.user = self.user
+
+    def test_recipes_parity(self):
+        """Рецепты: get_recipes_data и RecipeSerializer."""
+        recipes = Recipe.objects.all()
+        expected = JSONRenderer().render(RecipeSerializer(
+            recipes, many=True, context={'request': self.request}
+        ).data)
+        actual = FastJSONRenderer().render(get_recipes_data(
+            self.request, recipes.values_list('id', flat=True)
+        ))
+        self.assertEqual(actual, expected)
+
+    def test_subscriptions_parity(self):
+        """Подписки: build_subscriptions и SubscriptionsSerializer."""
+        authors = User.objects.filter(following__user=self.user)
+        expected = JSONRenderer().render(SubscriptionsSerializer(
+            authors, many=True, context={'request': self.request}
+        ).data)
+        actual = FastJSONRenderer().render(build_subscriptions(
+            self.request, authors.values_list('id', flat=True),
+            get_user_sets(self.request)[FOLLOWING]
+        ))
+        self.assertEqual(actual, expected)
+
+
+class SparseFieldsetsTestCase(RecipeDataTestCase):
+    """Параметры fields и omit для рецептов и пользователей."""
+
+    def test_recipe_fields_without_relations(self):
+        """Карточка рецепта без автора, тегов и ингредиентов."""
+        url = (f'/api/recipes/{self.recipe.id}/'
+               '?fields=id,name,image,cooking_time')
+        with self.assertNumQueries(2):
+            response = self.authorized_client.get(url)
+        self.assertEqual(
+            list(response.data), ['id', 'name', 'image', 'cooking_time']
+        )
+
+    def test_recipe_omit(self):
+        """omit исключает поля из полного представления."""
+        response = self.authorized_client.get(
+            '/api/recipes/?omit=ingredients,text,author'
+        )
+        recipe = response.data['results'][0]
+        self.assertNotIn('ingredients', recipe)
+        self.assertNotIn('author', recipe)
+        self.assertIn('is_favorited', recipe)
+
+    def test_unknown_field(self):
+        """Неизвестное поле - ошибка 400."""
+        response = self.guest_client.get('/api/recipes/?fields=views_total')
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+
+    def test_empty_fieldset(self):
+        """Пустой набор полей - ошибка 400 и с холодным, и с тёплым кэшем."""
+        recipe_id = self.recipe.id
+        urls = ('/api/recipes/?fields=', f'/api/recipes/{recipe_id}/?fields=',
+                f'/api/recipes/batch/?ids={recipe_id}&fields=',
+                '/api/recipes/?omit=' + ','.join(
+                    RECIPE_FIELDS))
+        for warm in (False, True):
+            if warm:
+                self.guest_client.get('/api/recipes/')
+            for url in urls:
+                with self.subTest(url=url, warm=warm):
+                    response = self.guest_client.get(url)
+                    self.assertEqual(response.status_code,
+                                     HTTPStatus.BAD_REQUEST)
+
+    def test_user_fields(self):
+        """Пользователи и подписки с ограниченным набором полей."""
+        response = self.authorized_client.get(
+            f'/api/users/{self.author.id}/?fields=id,username'
+        )
+        self.assertEqual(dict(response.data),
+                         {'id': self.author.id, 'username': 'author'})
+        Follow.objects.create(user=self.user, author=self.author)
+        response = self.authorized_client.get(
+            '/api/users/subscriptions/?omit=recipes,email'
+        )
+        subscription = response.data['results'][0]
+        self.assertNotIn('recipes', subscription)
+        self.assertEqual(subscription['recipes_count'], 3)
+
+
+class FeedTestCase(RecipeDataTestCase):
+    """Лента подписок с рассылкой при публикации."""
+
+    def create_recipe(self, name):
+        return Recipe.objects.create(
+            author=self.author, name=name, text='Описание',
+            image='recipes/images/test.png', cooking_time=5
+        )
+
+    def feed_ids(self, url='/api/recipes/feed/'):
+        response = self.authorized_client.get(url)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def test_subscribe_backfills_and_unsubscribe_prunes(self):
+        """Подписка заполняет ленту, отписка очищает."""
+        subscribe_url = f'/api/users/{self.author.id}/subscribe/'
+        self.authorized_client.post(subscribe_url)
+        self.assertEqual(
+            self.feed_ids(), [recipe.id for recipe in reversed(self.recipes)]
+        )
+        self.authorized_client.delete(subscribe_url)
+        self.assertEqual(self.feed_ids(), [])
+
+    def test_fan_out_and_cursor(self):
+        """Новый рецепт попадает в ленту, страницы идут по курсору."""
+        self.authorized_client.post(f'/api/users/{self.author.id}/subscribe/')
+        recipe = self.create_recipe('Новый рецепт')
+        response = self.authorized_client.get('/api/recipes/feed/?limit=2')
+        self.assertEqual(response.data['results'][0]['id'], recipe.id)
+        self.assertEqual(len(self.feed_ids(response.data['next'])), 2)
+
+    @mock.patch('api.services.FEED_FANOUT_LIMIT', 0)
+    def test_popular_author_pull(self):
+        """Рецепты популярного автора подмешиваются при чтении."""
+        Follow.objects.create(user=self.user, author=self.author)
+        recipe = self.create_recipe('Рецепт популярного автора')
+        self.assertFalse(FeedEntry.objects.filter(recipe=recipe).exists())
+        self.assertIn(recipe.id, self.feed_ids())
+
+    @mock.patch('api.services.FEED_FANOUT_LIMIT', 1)
+    def test_pages_merge_entries_and_popular_authors(self):
+        """
+        Записи ленты и рецепты популярного автора сливаются в одну
+        ленту, страницы по курсору идут без пропусков и повторов.
+        """
+        other = User.objects.create_user(
+            email='other@yandex.ru', username='other', password='Qwerty123'
+        )
+        fan = User.objects.create_user(
+            email='fan@yandex.ru', username='fan', password='Qwerty123'
+        )
+        Follow.objects.create(user=fan, author=self.author)
+        Follow.objects.create(user=self.user, author=self.author)
+        self.authorized_client.post(f'/api/users/{other.id}/subscribe/')
+        for number in range(2):
+            Recipe.objects.create(
+                author=other, name=f'Рецепт подписки {number}',
+                text='Описание', image='recipes/images/test.png',
+                cooking_time=5
+            )
+        expected = list(Recipe.objects.filter(
+            author__in=(self.author, other)
+        ).order_by('-pub_date', '-id').values_list('id', flat=True))
+        ids, url = [], '/api/recipes/feed/?limit=2'
+        with CaptureQueriesContext(connection) as queries:
+            while url:
+                response = self.authorized_client.get(url)
+                ids += [recipe['id'] for recipe in response.data['results']]
+                url = response.data['next']
+        self.assertEqual(ids, expected)
+        self.assertTrue(any('"recipes_feedentry"."pub_date" DESC' in query[
+            'sql'] for query in queries.captured_queries))
+        self.assertEqual(FeedEntry.objects.filter(user=self.user).count(), 2)
+
+
+class SimilarRecipesTestCase(RecipeDataTestCase):
+    """Похожие рецепты по MinHash/LSH-индексу."""
+
+    def test_similar_ranked_by_jaccard(self):
+        """Рецепты с общими ингредиентами ранжируются по сходству."""
+        ingredients = [
+            Ingredient.objects.create(name=f'ингредиент {i}', unit='г')
+            for i in range(6)
+        ]
+        self.authorized_client.force_authenticate(self.author)
+        ids = []
+        for number, count in enumerate((6, 5, 3)):
+            response = self.authorized_client.post('/api/recipes/', {
+                'ingredients': [{'id': ingredient.id, 'amount': 1}
+                                for ingredient in ingredients[:count]],
+                'tags': [self.tag.id],
+                'image': IMAGE,
+                'name': f'Похожий рецепт {number}',
+                'text': 'Описание',
+                'cooking_time': 5,
+            }, format='json')
+            self.assertEqual(response.status_code, HTTPStatus.CREATED)
+            ids.append(response.data['id'])
+        response = self.guest_client.get(f'/api/recipes/{ids[0]}/similar/')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.data[0]['id'], ids[1])
+        self.assertGreater(response.data[0]['similarity'], 0.5)
+        self.assertNotIn(self.recipe.id,
+                         [recipe['id'] for recipe in response.data])
+        response = self.guest_client.get('/api/recipes/abc/similar/')
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+
+class PantryIndexTestCase(RecipeDataTestCase):
+    """Поиск рецептов по имеющимся ингредиентам."""
+
+    def setUp(self):
+        super().setUp()
+        reset_index()
+
+    def test_search_matches_brute_force(self):
+        """Битовый поиск совпадает с перебором, в том числе после правок."""
+        rng = random.Random(0)
+        recipes = {
+            recipe_id: (set(rng.sample(range(30), rng.randint(1, 8))),
+                        {rng.randrange(3)})
+            for recipe_id in range(1, 301)
+        }
+        index = PantryIndex.from_rows(
+            (recipe_id, *sets) for recipe_id, sets in recipes.items()
+        )
+        recipes[5] = ({1, 2}, {0})
+        index.add(5, *recipes[5])
+        del recipes[7]
+        index.remove(7)
+        for _ in range(20):
+            pantry = set(rng.sample(range(30), 10))
+            expected = sorted(
+                ((len(ingredients - pantry), -recipe_id)
+                 for recipe_id, (ingredients, tags) in recipes.items()
+                 if ingredients & pantry and 0 in tags
+                 and len(ingredients - pantry) <= 2)
+            )
+            matches = index.search(pantry, 2, [0])
+            self.assertEqual(
+                matches[0:len(matches)],
+                [(-recipe_id, missing) for missing, recipe_id in expected]
+            )
+
+    def test_sync_removes_deleted_recipes(self):
+        """
+        Удалённые и скрытые рецепты убираются из индекса
+        при досинхронизации, даже если число рецептов не изменилось.
+        """
+        self.assertEqual(set(get_index().positions),
+                         {recipe.id for recipe in self.recipes})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipes[1].delete()
+            deactivate_recipes([self.recipes[2].id])
+            created = [
+                Recipe.objects.create(
+                    author=self.author, name=f'Новый рецепт {number}',
+                    image='recipes/images/test.png', text='Описание',
+                    cooking_time=10
+                ) for number in range(2)
+            ]
+        with mock.patch('api.pantry.build_index') as build:
+            index = get_index()
+        build.assert_not_called()
+        self.assertEqual(set(index.positions),
+                         {self.recipe.id, *(recipe.id for recipe in created)})
+
+    def test_cook_endpoint(self):
+        """Рецепты ранжируются по числу недостающих ингредиентов."""
+        url = f'/api/recipes/cook/?ingredients={self.ingredient.id}'
+        self.assertEqual(self.guest_client.get(url).data['count'], 3)
+        pepper = Ingredient.objects.create(name='перец', unit='г')
+        lunch = Tag.objects.create(name='Обед', color='#49B64E', slug='lunch')
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe = Recipe.objects.create(
+                author=self.author, name='Рецепт с перцем',
+                image='recipes/images/test.png', text='Описание',
+                cooking_time=10
+            )
+            RecipeTag.objects.create(recipe=recipe, tag=lunch)
+            for ingredient in (self.ingredient, pepper):
+                RecipeIngredient.objects.create(
+                    recipe=recipe, ingredient=ingredient, amount=1
+                )
+        response = self.guest_client.get(url)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.data['count'], 4)
+        self.assertEqual(
+            [(item['id'], item['missing'])
+             for item in response.data['results']][-1],
+            (recipe.id, 1)
+        )
+        response = self.guest_client.get(
+            f'{url}&max_missing=0&tags=lunch'
+        )
+        self.assertEqual(response.data['count'], 0)
+        response = self.guest_client.get(f'{url},{pepper.id}&tags=lunch')
+        self.assertEqual(
+            [(item['id'], item['missing'])
+             for item in response.data['results']],
+            [(recipe.id, 0)]
+        )
+        response = self.guest_client.get('/api/recipes/cook/')
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+
+
+class RecipeScoresTestCase(RecipeDataTestCase):
+    """Сортировка по предрассчитанной популярности."""
+
+    def ordered_ids(self, ordering):
+        response = self.guest_client.get(f'/api/recipes/?ordering={ordering}')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def test_popular_and_trending(self):
+        """Старые добавления влияют на популярность, но не на тренд."""
+        first, second, third = self.recipes
+        FavoriteRecipe.objects.create(user=self.user, recipe=first)
+        FavoriteRecipe.objects.create(user=self.author, recipe=first)
+        RecipeShoppingList.objects.create(user=self.user, recipe=second)
+        RecipeShoppingList.objects.create(user=self.author, recipe=second)
+        RecipeShoppingList.objects.filter(recipe=second).update(
+            created=timezone.now() - timedelta(days=10)
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            refresh_scores()
+        self.assertEqual(self.ordered_ids('popular'),
+                         [first.id, second.id, third.id])
+        self.assertEqual(self.ordered_ids('trending'),
+                         [first.id, third.id, second.id])
+
+    def test_refresh_changes_etag(self):
+        """Пересчёт оценок меняет ETag отсортированного списка."""
+        url = '/api/recipes/?ordering=popular'
+        etag = self.guest_client.get(url)['ETag']
+        self.assertEqual(self.guest_client.get('/api/recipes/')['ETag'],
+                         self.guest_client.get('/api/recipes/')['ETag'])
+        FavoriteRecipe.objects.create(user=self.user, recipe=self.recipe)
+        with self.captureOnCommitCallbacks(execute=True):
+            refresh_scores()
+        self.assertNotEqual(self.guest_client.get(url)['ETag'], etag)
+
+    def test_order_matches_score_index(self):
+        """Сортировка идёт через INNER JOIN в порядке индекса оценок."""
+        with CaptureQueriesContext(connection) as queries:
+            ids = self.ordered_ids('trending')
+        self.assertCountEqual(ids, [recipe.id for recipe in self.recipes])
+        sql = ' '.join(query['sql'] for query in queries)
+        self.assertIn('INNER JOIN "recipes_recipescore"', sql)
+        self.assertIn('ORDER BY "recipes_recipescore"."trending" DESC, '
+                      '"recipes_recipescore"."recipe_id" DESC', sql)
+
+
+class TagFacetsTestCase(RecipeDataTestCase):
+    """Счётчики рецептов по тегам для текущих фильтров."""
+
+    def facets(self, query=''):
+        response = self.guest_client.get(f'/api/recipes/facets/{query}')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return {tag['slug']: tag['count'] for tag in response.data}
+
+    def test_counts_cached_and_invalidated(self):
+        """Счётчики кэшируются и пересчитываются после изменений."""
+        lunch = Tag.objects.create(name='Обед', color='#49B64E', slug='lunch')
+        self.assertEqual(self.facets('?tags=lunch'),
+                         {'breakfast': 3, 'lunch': 0})
+        with self.assertNumQueries(0):
+            self.facets('?tags=breakfast')
+        with self.captureOnCommitCallbacks(execute=True):
+            RecipeTag.objects.create(recipe=self.recipe, tag=lunch)
+        self.assertEqual(self.facets(), {'breakfast': 3, 'lunch': 1})
+
+    def test_respects_other_filters(self):
+        """Остальные фильтры списка, в том числе личные, учитываются."""
+        self.assertEqual(self.facets(f'?author={self.author.id}'),
+                         {'breakfast': 3})
+        url = '/api/recipes/facets/?is_favorited=1'
+        response = self.authorized_client.get(url)
+        self.assertEqual(response.data[0]['count'], 0)
+        self.authorized_client.post(f'/api/recipes/{self.recipe.id}/favorite/')
+        response = self.authorized_client.get(url)
+        self.assertEqual(response.data[0]['count'], 1)
+
+
+class TaskQueueTestCase(TransactionTestCase):
+    """Очередь фоновых задач в базе и воркер."""
+
+    def setUp(self):
+        CALLS.clear()
+
+    def test_enqueue_after_commit(self):
+        """Задача попадает в очередь после коммита и выполняется."""
+        with transaction.atomic():
+            enqueue(record_call, 1)
+            enqueue(record_call, 2)
+            self.assertFalse(Task.objects.exists())
+        self.assertEqual(Task.objects.count(), 2)
+        work(threads=2, burst=True)
+        self.assertEqual(sorted(CALLS), [1, 2])
+        self.assertFalse(Task.objects.exists())
+
+    def test_retry_then_fail(self):
+        """Упавшая задача повторяется, затем помечается ошибкой."""
+        enqueue(always_fail)
+        with self.assertLogs('tasks.queue', 'ERROR'):
+            work(threads=1, burst=True)
+        failed = Task.objects.get()
+        self.assertEqual((failed.status, failed.attempts),
+                         (Task.PENDING, 1))
+        Task.objects.update(run_at=timezone.now())
+        with self.assertLogs('tasks.queue', 'ERROR'):
+            work(threads=1, burst=True)
+        failed.refresh_from_db()
+        self.assertEqual(failed.status, Task.FAILED)
+        self.assertIn('сбой задачи', failed.last_error)
+
+    def test_stale_tasks(self):
+        """
+        Зависшая задача возвращается в очередь, пока есть попытки,
+        иначе помечается ошибкой; heartbeat продлевает блокировку.
+        """
+        locked_at = timezone.now() - LOCK_TIMEOUT * 2
+        retry, exhausted, alive = (
+            Task.objects.create(
+                name=record_call.task_name, status=Task.RUNNING,
+                locked_at=locked_at, attempts=attempts, max_attempts=3
+            ) for attempts in (1, 3, 1)
+        )
+        self.assertEqual(heartbeat([alive.id]), 1)
+        self.assertEqual(requeue_stale(), 1)
+        self.assertEqual(
+            {task.id: task.status for task in Task.objects.all()},
+            {retry.id: Task.PENDING, exhausted.id: Task.FAILED,
+             alive.id: Task.RUNNING}
+        )
+
+    @override_settings(TASKS_EAGER=True)
+    def test_eager(self):
+        """В режиме TASKS_EAGER задача выполняется сразу."""
+        enqueue(record_call, 3)
+        self.assertEqual(CALLS, [3])
+        self.assertFalse(Task.objects.exists())
+
+
+class ViewCounterTestCase(RecipeDataTestCase):
+    """Буферизованные счётчики просмотров рецептов."""
+
+    def test_views_flushed_in_batches(self):
+        """Просмотры копятся в буфере и сбрасываются пачкой."""
+        url = f'/api/recipes/{self.recipe.id}/'
+        response = self.guest_client.get(url)
+        self.assertEqual(response.data['views'], 0)
+        self.guest_client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.guest_client.get(f'/api/recipes/{self.recipes[1].id}/')
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.views, 0)
+        with self.assertNumQueries(2):
+            view_counter.flush()
+        self.assertEqual(
+            list(Recipe.objects.order_by('id').values_list('views',
+                                                           flat=True)),
+            [2, 1, 0]
+        )
+        response = self.guest_client.get(f'{url}?fields=views')
+        self.assertEqual(response.data, {'views': 2})
+
+    def test_flush_in_background(self):
+        """Заполненный буфер сбрасывает фоновый поток, а не запрос."""
+        flushed = threading.Event()
+        threads = []
+
+        def flush():
+            threads.append(threading.current_thread().name)
+            flushed.set()
+
+        with mock.patch.object(view_counter, 'flush_size', 1):
+            with mock.patch.object(view_counter, 'flush', flush):
+                self.guest_client.get(f'/api/recipes/{self.recipe.id}/')
+                self.assertTrue(flushed.wait(5))
+        self.assertEqual(threads, ['view-counter'])
+
+    def test_exit_flush_without_table(self):
+        """При выходе без таблицы рецептов буфер не сбрасывается."""
+        view_counter.record(self.recipe.id)
+        tables = mock.patch.object(connection.introspection, 'table_names',
+                                   return_value=[])
+        with tables, mock.patch.object(view_counter, 'flush') as flush:
+            view_counter.flush_at_exit()
+        flush.assert_not_called()
+
+
+class RelationWritesTestCase(RecipeDataTestCase):
+    """Избранное, корзина и подписки одним запросом."""
+
+    def test_single_query_writes(self):
+        """
+        Повторное добавление и удаление - один запрос к базе,
+        когда фрагмент рецепта и множества пользователя в кэше.
+        Запись сбрасывает множество в кэше, а не перезаписывает его.
+        """
+        url = f'/api/recipes/{self.recipe.id}/favorite/'
+        key = USER_SET_KEY.format(self.user.id, FAVORITES)
+        response = self.authorized_client.post(url)
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        self.assertTrue(response.data['is_favorited'])
+        self.assertIsNone(cache.get(key))
+        response = self.authorized_client.post(url)
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        self.authorized_client.get('/api/recipes/')
+        with self.assertNumQueries(1):
+            response = self.authorized_client.delete(url)
+        self.assertEqual(response.status_code, HTTPStatus.NO_CONTENT)
+        self.authorized_client.get('/api/recipes/')
+        with self.assertNumQueries(1):
+            response = self.authorized_client.post(url)
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        self.authorized_client.delete(url)
+        response = self.authorized_client.delete(url)
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        response = self.authorized_client.post('/api/recipes/0/favorite/')
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+    def test_orm_deletes_reset_user_sets(self):
+        """Удаление через ORM и фоновое удаление сбрасывают множества."""
+        url = f'/api/recipes/{self.recipe.id}/'
+        self.authorized_client.post(f'{url}favorite/')
+        self.authorized_client.post(f'{url}shopping_cart/')
+        self.assertTrue(self.authorized_client.get(url).data['is_favorited'])
+        FavoriteRecipe.objects.filter(user=self.user).delete()
+        self.assertFalse(self.authorized_client.get(url).data['is_favorited'])
+        self.assertTrue(
+            self.authorized_client.get(url).data['is_in_shopping_cart']
+        )
+        Recipe.objects.filter(pk=self.recipe.pk).update(is_active=False)
+        purge_recipes([self.recipe.id])
+        self.assertEqual(get_user_sets(self.user_request())[SHOPPING_CART],
+                         frozenset())
+
+    def user_request(self):
+        request = APIRequestFactory().get('/')
+        request.user = self.user
+        return request
+
+    def test_responses_compatible(self):
+        """Ответы совпадают с прежними сериализаторами."""
+        response = self.authorized_client.post(
+            f'/api/recipes/{self.recipe.id}/shopping_cart/'
+        )
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        self.assertEqual(set(response.data),
+                         {'name', 'image', 'author', 'cooking_time'})
+        self.assertEqual(response.data['author'], self.author.id)
+        url = f'/api/users/{self.author.id}/subscribe/'
+        response = self.authorized_client.post(url)
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        self.assertTrue(response.data['is_subscribed'])
+        self.assertEqual(response.data['recipes_count'], 3)
+        response = self.authorized_client.post(url)
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        response = self.authorized_client.post(
+            f'/api/users/{self.user.id}/subscribe/'
+        )
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+
+
+@skipIf(connection.vendor == 'sqlite',
+        'SQLite блокирует таблицы при параллельной записи')
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, TASKS_EAGER=True)
+class RelationWritesStressTestCase(TransactionTestCase):
+    """Параллельные двойные клики не приводят к ошибкам 500."""
+    THREADS = 8
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(
+            email='author@yandex.ru', username='author',
+            first_name='Автор', last_name='Рецептов', password='Qwerty123'
+        )
+        self.users = [
+            User.objects.create_user(
+                email=f'user{number}@yandex.ru', username=f'user{number}',
+                first_name='Вася', last_name='Пупкин', password='Qwerty123'
+            ) for number in range(2)
+        ]
+        self.recipe = Recipe.objects.create(
+            author=self.author, name='Рецепт', text='Описание',
+            image='recipes/images/test.png', cooking_time=10
+        )
+
+    def hammer(self, method, url):
+        def request(user):
+            client = APIClient()
+            client.force_authenticate(user)
+            return getattr(client, method)(url).status_code
+
+        with ThreadPoolExecutor(self.THREADS) as pool:
+            return list(pool.map(request, self.users * self.THREADS))
+
+    def test_concurrent_double_clicks(self):
+        for url in (f'/api/recipes/{self.recipe.id}/favorite/',
+                    f'/api/recipes/{self.recipe.id}/shopping_cart/',
+                    f'/api/users/{self.author.id}/subscribe/'):
+            with self.subTest(url=url):
+                statuses = self.hammer('post', url)
+                self.assertEqual(statuses.count(HTTPStatus.CREATED), 2)
+                self.assertEqual(statuses.count(HTTPStatus.BAD_REQUEST),
+                                 len(statuses) - 2)
+                statuses = self.hammer('delete', url)
+                self.assertEqual(statuses.count(HTTPStatus.NO_CONTENT), 2)
+                self.assertEqual(statuses.count(HTTPStatus.BAD_REQUEST),
+                                 len(statuses) - 2)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, TASKS_EAGER=True,
+                   DATABASE_REPLICAS=['replica1'])
+class ReplicaRoutingTestCase(TransactionTestCase):
+    """Чтение из реплик и закрепление за основной базой после записи."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            email='user@yandex.ru', username='user',
+            first_name='Вася', last_name='Пупкин', password='Qwerty123'
+        )
+        self.recipe = Recipe.objects.create(
+            author=self.user, name='Рецепт', text='Описание',
+            image='recipes/images/test.png', cooking_time=10
+        )
+        self.authorized_client = APIClient()
+        self.authorized_client.force_authenticate(self.user)
+        self.routed = []
+        route = ReplicaRouter.db_for_read
+
+        def record(router, model, **hints):
+            self.routed.append(route(router, model, **hints))
+            return DEFAULT_DB_ALIAS
+
+        patcher = mock.patch.object(ReplicaRouter, 'db_for_read', record)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_routes(self, client, url):
+        self.routed.clear()
+        response = client.get(url)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return set(self.routed)
+
+    def test_router(self):
+        router = ReplicaRouter()
+        self.assertEqual(router.db_for_read(Recipe), DEFAULT_DB_ALIAS)
+        self.routed.clear()
+        token = start_replica_reads()
+        try:
+            Recipe.objects.count()
+            with use_primary():
+                Recipe.objects.count()
+            with transaction.atomic():
+                Recipe.objects.count()
+        finally:
+            stop_replica_reads(token)
+        self.assertEqual(self.routed,
+                         ['replica1', DEFAULT_DB_ALIAS, DEFAULT_DB_ALIAS])
+        self.assertEqual(router.db_for_write(Recipe), DEFAULT_DB_ALIAS)
+        self.assertFalse(router.allow_migrate('replica1', 'recipes'))
+
+    def test_safe_requests_read_from_replica(self):
+        for url in ('/api/tags/', '/api/ingredients/', '/api/recipes/',
+                    f'/api/recipes/{self.recipe.id}/', '/api/users/'):
+            with self.subTest(url=url):
+                self.assertIn('replica1',
+                              self.get_routes(self.authorized_client, url))
+        self.routed.clear()
+        Recipe.objects.count()
+        self.assertEqual(self.routed, [DEFAULT_DB_ALIAS])
+
+    def test_write_pins_user_to_primary(self):
+        response = self.authorized_client.post(
+            f'/api/recipes/{self.recipe.id}/favorite/'
+        )
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        self.assertEqual(
+            self.get_routes(self.authorized_client, '/api/recipes/'),
+            {DEFAULT_DB_ALIAS}
+        )
+        self.assertIn('replica1',
+                      self.get_routes(APIClient(), '/api/recipes/'))
+        cache.delete(PRIMARY_KEY.format(self.user.id))
+        self.assertIn(
+            'replica1',
+            self.get_routes(self.authorized_client, '/api/recipes/')
+        )
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, TASKS_EAGER=True,
+                   ROOT_URLCONF='recipebook.asgi_urls')
+class AsyncReadViewsTestCase(TransactionTestCase):
+    """Асинхронные GET-представления через ASGI и WSGI."""
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(
+            email='author@yandex.ru', username='author',
+            first_name='Автор', last_name='Рецептов', password='Qwerty123'
+        )
+        self.user = User.objects.create_user(
+            email='user@yandex.ru', username='user',
+            first_name='Вася', last_name='Пупкин', password='Qwerty123'
+        )
+        self.tag = Tag.objects.create(
+            name='Завтрак', color='#E26C2D', slug='breakfast'
+        )
+        self.ingredient = Ingredient.objects.create(name='соль', unit='г')
+        self.recipe = Recipe.objects.create(
+            author=self.author, name='Рецепт', text='Описание',
+            image='recipes/images/test.png', cooking_time=10
+        )
+        self.recipe.tags.set([self.tag])
+        RecipeIngredient.objects.create(
+            recipe=self.recipe, ingredient=self.ingredient, amount=5
+        )
+        Follow.objects.create(user=self.user, author=self.author)
+        FavoriteRecipe.objects.create(user=self.user, recipe=self.recipe)
+        self.headers = {
+            'Authorization': f'Token {Token.objects.create(user=self.user)}'
+        }
+        self.urls = (
+            '/api/recipes/', '/api/recipes/?is_favorited=1',
+            f'/api/recipes/{self.recipe.id}/',
+            f'/api/recipes/{self.recipe.id}/?fields=name',
+            '/api/tags/', f'/api/tags/{self.tag.id}/',
+            '/api/ingredients/?name=%D1%81%D0%BE',
+            f'/api/ingredients/{self.ingredient.id}/',
+            '/api/users/subscriptions/',
+        )
+
+    async def test_same_responses_as_wsgi(self):
+        """Независимые шаги идут в отдельных потоках, ответы не меняются."""
+        async_client = AsyncClient()
+        client = Client(headers=self.headers)
+        with mock.patch.object(async_views, 'sync_to_async',
+                               wraps=sync_to_async) as spy:
+            for url in self.urls:
+                with self.subTest(url=url):
+                    response = await async_client.get(url,
+                                                      headers=self.headers)
+                    self.assertEqual(response.status_code, HTTPStatus.OK)
+                    with override_settings(ROOT_URLCONF='recipebook.urls'):
+                        expected = await sync_to_async(client.get)(url)
+                    self.assertEqual(response.json(), expected.json())
+                    self.assertEqual(response.get('ETag'),
+                                     expected.get('ETag'))
+        self.assertIn(mock.call(mock.ANY, thread_sensitive=False,
+                                executor=async_views.get_executor()),
+                      spy.call_args_list)
+        response = await async_client.get(
+            '/api/recipes/?is_favorited=1', headers=self.headers
+        )
+        self.assertEqual(response.json()['count'], 1)
+
+    def test_async_views_only_under_asgi(self):
+        """Под WSGI горячие GET-действия остаются синхронными."""
+        for urlconf, expected in (('recipebook.urls', False),
+                                  ('recipebook.asgi_urls', True)):
+            with self.subTest(urlconf=urlconf):
+                view = resolve('/api/recipes/', urlconf).func
+                self.assertIs(asyncio.iscoroutinefunction(view), expected)
+
+    async def test_conditional_get(self):
+        client = AsyncClient()
+        for url in self.urls[:-1]:
+            with self.subTest(url=url):
+                etag = (await client.get(url, headers=self.headers))['ETag']
+                response = await client.get(
+                    url, headers={**self.headers, 'If-None-Match': etag}
+                )
+                self.assertEqual(response.status_code,
+                                 HTTPStatus.NOT_MODIFIED)
+
+    async def test_errors_and_writes(self):
+        """Ошибки и запросы с записью обрабатываются синхронным вьюсетом."""
+        client = AsyncClient()
+        response = await client.get('/api/recipes/0/')
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+        response = await client.get('/api/users/subscriptions/')
+        self.assertEqual(response.status_code, HTTPStatus.UNAUTHORIZED)
+        response = await client.delete(f'/api/recipes/{self.recipe.id}/')
+        self.assertEqual(response.status_code, HTTPStatus.UNAUTHORIZED)
+        token = await sync_to_async(Token.objects.create)(user=self.author)
+        response = await client.delete(
+            f'/api/recipes/{self.recipe.id}/',
+            headers={'Authorization': f'Token {token}'}
+        )
+        self.assertEqual(response.status_code, HTTPStatus.NO_CONTENT)
+        self.assertFalse(
+            await Recipe.objects.filter(id=self.recipe.id).aexists()
+        )
+
+
+class ConnectionStatsTestCase(TestCase):
+    """
+    Постоянные соединения воркера на отдельном DatabaseWrapper
+    поверх тестовой базы. SQLite в памяти не закрывает соединения,
+    поэтому для неё база заменяется временным файлом.
+    """
+
+    def make_wrapper(self, **options):
+        default = connections[DEFAULT_DB_ALIAS]
+        if default.vendor == 'sqlite':
+            directory = tempfile.mkdtemp()
+            self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+            options.setdefault('NAME', f'{directory}/db.sqlite3')
+        wrapper_class = type(default)
+        if not issubclass(wrapper_class, TrackedConnectionMixin):
+            wrapper_class = type('TrackedDatabaseWrapper',
+                                 (TrackedConnectionMixin, wrapper_class),
+                                 {})
+        wrapper = wrapper_class(
+            {**default.settings_dict, 'CONN_MAX_AGE': 60,
+             'CONN_HEALTH_CHECKS': True, **options},
+            alias='tracked'
+        )
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def request(self, wrapper, queries=2):
+        """Запрос воркера между сигналами request_started и finished."""
+        wrapper.close_if_unusable_or_obsolete()
+        for _ in range(queries):
+            with wrapper.cursor() as cursor:
+                cursor.execute('SELECT 1')
+        wrapper.close_if_unusable_or_obsolete()
+
+    def setUp(self):
+        connection_stats.reset()
+
+    def test_connection_reused_between_requests(self):
+        wrapper = self.make_wrapper()
+        for _ in range(3):
+            self.request(wrapper)
+        stats = connection_stats.snapshot()
+        self.assertEqual(
+            (stats['first_uses'], stats['reused'], stats['connects'],
+             stats['reconnects'], stats['recycled']),
+            (3, 2, 1, 0, 0)
+        )
+        self.assertEqual(stats['open'], 1)
+
+    def test_without_max_age_connection_closed_after_request(self):
+        wrapper = self.make_wrapper(CONN_MAX_AGE=0)
+        for _ in range(2):
+            self.request(wrapper)
+        stats = connection_stats.snapshot()
+        self.assertEqual((stats['reused'], stats['reconnects'],
+                          stats['recycled']), (0, 1, 2))
+
+    def test_old_connection_recycled(self):
+        wrapper = self.make_wrapper()
+        self.request(wrapper)
+        wrapper.close_at = 0
+        self.request(wrapper)
+        stats = connection_stats.snapshot()
+        self.assertEqual((stats['recycled'], stats['reconnects']), (1, 1))
+
+    def test_broken_connection_replaced_on_checkout(self):
+        wrapper = self.make_wrapper()
+        self.request(wrapper)
+        with mock.patch.object(wrapper, 'is_usable', return_value=False):
+            self.request(wrapper)
+        stats = connection_stats.snapshot()
+        self.assertEqual(
+            (stats['health_check_failures'], stats['reconnects'],
+             stats['reused']),
+            (1, 1, 0)
+        )
+
+    def test_forked_worker_does_not_close_parent_connection(self):
+        """
+        Дочерний процесс открывает своё соединение, а унаследованное
+        остаётся рабочим для родителя.
+        """
+        wrapper = self.make_wrapper()
+        self.request(wrapper)
+        inherited = wrapper.connection
+        detach_inherited_connections()
+        self.request(wrapper)
+        self.assertIsNot(wrapper.connection, inherited)
+        inherited.cursor().execute('SELECT 1')
+        stats = connection_stats.snapshot()
+        self.assertEqual((stats['inherited'], stats['reconnects']), (1, 1))
+        inherited.close()
+
+    def test_executor_threads_have_request_boundaries(self):
+        """
+        Шаги в потоках общего пула асинхронных представлений
+        проверяют и освобождают соединения потока, как запрос.
+        """
+        with mock.patch.object(async_views,
+                               'close_old_connections') as close:
+            results = async_to_sync(async_views.gather)(
+                True, lambda: 1, lambda: 2
+            )
+        self.assertEqual(results, [1, 2])
+        self.assertEqual(close.call_count, 4)
+
+    def test_health(self):
+        response = self.client.get('/api/health/')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.json()['databases'][DEFAULT_DB_ALIAS],
+                         'ok')
+        self.assertNotIn('connections', response.json())
+        admin = User.objects.create_user(
+            email='admin@yandex.ru', username='admin', first_name='Админ',
+            last_name='Админов', password='Qwerty123', is_staff=True
+        )
+        client = APIClient()
+        client.force_authenticate(admin)
+        self.assertIn('first_uses',
+                      client.get('/api/health/').json()['connections'])
+        with mock.patch.object(type(connections[DEFAULT_DB_ALIAS]),
+                               'is_usable', return_value=False):
+            response = self.client.get('/api/health/')
+        self.assertEqual(response.status_code,
+                         HTTPStatus.SERVICE_UNAVAILABLE)
+
+
+class DeltaSyncTestCase(RecipeDataTestCase):
+    """Дельта-синхронизация рецептов и справочников."""
+    url = '/api/sync/'
+
+    def sync(self, **params):
+        response = self.guest_client.get(self.url, params)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return response.data
+
+    def test_full_load_pages_by_cursor(self):
+        """Без позиции отдаются все объекты страницами по limit."""
+        first = self.sync(limit=2)
+        self.assertTrue(first['has_more'])
+        second = self.sync(cursor=first['cursor'], limit=2)
+        self.assertFalse(second['has_more'])
+        recipe_ids = [recipe['id'] for page in (first, second)
+                      for recipe in page['recipes']['updated']]
+        self.assertEqual(sorted(recipe_ids),
+                         sorted(recipe.id for recipe in self.recipes))
+        self.assertEqual(
+            [tag['id'] for tag in first['tags']['updated']], [self.tag.id]
+        )
+        self.assertEqual(first['ingredients']['updated'],
+                         [{'id': self.ingredient.id, 'name': 'соль',
+                           'unit': 'г'}])
+        self.assertEqual(second['tags']['updated'], [])
+
+    def test_changes_since_position(self):
+        """Изменённые и удалённые объекты после метки since."""
+        since = timezone.now().isoformat()
+        self.assertEqual(self.sync(since=since)['recipes']['updated'], [])
+        self.recipe.name = 'Новое название'
+        self.recipe.save()
+        deleted_id = self.recipes[1].id
+        self.recipes[1].delete()
+        tag = Tag.objects.create(name='Ужин', color='#49B64E', slug='dinner')
+        ingredient = Ingredient.objects.create(name='перец', unit='г')
+        ingredient_id = ingredient.id
+        ingredient.delete()
+        data = self.sync(since=since)
+        self.assertEqual(
+            [recipe['name'] for recipe in data['recipes']['updated']],
+            ['Новое название']
+        )
+        self.assertEqual(data['recipes']['deleted'], [deleted_id])
+        self.assertEqual([item['id'] for item in data['tags']['updated']],
+                         [tag.id])
+        self.assertEqual(data['ingredients']['deleted'], [ingredient_id])
+        self.assertTrue(Tombstone.objects.filter(
+            kind=Tombstone.RECIPE, object_id=deleted_id
+        ).exists())
+
+    def test_no_user_flags(self):
+        """В рецептах синхронизации нет устаревающих флагов пользователя."""
+        FavoriteRecipe.objects.create(user=self.user, recipe=self.recipe)
+        Follow.objects.create(user=self.user, author=self.author)
+        for query in ('', '?omit=text'):
+            response = self.authorized_client.get(f'{self.url}{query}')
+            self.assertEqual(response.status_code, HTTPStatus.OK)
+            for recipe in response.data['recipes']['updated']:
+                self.assertNotIn('is_favorited', recipe)
+                self.assertNotIn('is_in_shopping_cart', recipe)
+                self.assertNotIn('is_subscribed', recipe['author'])
+        response = self.guest_client.get(self.url, {'fields': 'is_favorited'})
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+
+    def test_invalid_and_expired_position(self):
+        """Некорректный курсор - 400, устаревший - 410."""
+        response = self.guest_client.get(self.url, {'cursor': 'мусор'})
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        since = timezone.now() - timedelta(days=365)
+        response = self.guest_client.get(
+            self.url, {'since': since.isoformat()}
+        )
+        self.assertEqual(response.status_code, HTTPStatus.GONE)
+
+
+class IngredientSnapshotTestCase(RecipeDataTestCase):
+    """Сжатый снимок каталога ингредиентов."""
+    url = '/api/ingredients/snapshot/'
+
+    def test_columnar_snapshot_in_all_encodings(self):
+        """Кодировки отдают одно тело по столбцам со своими ETag."""
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.create(name='вода', unit='мл')
+        plain = self.guest_client.get(self.url, HTTP_ACCEPT_ENCODING='')
+        self.assertNotIn('Content-Encoding', plain)
+        data = json.loads(plain.content)
+        self.assertEqual(data['name'], ['вода', 'соль'])
+        self.assertEqual([data['units'][index] for index in data['unit']],
+                         ['мл', 'г'])
+        compressed = self.guest_client.get(
+            self.url, HTTP_ACCEPT_ENCODING='br;q=0, gzip'
+        )
+        self.assertEqual(compressed['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(compressed.content), plain.content)
+        self.assertNotEqual(compressed['ETag'], plain['ETag'])
+        self.assertIn('Accept-Encoding', compressed['Vary'])
+
+    def test_not_modified_until_catalog_changes(self):
+        """304 по ETag до изменения справочника."""
+        etag = self.guest_client.get(self.url)['ETag']
+        response = self.guest_client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+        self.ingredient.name = 'соль морская'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ingredient.save()
+        response = self.guest_client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertIn('соль морская', json.loads(response.content)['name'])
+
+
+class RecipeBatchTestCase(RecipeDataTestCase):
+    """Рецепты по списку id одним запросом."""
+
+    def test_batch_preserves_order_and_reports_missing(self):
+        """Порядок запроса сохраняется, отсутствующие id в missing."""
+        first, second, third = (recipe.id for recipe in self.recipes)
+        missing = third + 100
+        self.authorized_client.post(f'/api/recipes/{second}/favorite/')
+        response = self.authorized_client.get(
+            '/api/recipes/batch/',
+            {'ids': f'{third},{missing},{first},{second},{third}'}
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        results = response.data['results']
+        self.assertEqual([recipe['id'] for recipe in results],
+                         [third, first, second])
+        self.assertEqual([recipe['is_favorited'] for recipe in results],
+                         [False, False, True])
+        self.assertEqual(response.data['missing'], [missing])
+        listed = {
+            recipe['id']: recipe for recipe in
+            self.authorized_client.get('/api/recipes/').data['results']
+        }
+        self.assertEqual(results, [listed[third], listed[first],
+                                   listed[second]])
+
+    def test_batch_validates_ids(self):
+        """Без id, с нечисловыми, вне bigint и сверх лимита id - 400."""
+        for ids in ('', 'abc', '0', '-1', str(2 ** 63),
+                    '99999999999999999999999',
+                    ','.join(map(str, range(1, 102)))):
+            response = self.guest_client.get('/api/recipes/batch/',
+                                             {'ids': ids})
+            self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        url = f'/api/recipes/cook/?ingredients={2 ** 63}'
+        self.assertEqual(self.guest_client.get(url).status_code,
+                         HTTPStatus.BAD_REQUEST)
+
+    def test_out_of_range_pk(self):
+        """id вне bigint в адресе - 404, в теле запроса - 400."""
+        huge = 2 ** 63
+        for method, url in (
+            ('get', f'/api/recipes/{huge}/'),
+            ('get', f'/api/recipes/{huge}/similar/'),
+            ('post', f'/api/recipes/{huge}/favorite/'),
+            ('delete', f'/api/recipes/{huge}/shopping_cart/'),
+            ('post', f'/api/recipes/{huge}/fork/'),
+            ('post', f'/api/users/{huge}/subscribe/'),
+            ('patch', f'/api/recipes/{huge}/'),
+            ('delete', f'/api/recipes/{huge}/'),
+            ('get', f'/api/tags/{huge}/'),
+            ('get', f'/api/ingredients/{huge}/'),
+            ('get', f'/api/users/{huge}/'),
+        ):
+            response = getattr(self.authorized_client, method)(url)
+            self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND,
+                             (method, url))
+        response = self.guest_client.post(
+            '/api/recipes/shopping_list/', {'recipes': [{'id': huge}]},
+            format='json'
+        )
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+
+
+class RecipeTransferTestCase(RecipeDataTestCase):
+    """Выгрузка и загрузка рецептов в JSONL."""
+
+    def setUp(self):
+        super().setUp()
+        path = os.path.join(TEMP_MEDIA_ROOT, self.recipe.image.name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as image:
+            image.write(b'png')
+        self.images_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.images_dir, True)
+
+    def export(self):
+        output = io.StringIO()
+        self.assertEqual(
+            sum(export_recipes(output, self.images_dir, batch_size=2)), 3
+        )
+        return output.getvalue().splitlines()
+
+    def test_round_trip_with_resume(self):
+        """Рецепты восстанавливаются со связями, ошибки и offset."""
+        lines = self.export()
+        pub_date = self.recipes[2].pub_date
+        Recipe.objects.all().delete()
+        broken = json.loads(lines[1])
+        broken['author'] = 'nobody@yandex.ru'
+        lines[1] = json.dumps(broken)
+        batches = list(import_recipes(lines, self.images_dir, offset=0,
+                                      batch_size=2))
+        self.assertEqual([batch[:2] for batch in batches], [(2, 1), (3, 1)])
+        self.assertEqual(batches[0][2],
+                         [(2, 'нет автора nobody@yandex.ru')])
+        recipe = Recipe.objects.get(name='Рецепт 2')
+        self.assertEqual(recipe.pub_date, pub_date)
+        self.assertEqual(list(recipe.tags.all()), [self.tag])
+        self.assertEqual(list(recipe.recipeingredient_set.values_list(
+            'ingredient_id', 'amount')), [(self.ingredient.id, 5)])
+        self.assertTrue(recipe.image.storage.exists(recipe.image.name))
+        broken['author'] = self.author.email
+        lines[1] = json.dumps(broken)
+        batches = list(import_recipes(lines, self.images_dir, offset=1))
+        self.assertEqual(batches[0][1], 1)
+        self.assertEqual(
+            [reason for _, reason in batches[0][2]],
+            ['рецепт с таким названием уже есть']
+        )
+        self.assertEqual(Recipe.objects.count(), 3)
+
+    def test_failed_batch_rolls_back_catalog_and_images(self):
+        """Упавшая пачка не оставляет ингредиентов и изображений."""
+        lines = self.export()
+        record = json.loads(lines[0])
+        record['name'] = 'Новый рецепт'
+        record['ingredients'] = [
+            {'name': 'Новый ингредиент', 'unit': 'г', 'amount': 1}
+        ]
+        images = os.path.join(TEMP_MEDIA_ROOT, IMAGE_UPLOAD_TO)
+        before = set(os.listdir(images))
+        with mock.patch.object(RecipeScore.objects, 'bulk_create',
+                               side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                list(import_recipes([json.dumps(record)], self.images_dir))
+        self.assertFalse(
+            Ingredient.objects.filter(name='Новый ингредиент').exists()
+        )
+        self.assertFalse(Recipe.objects.filter(name='Новый рецепт').exists())
+        self.assertEqual(set(os.listdir(images)), before)
+
+
+class BackgroundDeletionTestCase(RecipeDataTestCase):
+    """Скрытие при удалении и удаление связанных строк пачками."""
+
+    def setUp(self):
+        super().setUp()
+        self.author_client = APIClient()
+        self.author_client.force_authenticate(self.author)
+        FavoriteRecipe.objects.create(user=self.user, recipe=self.recipe)
+        Follow.objects.create(user=self.user, author=self.author)
+
+    @override_settings(TASKS_EAGER=False)
+    def test_recipe_hidden_then_purged_in_batches(self):
+        """Рецепт пропадает сразу, строки удаляются пачками."""
+        recipe_id = self.recipe.id
+        response = self.author_client.delete(f'/api/recipes/{recipe_id}/')
+        self.assertEqual(response.status_code, HTTPStatus.NO_CONTENT)
+        response = self.guest_client.get(f'/api/recipes/{recipe_id}/')
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+        self.assertNotIn(recipe_id, [
+            recipe['id'] for recipe in
+            self.guest_client.get('/api/recipes/').data['results']
+        ])
+        self.assertTrue(Tombstone.objects.filter(object_id=recipe_id))
+        self.assertTrue(FavoriteRecipe.objects.filter(recipe_id=recipe_id))
+        reports = []
+        deleted = purge_recipes([recipe_id], batch_size=1,
+                                progress=lambda rows: reports.append(
+                                    sum(rows.values())))
+        self.assertEqual(deleted['recipes.Recipe'], 1)
+        self.assertEqual(deleted['recipes.FavoriteRecipe'], 1)
+        self.assertEqual(deleted['recipes.RecipeIngredient'], 1)
+        self.assertEqual(reports, sorted(reports))
+        self.assertGreater(len(reports), 3)
+        self.assertFalse(Recipe.all_objects.filter(id=recipe_id).exists())
+        self.assertFalse(FavoriteRecipe.objects.filter(recipe_id=recipe_id))
+
+    @override_settings(TASKS_EAGER=False)
+    def test_links_to_hidden_objects_not_found(self):
+        """
+        Скрытый рецепт нельзя добавить в избранное и корзину,
+        на деактивированного автора нельзя подписаться.
+        """
+        hidden = self.recipes[1].id
+        self.author_client.delete(f'/api/recipes/{hidden}/')
+        for name, model in (('favorite', FavoriteRecipe),
+                            ('shopping_cart', RecipeShoppingList)):
+            response = self.authorized_client.post(
+                f'/api/recipes/{hidden}/{name}/'
+            )
+            self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+            self.assertFalse(model.objects.filter(recipe_id=hidden).exists())
+        User.objects.filter(id=self.author.id).update(is_active=False)
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(
+            email='reader@yandex.ru', username='reader', password='Qwerty123'
+        ))
+        response = client.post(f'/api/users/{self.author.id}/subscribe/')
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+        self.assertEqual(Follow.objects.filter(author=self.author).count(), 1)
+
+    @override_settings(TASKS_EAGER=False)
+    def test_hidden_recipe_leaves_relations(self):
+        """
+        Скрытый рецепт до фонового удаления не попадает в список
+        покупок и похожие, ход удаления виден администратору.
+        """
+        rebuild_index()
+        hidden, other, _ = (recipe.id for recipe in self.recipes)
+        self.assertIn(hidden, dict(find_similar(other, 5)))
+        for recipe_id in (hidden, other):
+            self.authorized_client.post(
+                f'/api/recipes/{recipe_id}/shopping_cart/'
+            )
+        self.author_client.delete(f'/api/recipes/{hidden}/')
+        response = self.authorized_client.get(
+            '/api/recipes/download_shopping_cart/'
+        )
+        self.assertEqual(response.content.decode(),
+                         'Список покупок:\n- соль (г) - 5')
+        self.assertNotIn(hidden, dict(find_similar(other, 5)))
+        rebuild_index()
+        self.assertNotIn(hidden, dict(find_similar(other, 5)))
+        admin_client = APIClient()
+        admin_client.force_authenticate(User.objects.create_user(
+            email='admin@yandex.ru', username='admin', password='Qwerty123',
+            is_staff=True
+        ))
+        url = f'/api/deletions/recipes/{hidden}/'
+        self.assertEqual(self.author_client.get(url).status_code,
+                         HTTPStatus.FORBIDDEN)
+        self.assertEqual(admin_client.get(url).data,
+                         {'deleted': {}, 'finished': False})
+        delete_recipes([hidden])
+        self.assertTrue(admin_client.get(url).data['finished'])
+        self.assertEqual(admin_client.get('/api/deletions/recipes/0/')
+                         .status_code, HTTPStatus.NOT_FOUND)
+
+    def test_user_deactivated_and_purged(self):
+        """Удаление аккаунта: данные удаляются в фоне с отчётом."""
+        author_id = self.author.id
+        with override_settings(TASKS_EAGER=False):
+            response = self.author_client.delete(
+                '/api/users/me/', {'current_password': 'Qwerty123'}
+            )
+            self.assertEqual(response.status_code, HTTPStatus.NO_CONTENT)
+            self.assertFalse(User.objects.get(id=author_id).is_active)
+            self.assertEqual(
+                self.guest_client.get('/api/recipes/').data['count'], 0
+            )
+            response = self.authorized_client.get(
+                '/api/users/subscriptions/'
+            )
+            self.assertEqual(response.data['count'], 0)
+        delete_user(author_id)
+        self.assertFalse(User.objects.filter(id=author_id).exists())
+        self.assertFalse(Recipe.all_objects.filter(author_id=author_id))
+        self.assertFalse(Follow.objects.filter(author_id=author_id))
+        progress = get_progress('user', author_id)
+        self.assertTrue(progress['finished'])
+        self.assertEqual(progress['deleted']['recipes.Recipe'], 3)
+
+
+class IngredientDemandTestCase(RecipeDataTestCase):
+    """Спрос на ингредиенты по спискам покупок."""
+
+    def setUp(self):
+        super().setUp()
+        for recipe in self.recipes[:2]:
+            RecipeShoppingList.objects.create(user=self.user, recipe=recipe)
+        RecipeShoppingList.objects.create(user=self.author,
+                                          recipe=self.recipe)
+        inactive = User.objects.create_user(
+            email='gone@yandex.ru', username='gone', password='Qwerty123',
+            is_active=False
+        )
+        RecipeShoppingList.objects.create(user=inactive, recipe=self.recipe)
+
+    def test_demand_by_week_and_tag(self):
+        """Итог и разбивка по тегу без неактивных пользователей."""
+        columns = ingredient_demand(active_carts(), chunk_size=1)
+        week = timezone.localdate() - timedelta(
+            days=timezone.localdate().weekday()
+        )
+        self.assertEqual(columns, {
+            'week': [week, week],
+            'tag': ['', 'breakfast'],
+            'ingredient': ['соль', 'соль'],
+            'unit': ['г', 'г'],
+            'amount': [15, 15],
+            'carts': [3, 3],
+        })
+
+    def test_command_writes_csv(self):
+        """Команда пишет CSV с заголовком."""
+        output = io.StringIO()
+        call_command('ingredient_demand', stdout=output, stderr=io.StringIO())
+        lines = output.getvalue().splitlines()
+        self.assertEqual(lines[0], 'week,tag,ingredient,unit,amount,carts')
+        self.assertEqual(len(lines), 3)
+
+    def test_admin_streams_csv(self):
+        """Админка отдаёт тот же CSV потоком."""
+        admin = User.objects.create_superuser(
+            email='admin@yandex.ru', username='admin', first_name='Админ',
+            last_name='Админов', password='Qwerty123'
+        )
+        client = Client()
+        client.force_login(admin)
+        response = client.get(
+            reverse('admin:recipes_recipeshoppinglist_demand')
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertTrue(response.streaming)
+        output = io.StringIO()
+        call_command('ingredient_demand', stdout=output, stderr=io.StringIO())
+        self.assertEqual(
+            b''.join(response.streaming_content).decode().splitlines(),
+            output.getvalue().splitlines()
+        )
+
+
+class PlannedShoppingListTestCase(RecipeDataTestCase):
+    """Список покупок для набора рецептов с множителями порций."""
+
+    url = '/api/recipes/shopping_list/'
+
+    def test_weighted_amounts(self):
+        """Количества умножаются на порции, повторы складываются."""
+        first, second, _ = (recipe.id for recipe in self.recipes)
+        missing = first + 100
+        with self.assertNumQueries(2):
+            response = self.guest_client.post(self.url, {'recipes': [
+                {'id': first, 'portions': '1.5'},
+                {'id': second},
+                {'id': first, 'portions': '0.25'},
+                {'id': missing},
+            ]}, format='json')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.data, {
+            'ingredients': [{'id': self.ingredient.id, 'name': 'соль',
+                             'unit': 'г', 'amount': 13.75}],
+            'missing': [missing],
+        })
+        self.assertFalse(RecipeShoppingList.objects.exists())
+
+    def test_text_file(self):
+        """format=txt отдаёт файл как download_shopping_cart."""
+        response = self.guest_client.post(self.url, {
+            'recipes': [{'id': recipe.id, 'portions': 2}
+                        for recipe in self.recipes],
+            'format': 'txt',
+        }, format='json')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.content.decode(),
+                         'Список покупок:\n- соль (г) - 30')
+        self.assertIn('attachment', response['Content-Disposition'])
+
+    def test_validation(self):
+        """Пустой набор, нулевые порции и сверх лимита - 400."""
+        for recipes in ([], [{'id': self.recipe.id, 'portions': 0}],
+                        [{'id': number} for number in range(1, 102)]):
+            response = self.guest_client.post(
+                self.url, {'recipes': recipes}, format='json'
+            )
+            self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+
+
+class RecipeForkTestCase(RecipeDataTestCase):
+    """Копирование рецепта."""
+
+    def test_fork_copies_relations_and_shares_image(self):
+        """Копия с ингредиентами, тегами и тем же файлом изображения."""
+        url = f'/api/recipes/{self.recipe.id}/fork/'
+        response = self.authorized_client.post(url)
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        self.assertEqual(response.data['name'], 'Рецепт 0 (копия)')
+        self.assertEqual(response.data['author']['id'], self.user.id)
+        fork = Recipe.objects.get(pk=response.data['id'])
+        self.assertEqual(fork.image.name, self.recipe.image.name)
+        self.assertEqual(list(fork.tags.all()), [self.tag])
+        self.assertEqual(
+            list(fork.recipeingredient_set.values_list(
+                'ingredient_id', 'amount'
+            )),
+            [(self.ingredient.id, 5)]
+        )
+        self.assertTrue(RecipeScore.objects.filter(recipe=fork).exists())
+        names = [self.authorized_client.post(url).data['name']
+                 for _ in range(2)]
+        self.assertEqual(names, ['Рецепт 0 (копия 2)',
+                                 'Рецепт 0 (копия 3)'])
+
+    def test_fork_errors(self):
+        """Гость - 401, несуществующий рецепт - 404."""
+        url = f'/api/recipes/{self.recipe.id}/fork/'
+        self.assertEqual(self.guest_client.post(url).status_code,
+                         HTTPStatus.UNAUTHORIZED)
+        response = self.authorized_client.post(
+            f'/api/recipes/{self.recipes[-1].id + 100}/fork/'
+        )
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
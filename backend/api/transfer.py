@@ -0,0 +1,301 @@
+import json
+import os
+import shutil
+from collections import defaultdict
+
+from django.core.files import File
+from django.db import transaction
+from django.db.models import Case, DateTimeField, Value, When
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from recipes.models import (
+    Ingredient,
+    Recipe,
+    RecipeIngredient,
+    RecipeScore,
+    RecipeTag,
+    Tag
+)
+from recipes.versions import INGREDIENTS, RECIPES, bump_version
+from users.models import User
+from .representations import image_storage
+from .similarity import index_recipes
+from .snapshots import get_ingredient_snapshot
+
+TRANSFER_BATCH_SIZE = 500
+RECIPE_KEYS = ('name', 'text', 'cooking_time', 'image', 'author', 'tags',
+               'ingredients')
+IMAGE_UPLOAD_TO = Recipe._meta.get_field('image').upload_to
+
+
+def export_recipes(output, images_dir=None, batch_size=TRANSFER_BATCH_SIZE):
+    """
+    Выгрузка рецептов в JSONL: по строке на рецепт, автор по email,
+    теги по слагу, ингредиенты по названию и единице измерения.
+    Рецепты читаются пачками по id, изображения копируются
+    в images_dir под своими именами в хранилище.
+    Генератор: после каждой пачки отдаёт число выгруженных рецептов.
+    """
+    last_id = 0
+    while True:
+        rows = list(Recipe.objects.filter(id__gt=last_id).order_by(
+            'id'
+        ).values('id', 'name', 'text', 'cooking_time', 'image',
+                 'pub_date', 'author__email')[:batch_size])
+        if not rows:
+            return
+        recipe_ids = [row['id'] for row in rows]
+        tags = defaultdict(list)
+        for recipe_id, slug in RecipeTag.objects.filter(
+            recipe_id__in=recipe_ids
+        ).order_by('pk').values_list('recipe_id', 'tag__slug'):
+            tags[recipe_id].append(slug)
+        ingredients = defaultdict(list)
+        for recipe_id, name, unit, amount in RecipeIngredient.objects.filter(
+            recipe_id__in=recipe_ids
+        ).order_by('pk').values_list('recipe_id', 'ingredient__name',
+                                     'ingredient__unit', 'amount'):
+            ingredients[recipe_id].append(
+                {'name': name, 'unit': unit, 'amount': amount}
+            )
+        for row in rows:
+            if images_dir and row['image']:
+                _copy_image(row['image'], images_dir)
+            output.write(json.dumps({
+                'name': row['name'],
+                'text': row['text'],
+                'cooking_time': row['cooking_time'],
+                'image': row['image'],
+                'pub_date': row['pub_date'].isoformat(),
+                'author': row['author__email'],
+                'tags': tags[row['id']],
+                'ingredients': ingredients[row['id']],
+            }, ensure_ascii=False) + '\n')
+        last_id = recipe_ids[-1]
+        yield len(rows)
+
+
+def _copy_image(name, images_dir):
+    """
+    Копия изображения из хранилища. Отсутствующий файл пропускается:
+    при загрузке такой рецепт попадёт в ошибки.
+    """
+    path = os.path.join(images_dir, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        source = image_storage.open(name, 'rb')
+    except FileNotFoundError:
+        return
+    with source, open(path, 'wb') as target:
+        shutil.copyfileobj(source, target)
+
+
+def _parse_record(line):
+    """Рецепт из строки JSONL; ValueError с причиной при ошибке."""
+    try:
+        record = json.loads(line)
+    except json.JSONDecodeError as error:
+        raise ValueError(f'некорректный JSON: {error}')
+    if not isinstance(record, dict):
+        raise ValueError('ожидается объект')
+    missing = [key for key in RECIPE_KEYS if not record.get(key)]
+    if missing:
+        raise ValueError(f'нет полей {", ".join(missing)}')
+    if not 1 <= int(record['cooking_time']) <= 480:
+        raise ValueError('время приготовления вне 1-480')
+    for ingredient in record['ingredients']:
+        if not ingredient['name'] or not ingredient['unit']:
+            raise ValueError('нет названия или единицы ингредиента')
+        if not 1 <= int(ingredient['amount']) <= 5000:
+            raise ValueError('количество ингредиента вне 1-5000')
+    if record.get('pub_date') and parse_datetime(record['pub_date']) is None:
+        raise ValueError('некорректная pub_date')
+    return record
+
+
+def _image_path(images_dir, name):
+    root = os.path.abspath(images_dir)
+    path = os.path.abspath(os.path.join(root, name))
+    if not path.startswith(root + os.sep) or not os.path.isfile(path):
+        raise ValueError(f'нет файла изображения {name}')
+    return path
+
+
+def _resolve_ingredients(records):
+    """
+    id ингредиентов по (название, единица) одним запросом на пачку.
+    Недостающие ингредиенты создаются. Возвращает словарь
+    и признак, что справочник изменился.
+    """
+    keys = {(item['name'], item['unit'])
+            for record in records for item in record['ingredients']}
+    names = {name for name, _ in keys}
+
+    def fetch():
+        return {
+            (name, unit): ingredient_id
+            for ingredient_id, name, unit in Ingredient.objects.filter(
+                name__in=names
+            ).values_list('id', 'name', 'unit')
+            if (name, unit) in keys
+        }
+
+    ingredient_ids = fetch()
+    missing = keys - ingredient_ids.keys()
+    if not missing:
+        return ingredient_ids, False
+    Ingredient.objects.bulk_create(
+        (Ingredient(name=name, unit=unit) for name, unit in missing),
+        ignore_conflicts=True,
+    )
+    return fetch(), True
+
+
+def _write_batch(valid, authors, tags, saved_images):
+    """
+    Запись проверенных рецептов пачки; вызывается в транзакции.
+    Имена сохранённых изображений добавляются в saved_images,
+    чтобы при откате их можно было удалить.
+    Возвращает (рецепты, {id: {ингредиент: количество}},
+    изменился ли справочник ингредиентов).
+    """
+    ingredient_ids, catalog_changed = _resolve_ingredients(valid)
+    if catalog_changed:
+        transaction.on_commit(lambda: bump_version(INGREDIENTS))
+    for record in valid:
+        with open(record['image'], 'rb') as image:
+            record['image'] = image_storage.save(
+                os.path.join(IMAGE_UPLOAD_TO,
+                             os.path.basename(record['image'])),
+                File(image)
+            )
+        saved_images.append(record['image'])
+    now = timezone.now()
+    recipes = Recipe.objects.bulk_create(
+        Recipe(author_id=authors[record['author']],
+               name=record['name'], text=record['text'],
+               cooking_time=record['cooking_time'],
+               image=record['image'])
+        for record in valid
+    )
+    pub_dates = [
+        When(id=recipe.id,
+             then=Value(parse_datetime(record['pub_date'])))
+        for recipe, record in zip(recipes, valid)
+        if record.get('pub_date')
+    ]
+    if pub_dates:
+        Recipe.objects.filter(id__in=[
+            recipe.id for recipe in recipes
+        ]).update(pub_date=Case(
+            *pub_dates, default='pub_date', output_field=DateTimeField()
+        ))
+    RecipeTag.objects.bulk_create(
+        RecipeTag(recipe=recipe, tag_id=tags[slug])
+        for recipe, record in zip(recipes, valid)
+        for slug in dict.fromkeys(record['tags'])
+    )
+    recipe_ingredients = {}
+    for recipe, record in zip(recipes, valid):
+        recipe_ingredients[recipe.id] = {}
+        for item in record['ingredients']:
+            recipe_ingredients[recipe.id].setdefault(
+                ingredient_ids[(item['name'], item['unit'])],
+                int(item['amount'])
+            )
+    RecipeIngredient.objects.bulk_create(
+        RecipeIngredient(recipe_id=recipe_id, ingredient_id=ingredient_id,
+                         amount=amount)
+        for recipe_id, amounts in recipe_ingredients.items()
+        for ingredient_id, amount in amounts.items()
+    )
+    RecipeScore.objects.bulk_create(
+        (RecipeScore(recipe=recipe, refreshed_at=now)
+         for recipe in recipes),
+        ignore_conflicts=True,
+    )
+    transaction.on_commit(lambda: bump_version(RECIPES))
+    return recipes, recipe_ingredients, catalog_changed
+
+
+def import_batch(lines, images_dir):
+    """
+    Запись пачки [(номер строки, строка)] в одной транзакции
+    через bulk_create. Авторы, теги и ингредиенты разрешаются
+    по естественным ключам одним запросом на пачку; рецепты
+    с уже существующим названием пропускаются, поэтому повторный
+    импорт файла безопасен. Новые ингредиенты и изображения
+    пишутся в той же транзакции; при откате изображения удаляются.
+    Возвращает (создано, [(номер, причина)]).
+    """
+    errors = []
+    records = []
+    for number, line in lines:
+        try:
+            records.append((number, _parse_record(line)))
+        except (KeyError, TypeError, ValueError) as error:
+            errors.append((number, str(error)))
+    names = {record['name'] for _, record in records}
+    taken = set(Recipe.all_objects.filter(name__in=names).values_list(
+        'name', flat=True
+    ))
+    authors = dict(User.objects.filter(email__in={
+        record['author'] for _, record in records
+    }).values_list('email', 'id'))
+    tags = dict(Tag.objects.filter(slug__in={
+        slug for _, record in records for slug in record['tags']
+    }).values_list('slug', 'id'))
+    valid = []
+    for number, record in records:
+        unknown = set(record['tags']) - tags.keys()
+        if record['name'] in taken:
+            errors.append((number, 'рецепт с таким названием уже есть'))
+        elif record['author'] not in authors:
+            errors.append((number, f'нет автора {record["author"]}'))
+        elif unknown:
+            errors.append((number, f'нет тегов {", ".join(sorted(unknown))}'))
+        else:
+            try:
+                record['image'] = _image_path(images_dir, record['image'])
+            except ValueError as error:
+                errors.append((number, str(error)))
+                continue
+            taken.add(record['name'])
+            valid.append(record)
+    if not valid:
+        return 0, errors
+    saved_images = []
+    try:
+        with transaction.atomic():
+            recipes, recipe_ingredients, catalog_changed = _write_batch(
+                valid, authors, tags, saved_images
+            )
+    except Exception:
+        for name in saved_images:
+            image_storage.delete(name)
+        raise
+    index_recipes({recipe_id: list(amounts)
+                   for recipe_id, amounts in recipe_ingredients.items()})
+    if catalog_changed:
+        get_ingredient_snapshot()
+    return len(recipes), errors
+
+
+def import_recipes(stream, images_dir, offset=0,
+                   batch_size=TRANSFER_BATCH_SIZE):
+    """
+    Загрузка рецептов из JSONL пачками по batch_size строк,
+    начиная со строки offset + 1. Генератор: после каждой пачки
+    отдаёт (номер последней строки, создано, ошибки пачки).
+    """
+    batch = []
+    for number, line in enumerate(stream, start=1):
+        if number <= offset or not line.strip():
+            continue
+        batch.append((number, line))
+        if len(batch) >= batch_size:
+            yield (number, *import_batch(batch, images_dir))
+            batch = []
+    if batch:
+        yield (batch[-1][0], *import_batch(batch, images_dir))
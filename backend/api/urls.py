@@ -1,11 +1,15 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
+from .async_views import async_read_urls
 from .views import (
     IngredientViewSet,
     RecipeViewSet,
     TagViewSet,
-    CustomUserViewSet
+    CustomUserViewSet,
+    deletion_progress,
+    health,
+    sync
 )
 
 app_name = 'api'
@@ -17,8 +21,24 @@ router.register(r'recipes', RecipeViewSet, basename='recipes')
 router.register(r'users', CustomUserViewSet, basename='users')
 
 
-urlpatterns = [
-    path('', include(router.urls)),
-    path('', include('djoser.urls')),
-    path('auth/', include('djoser.urls.authtoken')),
-]
+def get_urlpatterns(asynchronous=False):
+    """
+    URL API. С asynchronous горячие GET-действия роутера
+    обслуживаются асинхронными представлениями - только для ASGI
+    (recipebook.asgi_urls), под WSGI остаются синхронные вьюсеты.
+    """
+    router_urls = router.urls
+    if asynchronous:
+        router_urls = async_read_urls(router_urls)
+    return [
+        path('health/', health, name='health'),
+        path('sync/', sync, name='sync'),
+        path('deletions/<str:kind>/<int:object_id>/', deletion_progress,
+             name='deletion-progress'),
+        path('', include(router_urls)),
+        path('', include('djoser.urls')),
+        path('auth/', include('djoser.urls.authtoken')),
+    ]
+
+
+urlpatterns = get_urlpatterns()
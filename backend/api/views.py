@@ -1,30 +1,169 @@
+from functools import partial
+
 from django.contrib.auth.hashers import make_password
+from django.db import DatabaseError, connections
+from django.db.models import Count, Max
+from django.http import Http404
 from django.http.response import HttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_vary_headers
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
 from rest_framework import permissions, status, viewsets
-from rest_framework.decorators import action
+from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 
+from .cache import (
+    FAVORITES,
+    FOLLOWING,
+    SHOPPING_CART,
+    get_recipes_data,
+    get_user_sets,
+    get_user_sets_signature,
+    update_user_set
+)
+from .counters import view_counter
+from .mixins import (
+    ConditionalGetMixin,
+    ReplicaReadMixin,
+    conditional_get
+)
+from .fieldsets import get_fieldset
+from .pagination import FeedPagination
+from .representations import (
+    RECIPE_DETAIL_FIELDS,
+    RECIPE_FIELDS,
+    SHORT_RECIPE_FIELDS,
+    SUBSCRIPTION_FIELDS,
+    USER_FIELDS,
+    USER_FLAG_FIELDS,
+    build_subscriptions
+)
 from .serializers import (
+    MAX_ID,
     CustomUserSerializer,
-    FavoriteRecipeSerializer,
     IngredientSerializer,
+    PlannedShoppingListSerializer,
     RecipeCreateUpdateSerializer,
     RecipeSerializer,
-    RecipeShoppingListSerializer,
-    SubscriptionsSerializer,
     TagSerializer
 )
 from .filters import IngredientFilter, RecipeFilter
 from .permissions import AuthorOnly
-from recipes.models import Ingredient, Recipe, Tag
+from recipes.models import (
+    FavoriteRecipe,
+    Ingredient,
+    Recipe,
+    RecipeShoppingList,
+    Tag
+)
+from recipebook.dbstats import connection_stats
+from recipes.versions import (
+    INGREDIENTS,
+    SCORES,
+    TAGS,
+    get_version,
+    get_versions
+)
+from tasks.queue import enqueue
 from users.models import Follow, User
-from .services import get_ingredients
+from .pantry import get_index
+from .similarity import find_similar
+from .purge import PURGE_KINDS, get_progress
+from .snapshots import IDENTITY, choose_encoding, get_ingredient_snapshot
+from .tasks import (
+    index_similarity,
+    schedule_recipe_deletion,
+    schedule_user_deletion,
+    warm_recipe_fragments
+)
+from .sync import get_changes
+from .services import (
+    add_link,
+    backfill_feed,
+    fork_recipe,
+    get_feed,
+    get_ingredients,
+    get_planned_ingredients,
+    get_tag_facets,
+    prune_feed
+)
 
+SIMILAR_LIMIT = 6
+BATCH_LIMIT = 100
+PANTRY_MAX_MISSING = 2
 
-class CustomUserViewSet(UserViewSet):
+
+def _parse_pk(value):
+    """id из URL; нечисловой или вне 1..MAX_ID (bigint) - 404."""
+    try:
+        pk = int(value)
+    except (TypeError, ValueError):
+        raise Http404
+    if not 0 < pk <= MAX_ID:
+        raise Http404
+    return pk
+
+
+class PkLookupMixin:
+    """Объект из URL: нечисловой id и id вне bigint - 404 до запроса."""
+
+    def get_object(self):
+        lookup = self.lookup_url_kwarg or self.lookup_field
+        if lookup in self.kwargs:
+            _parse_pk(self.kwargs[lookup])
+        return super().get_object()
+
+
+def _parse_ids(request, param):
+    """
+    Целые id из повторяющегося или перечисленного
+    через запятую параметра в порядке запроса, без повторов.
+    id вне 1..MAX_ID (bigint) - ошибка 400, а не переполнение в базе.
+    """
+    try:
+        ids = list(dict.fromkeys(
+            int(value) for values in request.query_params.getlist(param)
+            for value in values.split(',') if value.strip()
+        ))
+    except ValueError:
+        raise ValidationError({param: 'Ожидаются целые id.'})
+    if not all(0 < pk <= MAX_ID for pk in ids):
+        raise ValidationError({param: f'Ожидаются id от 1 до {MAX_ID}.'})
+    return ids
+
+
+def _delete_link(queryset):
+    """
+    Удаление связи одним DELETE без сигналов: множество пользователя
+    сбрасывает вызывающий код через update_user_set.
+    """
+    return queryset._raw_delete(queryset.db)
+
+
+def _amount(value):
+    """Количество без лишних нулей: целое или с дробной частью."""
+    value = value.normalize()
+    return int(value) if value == value.to_integral_value() else float(value)
+
+
+def _shopping_list_file(ingredients):
+    """Текстовый файл списка покупок из (название, единица, количество)."""
+    shopping_list = 'Список покупок:'
+    for ingredient in ingredients:
+        shopping_list += (
+            f"\n- {ingredient[0]} "
+            f"({ingredient[1]}) - "
+            f"{ingredient[2]}")
+    file = 'shopping_list.txt'
+    response = HttpResponse(shopping_list, content_type='text/plain')
+    response['Content-Disposition'] = f'attachment; filename="{file}.txt"'
+    return response
+
+
+class CustomUserViewSet(PkLookupMixin, ReplicaReadMixin, UserViewSet):
     """
     Вьюсет обработки всех запросов
     пользователей и  подписок.
@@ -32,6 +171,40 @@ class CustomUserViewSet(UserViewSet):
     queryset = User.objects.all()
     serializer_class = CustomUserSerializer
 
+    def get_queryset(self):
+        """
+        Для чтения выбираются только колонки запрошенных полей,
+        деактивированные пользователи не выводятся.
+        """
+        queryset = super().get_queryset()
+        if self.action not in ('list', 'retrieve'):
+            return queryset
+        queryset = queryset.filter(is_active=True)
+        fields = get_fieldset(self.request, CustomUserSerializer.Meta.fields)
+        if fields is None:
+            return queryset
+        return queryset.only(*(name for name in USER_FIELDS
+                               if name in fields))
+
+    def get_serializer(self, *args, **kwargs):
+        """
+        Сериализатор только с полями из параметров fields и omit:
+        исключённые поля не вычисляются.
+        """
+        serializer = super().get_serializer(*args, **kwargs)
+        if self.request.method != 'GET':
+            return serializer
+        target = getattr(serializer, 'child', serializer)
+        fields = get_fieldset(self.request, tuple(target.fields))
+        if fields is not None:
+            for name in set(target.fields) - set(fields):
+                target.fields.pop(name)
+        return serializer
+
+    def perform_destroy(self, instance):
+        """Аккаунт скрывается сразу, данные удаляются в фоне."""
+        schedule_user_deletion(instance)
+
     @action(methods=['POST'],
             detail=False,
             permission_classes=[permissions.IsAuthenticated])
@@ -49,7 +222,7 @@ class CustomUserViewSet(UserViewSet):
                 {'error': '"new_password": обязательное поле для заполнения'},
                 status=status.HTTP_400_BAD_REQUEST)
         user.password = make_password(new_password)
-        user.save()
+        user.save(update_fields=('password',))
         return Response({'status': 'password set'})
 
     @action(methods=['POST', 'DELETE'], detail=True,
@@ -58,25 +231,35 @@ class CustomUserViewSet(UserViewSet):
         """
         Авторизированный пользователь
         добавляет/удалет подписку на другого пользователя.
+        Подписка и отписка - один запрос без предварительной проверки,
+        автор загружается только для текста ошибки.
         """
         user = request.user
-        author = get_object_or_404(User, id=id)
-        subscription = Follow.objects.filter(user=user, author=author)
+        author_id = _parse_pk(id)
         if request.method == 'POST':
-            if subscription.exists():
-                return Response({'error': f'Вы уже подписаны на {author}'},
-                                status=status.HTTP_400_BAD_REQUEST)
-            if user == author:
+            if author_id == user.id:
                 return Response({'error': 'Невозможно подписаться на себя'},
                                 status=status.HTTP_400_BAD_REQUEST)
-            serializer = SubscriptionsSerializer(
-                author,
-                context={'request': request})
-            Follow.objects.create(user=user, author=author)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-        if subscription.exists():
-            subscription.delete()
+            if not add_link(Follow, user, 'author', author_id):
+                author = get_object_or_404(
+                    User.objects.filter(is_active=True), id=author_id
+                )
+                return Response({'error': f'Вы уже подписаны на {author}'},
+                                status=status.HTTP_400_BAD_REQUEST)
+            update_user_set(request, FOLLOWING, author_id)
+            backfill_feed(user, author_id)
+            data = build_subscriptions(
+                request, [author_id], get_user_sets(request)[FOLLOWING]
+            )
+            return Response(data[0], status=status.HTTP_201_CREATED)
+        deleted = _delete_link(Follow.objects.filter(
+            user=user, author_id=author_id
+        ))
+        if deleted:
+            update_user_set(request, FOLLOWING, author_id, add=False)
+            prune_feed(user, author_id)
             return Response(status=status.HTTP_204_NO_CONTENT)
+        author = get_object_or_404(User, id=author_id)
         return Response({'error': f'Вы не подписаны на пользователя {author}'},
                         status=status.HTTP_400_BAD_REQUEST)
 
@@ -88,17 +271,25 @@ class CustomUserViewSet(UserViewSet):
         Авторизированный пользователь
         получает список своих подписок.
         """
+        return self._subscriptions_response(self._get_subscriptions_page())
+
+    def _get_subscriptions_page(self):
+        """id авторов страницы подписок."""
         subscriptions = User.objects.filter(
-            following__user=self.request.user
-        )
-        page = self.paginate_queryset(subscriptions)
-        serializer = SubscriptionsSerializer(
-            page, many=True,
-            context={'request': request})
-        return self.get_paginated_response(serializer.data)
+            following__user=self.request.user, is_active=True
+        ).values_list('id', flat=True)
+        return self.paginate_queryset(subscriptions)
+
+    def _subscriptions_response(self, page):
+        request = self.request
+        return self.get_paginated_response(build_subscriptions(
+            request, page, get_user_sets(request)[FOLLOWING],
+            get_fieldset(request, SUBSCRIPTION_FIELDS) or SUBSCRIPTION_FIELDS
+        ))
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(PkLookupMixin, ReplicaReadMixin,
+                    viewsets.ModelViewSet):
     """
     Вся работа с рецептами: детально и в списках.
     Списки рецептов: главный, избранное, корзина;
@@ -116,7 +307,7 @@ class RecipeViewSet(viewsets.ModelViewSet):
         Просмотр списка рецептов и списка по id
         доступен всем.
         """
-        if self.action in ['list', 'retrieve']:
+        if self.action in ['list', 'retrieve', 'batch']:
             return (permissions.AllowAny(),)
         return super().get_permissions()
 
@@ -125,27 +316,164 @@ class RecipeViewSet(viewsets.ModelViewSet):
             return RecipeSerializer
         return RecipeCreateUpdateSerializer
 
-    def _action_post_delete(self, pk, serializer_class):
+    def _get_filtered_queryset(self):
+        """Отфильтрованный queryset, общий для валидаторов и списка."""
+        if not hasattr(self, '_filtered_queryset'):
+            self._filtered_queryset = self.filter_queryset(
+                self.get_queryset()
+            )
+        return self._filtered_queryset
+
+    def get_validators(self):
+        """
+        Валидаторы условных запросов: updated_at рецептов
+        и версии справочников тегов и ингредиентов, а при сортировке
+        по популярности - и версия пересчёта оценок.
+        Если в ответ входят флаги пользователя, они входят и в ETag,
+        а Last-Modified не отдаётся.
+        """
+        request = self.request
+        available = (RECIPE_DETAIL_FIELDS if self.action == 'retrieve'
+                     else RECIPE_FIELDS)
+        fields = get_fieldset(request, available) or available
+        personal = (request.user.is_authenticated
+                    and not USER_FLAG_FIELDS.isdisjoint(fields))
+        names = (TAGS, INGREDIENTS)
+        if self.action == 'list' and request.query_params.get('ordering'):
+            names += (SCORES,)
+        versions = get_versions(*names)
+        catalogs = ':'.join(str(versions[name]) for name in names)
+        if self.action == 'retrieve':
+            row = self._get_recipe_row()
+            if row is None:
+                return 'missing', None
+            recipe_id, updated_at, author_id, views = row
+            flags = ()
+            if personal:
+                sets = get_user_sets(request)
+                flags = (recipe_id in sets[FAVORITES],
+                         recipe_id in sets[SHOPPING_CART],
+                         author_id in sets[FOLLOWING])
+            source = (f'recipe:{request.get_full_path()}:{updated_at}:'
+                      f'{views}:{catalogs}:{flags}')
+        else:
+            state = self._get_filtered_queryset().aggregate(
+                updated_at=Max('updated_at'), count=Count('id')
+            )
+            updated_at = state['updated_at']
+            signature = get_user_sets_signature(request) if personal else ''
+            source = (f'recipes:{request.get_full_path()}:'
+                      f'{updated_at}:{state["count"]}:{catalogs}:'
+                      f'{signature}')
+        if personal:
+            return source, None
+        last_modified = max(versions.values()) // 1000
+        if updated_at:
+            last_modified = max(last_modified, int(updated_at.timestamp()))
+        return source, last_modified
+
+    @conditional_get
+    def list(self, request, *args, **kwargs):
+        """
+        Список рецептов из кэшированных фрагментов:
+        из базы выбираются только id рецептов страницы.
+        Набор полей ограничивается параметрами fields и omit.
+        """
+        return self._list_response(self._get_page())
+
+    def _get_page(self):
+        """id рецептов страницы списка или всего списка без пагинации."""
+        recipe_ids = self._get_filtered_queryset().values_list(
+            'id', flat=True
+        )
+        page = self.paginate_queryset(recipe_ids)
+        return list(recipe_ids) if page is None else page
+
+    def _list_response(self, recipe_ids):
+        data = get_recipes_data(
+            self.request, recipe_ids,
+            get_fieldset(self.request, RECIPE_FIELDS)
+        )
+        if self.paginator is None:
+            return Response(data)
+        return self.get_paginated_response(data)
+
+    def _get_recipe_row(self):
+        """
+        Строка (id, updated_at, author_id, views) рецепта из URL,
+        общая для валидаторов и retrieve; None, если рецепта нет.
+        """
+        if not hasattr(self, '_recipe_row'):
+            try:
+                pk = _parse_pk(self.kwargs[self.lookup_field])
+            except Http404:
+                self._recipe_row = None
+            else:
+                self._recipe_row = Recipe.objects.filter(
+                    pk=pk
+                ).values_list('id', 'updated_at', 'author_id',
+                              'views').first()
+        return self._recipe_row
+
+    @conditional_get
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Рецепт по id из кэшированного фрагмента
+        с числом просмотров на момент последнего сброса счётчиков.
+        """
+        row = self._get_recipe_row()
+        if row is None:
+            raise Http404
+        fields = get_fieldset(request, RECIPE_DETAIL_FIELDS)
+        data = {}
+        recipe_fields = fields and tuple(
+            name for name in fields if name != 'views'
+        )
+        if recipe_fields != ():
+            recipes = get_recipes_data(request, [row[0]], recipe_fields)
+            if not recipes:
+                raise Http404
+            data = recipes[0]
+        if fields is None or 'views' in fields:
+            data['views'] = row[3]
+        return Response(data)
+
+    def perform_destroy(self, instance):
+        """Рецепт скрывается сразу, связанные строки удаляются в фоне."""
+        schedule_recipe_deletion([instance.pk])
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        """Просмотр рецепта засчитывается и при ответе 304."""
+        if (self.action == 'retrieve'
+                and response.status_code in (200, 304)
+                and self._get_recipe_row() is not None):
+            view_counter.record(self._get_recipe_row()[0])
+        return super().finalize_response(request, response, *args, **kwargs)
+
+    def _action_post_delete(self, pk, model, user_set, error):
         """
         Функция для добавления/удаления рецепта в списки.
+        Вставка и удаление выполняются одним запросом, рецепт
+        загружается только для ошибки 404. Изменение сразу
+        записывается в кэшированное множество пользователя user_set.
         """
         user = self.request.user
-        recipe = get_object_or_404(Recipe, pk=pk)
-        object = serializer_class.Meta.model.objects.filter(
-            user=user,
-            recipe=recipe
-        )
+        recipe_id = _parse_pk(pk)
         if self.request.method == 'POST':
-            data = {'user': user.id, 'recipe': pk}
-            context = {'request': self.request}
-            serializer = serializer_class(data=data,
-                                          context=context)
-            serializer.is_valid(raise_exception=True)
-            serializer.save()
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-        if object.exists():
-            object.delete()
+            if not add_link(model, user, 'recipe', recipe_id,
+                            created=timezone.now()):
+                get_object_or_404(Recipe.objects.only('id'), pk=recipe_id)
+                return Response({'non_field_errors': [error]},
+                                status=status.HTTP_400_BAD_REQUEST)
+            update_user_set(self.request, user_set, recipe_id)
+            return None
+        deleted = _delete_link(model.objects.filter(
+            user=user, recipe_id=recipe_id
+        ))
+        if deleted:
+            update_user_set(self.request, user_set, recipe_id, add=False)
             return Response(status=status.HTTP_204_NO_CONTENT)
+        get_object_or_404(Recipe.objects.only('id'), pk=recipe_id)
         return Response({'Этого рецепта не было в cписке'},
                         status=status.HTTP_400_BAD_REQUEST)
 
@@ -154,40 +482,220 @@ class RecipeViewSet(viewsets.ModelViewSet):
             methods=['POST', 'DELETE'])
     def favorite(self, request, pk=None):
         """Добавляет/удаляет рецепт в список избранного."""
-        return self._action_post_delete(pk, FavoriteRecipeSerializer)
+        response = self._action_post_delete(
+            pk, FavoriteRecipe, FAVORITES, 'Рецепт уже добавлен в избранное!'
+        )
+        if response is not None:
+            return response
+        data = get_recipes_data(request, [int(pk)])
+        return Response(data[0], status=status.HTTP_201_CREATED)
 
     @action(detail=True,
             permission_classes=[permissions.IsAuthenticated],
             methods=['POST', 'DELETE'], )
     def shopping_cart(self, request, pk=None):
         """Добавляет/удаляет рецепт в список покупок."""
-        return self._action_post_delete(pk, RecipeShoppingListSerializer)
+        response = self._action_post_delete(
+            pk, RecipeShoppingList, SHOPPING_CART,
+            'Рецепт уже добавлен в список покупок!'
+        )
+        if response is not None:
+            return response
+        recipe = get_recipes_data(request, [int(pk)], SHORT_RECIPE_FIELDS)[0]
+        recipe['author'] = recipe['author']['id']
+        return Response(recipe, status=status.HTTP_201_CREATED)
+
+    @action(detail=False,
+            permission_classes=[permissions.IsAuthenticated],
+            pagination_class=FeedPagination)
+    def feed(self, request):
+        """
+        Лента рецептов авторов, на которых подписан пользователь,
+        с курсорной пагинацией по записям ленты.
+        """
+        page = self.paginate_queryset(partial(get_feed, request.user))
+        return self.get_paginated_response(get_recipes_data(
+            request, page, get_fieldset(request, RECIPE_FIELDS)
+        ))
+
+    @action(detail=False, permission_classes=[permissions.AllowAny])
+    def facets(self, request):
+        """
+        Число рецептов каждого тега при текущих фильтрах списка.
+        Фильтр tags не учитывается: счётчик показывает, сколько
+        рецептов будет при выборе тега.
+        """
+        return Response(get_tag_facets(
+            request, self.filterset_class, self.get_queryset()
+        ))
+
+    @action(detail=False)
+    def batch(self, request):
+        """
+        Рецепты по списку id (параметр ids, не больше BATCH_LIMIT)
+        в порядке запроса из тех же фрагментов, что и список;
+        несуществующие id перечисляются в missing.
+        """
+        recipe_ids = _parse_ids(request, 'ids')
+        if not recipe_ids:
+            raise ValidationError({'ids': 'Укажите id рецептов.'})
+        if len(recipe_ids) > BATCH_LIMIT:
+            raise ValidationError(
+                {'ids': f'Не больше {BATCH_LIMIT} id за запрос.'}
+            )
+        existing = set(Recipe.objects.filter(
+            id__in=recipe_ids
+        ).values_list('id', flat=True))
+        return Response({
+            'results': get_recipes_data(
+                request,
+                [recipe_id for recipe_id in recipe_ids
+                 if recipe_id in existing],
+                get_fieldset(request, RECIPE_FIELDS)
+            ),
+            'missing': [recipe_id for recipe_id in recipe_ids
+                        if recipe_id not in existing],
+        })
+
+    @action(detail=True, methods=['POST'],
+            permission_classes=[permissions.IsAuthenticated])
+    def fork(self, request, pk=None):
+        """
+        Копия чужого или своего рецепта от имени пользователя
+        с тем же изображением, ингредиентами и тегами.
+        """
+        recipe = get_object_or_404(
+            Recipe.objects.only('id', 'name', 'image', 'text',
+                                'cooking_time'),
+            pk=_parse_pk(pk)
+        )
+        fork = fork_recipe(recipe, request.user)
+        enqueue(index_similarity, fork.id)
+        enqueue(warm_recipe_fragments, [fork.id])
+        data = get_recipes_data(request, [fork.id])
+        return Response(data[0], status=status.HTTP_201_CREATED)
+
+    @action(detail=True, permission_classes=[permissions.AllowAny])
+    def similar(self, request, pk=None):
+        """
+        Похожие по набору ингредиентов рецепты
+        с оценкой коэффициента Жаккара в поле similarity.
+        """
+        recipe = get_object_or_404(Recipe.objects.only('id'),
+                                   pk=_parse_pk(pk))
+        try:
+            limit = int(request.query_params.get('limit', SIMILAR_LIMIT))
+        except ValueError:
+            limit = SIMILAR_LIMIT
+        similar = {
+            recipe_id: round(similarity, 2) for recipe_id, similarity
+            in find_similar(recipe.id, min(max(limit, 1), 50))
+        }
+        return Response(self._get_scored_recipes(similar, 'similarity'))
+
+    @action(detail=False, permission_classes=[permissions.AllowAny])
+    def cook(self, request):
+        """
+        Что приготовить из имеющихся ингредиентов (параметр ingredients):
+        рецепты, которым недостаёт не более max_missing ингредиентов,
+        по возрастанию числа недостающих (поле missing).
+        Поддерживает фильтр tags по слагам.
+        """
+        ingredient_ids = _parse_ids(request, 'ingredients')
+        if not ingredient_ids:
+            raise ValidationError(
+                {'ingredients': 'Укажите id имеющихся ингредиентов.'}
+            )
+        try:
+            max_missing = int(request.query_params.get(
+                'max_missing', PANTRY_MAX_MISSING
+            ))
+        except ValueError:
+            max_missing = PANTRY_MAX_MISSING
+        tag_ids = None
+        slugs = request.query_params.getlist('tags')
+        if slugs:
+            tag_ids = list(Tag.objects.filter(
+                slug__in=slugs
+            ).values_list('id', flat=True))
+        matches = get_index().search(
+            ingredient_ids, min(max(max_missing, 0), 10), tag_ids
+        )
+        page = self.paginate_queryset(matches)
+        return self.get_paginated_response(
+            self._get_scored_recipes(dict(page), 'missing')
+        )
+
+    def _get_scored_recipes(self, scores, name):
+        """
+        Представления рецептов из scores ({id: значение}) в их порядке
+        с дополнительным полем name; id запрашивается всегда,
+        но выводится, только если входит в fields.
+        """
+        fields = get_fieldset(self.request, RECIPE_FIELDS)
+        data = get_recipes_data(self.request, scores, fields and tuple(
+            field for field in RECIPE_FIELDS
+            if field in fields or field == 'id'
+        ))
+        for item in data:
+            item[name] = scores[item['id']]
+            if fields and 'id' not in fields:
+                del item['id']
+        return data
 
     @action(detail=False, permission_classes=[AuthorOnly])
     def download_shopping_cart(self, request):
         """Загружает .txt файл со списком покупок."""
-        ingredients = get_ingredients(request.user)
-        shopping_list = 'Список покупок:'
-        for ingredient in ingredients:
-            shopping_list += (
-                f"\n- {ingredient[0]} "
-                f"({ingredient[1]}) - "
-                f"{ingredient[2]}")
-        file = 'shopping_list.txt'
-        response = HttpResponse(shopping_list, content_type='text/plain')
-        response['Content-Disposition'] = f'attachment; filename="{file}.txt"'
-        return response
+        return _shopping_list_file(get_ingredients(request.user))
+
+    @action(detail=False, methods=['POST'], url_path='shopping_list',
+            permission_classes=[permissions.AllowAny])
+    def planned_shopping_list(self, request):
+        """
+        Список покупок для произвольного набора рецептов с множителями
+        порций, корзина не меняется. format=txt - файл как у
+        download_shopping_cart, иначе JSON; несуществующие рецепты
+        перечисляются в missing.
+        """
+        serializer = PlannedShoppingListSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        portions = serializer.validated_data['recipes']
+        ingredients = [
+            (ingredient_id, name, unit, _amount(amount))
+            for ingredient_id, name, unit, amount
+            in get_planned_ingredients(portions)
+        ]
+        if serializer.validated_data['format'] == 'txt':
+            return _shopping_list_file(row[1:] for row in ingredients)
+        existing = set(Recipe.objects.filter(
+            id__in=portions
+        ).values_list('id', flat=True))
+        return Response({
+            'ingredients': [
+                {'id': ingredient_id, 'name': name, 'unit': unit,
+                 'amount': amount}
+                for ingredient_id, name, unit, amount in ingredients
+            ],
+            'missing': [recipe_id for recipe_id in portions
+                        if recipe_id not in existing],
+        })
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class TagViewSet(PkLookupMixin, ReplicaReadMixin, ConditionalGetMixin,
+                 viewsets.ReadOnlyModelViewSet):
     """Вывод тегов."""
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     pagination_class = None
     permission_classes = (permissions.AllowAny,)
 
+    def get_validators(self):
+        version = get_version(TAGS)
+        return f'tags:{version}:{self.request.path}', version // 1000
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+
+class IngredientViewSet(PkLookupMixin, ReplicaReadMixin,
+                        ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     """Вывод ингредиентов."""
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
@@ -195,3 +703,81 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     permission_classes = (permissions.AllowAny,)
     filter_backends = (IngredientFilter,)
     search_fields = ('^name', )
+
+    def get_validators(self):
+        version = get_version(INGREDIENTS)
+        return (f'ingredients:{version}:{self.request.get_full_path()}',
+                version // 1000)
+
+    @action(detail=False, methods=('get',),
+            permission_classes=(permissions.AllowAny,))
+    def snapshot(self, request):
+        """
+        Весь каталог по столбцам для поиска на клиенте. Тело заранее
+        отрендерено и сжато gzip и brotli для текущей версии
+        справочника, ETag у каждой кодировки свой.
+        """
+        encodings = get_ingredient_snapshot()
+        encoding = choose_encoding(
+            request.META.get('HTTP_ACCEPT_ENCODING', ''), encodings
+        )
+        body, etag = encodings[encoding]
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = HttpResponse(body, content_type='application/json')
+            if encoding != IDENTITY:
+                response['Content-Encoding'] = encoding
+        response['ETag'] = etag
+        response['Cache-Control'] = 'public, no-cache'
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+
+
+@api_view(['GET'])
+@permission_classes([permissions.AllowAny])
+def health(request):
+    """
+    Проверка соединений со всеми базами для балансировщика:
+    503, если какая-то недоступна. Администраторам отдаются
+    и счётчики соединений процесса воркера.
+    """
+    databases = {}
+    for alias in connections:
+        try:
+            connections[alias].ensure_connection()
+            usable = connections[alias].is_usable()
+        except DatabaseError:
+            usable = False
+        databases[alias] = 'ok' if usable else 'unavailable'
+    data = {'databases': databases}
+    if request.user.is_staff:
+        data['connections'] = connection_stats.snapshot()
+    if 'unavailable' in databases.values():
+        return Response(data, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    return Response(data)
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def deletion_progress(request, kind, object_id):
+    """
+    Ход фонового удаления рецептов (kind=recipes) или пользователя
+    (kind=user): число удалённых строк по моделям и признак
+    завершения. 404, пока удаление не началось.
+    """
+    progress = get_progress(kind, object_id) if kind in PURGE_KINDS else None
+    if progress is None:
+        raise Http404
+    return Response(progress)
+
+
+@api_view(['GET'])
+@permission_classes([permissions.AllowAny])
+def sync(request):
+    """
+    Дельта-синхронизация офлайн-клиентов: изменённые и удалённые
+    рецепты, теги и ингредиенты после cursor из прошлого ответа
+    или метки времени since. Без параметров - полная загрузка
+    страницами по limit рецептов.
+    """
+    return Response(get_changes(request))
@@ -0,0 +1,42 @@
+"""
+ASGI config for recipebook project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+
+Production is served by gunicorn through WSGI: in benchmark_asgi and
+over HTTP the sync views are faster than the async ones. To serve
+through ASGI, run
+``gunicorn -k uvicorn.workers.UvicornWorker recipebook.asgi:application``
+with CONN_MAX_AGE=0: Django runs each ASGI request's sync code in its
+own thread, so persistent connections are not reused.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
+"""
+
+import os
+
+import django
+from django.core.handlers.asgi import ASGIHandler
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'recipebook.settings')
+
+ASGI_URLCONF = 'recipebook.asgi_urls'
+
+
+class AsyncReadASGIHandler(ASGIHandler):
+    """
+    Обработчик ASGI с recipebook.asgi_urls: асинхронные представления
+    чтения подключаются только под ASGI-сервером, WSGI (gunicorn)
+    обслуживает синхронные вьюсеты без лишнего потока событий.
+    """
+
+    def create_request(self, scope, body_file):
+        request, error_response = super().create_request(scope, body_file)
+        if request is not None:
+            request.urlconf = ASGI_URLCONF
+        return request, error_response
+
+
+django.setup(set_prefix=False)
+application = AsyncReadASGIHandler()
@@ -0,0 +1,14 @@
+"""
+URL для ASGI-сервера: API с асинхронными представлениями
+горячих GET-действий, остальное - как в recipebook.urls.
+"""
+from django.urls import include, path
+
+from api.urls import app_name, get_urlpatterns
+from .urls import urlpatterns as sync_urlpatterns
+
+urlpatterns = [
+    path('api/', include((get_urlpatterns(asynchronous=True), app_name))),
+    *(pattern for pattern in sync_urlpatterns
+      if getattr(pattern, 'app_name', None) != app_name),
+]
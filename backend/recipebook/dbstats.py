@@ -0,0 +1,146 @@
+import os
+import threading
+import time
+import weakref
+from collections import Counter
+
+COUNTERS = (
+    'first_uses',
+    'reused',
+    'connects',
+    'reconnects',
+    'health_check_failures',
+    'recycled',
+    'inherited',
+)
+
+
+class ConnectionStats:
+    """
+    Счётчики постоянных соединений с базой в процессе воркера:
+    first_uses - первые обращения к соединению в запросе или задаче,
+    reused - из них обслужено уже открытым соединением,
+    connects и reconnects - новые соединения, в том числе взамен закрытых,
+    health_check_failures - соединения, не прошедшие проверку,
+    recycled - закрытые на границе запроса по возрасту или после ошибок,
+    inherited - унаследованные при fork и отброшенные соединения.
+    check_connect_seconds - задержка первого обращения: проверка
+    соединения и при необходимости подключение. Это не пул
+    с ожиданием свободного соединения: у каждого потока своё.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counts = Counter(dict.fromkeys(COUNTERS, 0))
+            self.check_connect_seconds = 0.0
+            self.max_check_connect_seconds = 0.0
+
+    def add(self, name, count=1):
+        with self.lock:
+            self.counts[name] += count
+
+    def add_first_use(self, seconds, reused):
+        with self.lock:
+            self.counts['first_uses'] += 1
+            self.counts['reused'] += reused
+            self.check_connect_seconds += seconds
+            self.max_check_connect_seconds = max(
+                self.max_check_connect_seconds, seconds
+            )
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'pid': os.getpid(),
+                'open': sum(wrapper.connection is not None
+                            for wrapper in list(_wrappers.values())),
+                **self.counts,
+                'check_connect_seconds': round(
+                    self.check_connect_seconds, 6
+                ),
+                'max_check_connect_seconds': round(
+                    self.max_check_connect_seconds, 6
+                ),
+            }
+
+
+connection_stats = ConnectionStats()
+_wrappers = weakref.WeakValueDictionary()
+_inherited = []
+
+
+class TrackedConnectionMixin:
+    """
+    Учёт постоянных соединений Django (CONN_MAX_AGE) для DatabaseWrapper.
+    Соединением управляет сам Django: одно на поток, переиспользуется
+    между запросами, при первом обращении в запросе проверяется
+    (CONN_HEALTH_CHECKS) и закрывается на границе запроса по возрасту
+    или после ошибок. Миксин только считает эти события.
+    Соединения, унаследованные дочерним процессом при fork,
+    отбрасываются без закрытия: закрытие оборвало бы сессию родителя.
+    """
+    _connected_before = False
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._release()
+        _wrappers[id(self)] = self
+
+    def _release(self):
+        self._in_use = False
+        self._connected = False
+
+    def connect(self):
+        super().connect()
+        self._connected = True
+        connection_stats.add('reconnects' if self._connected_before
+                             else 'connects')
+        self._connected_before = True
+
+    def _cursor(self, name=None):
+        """
+        Учёт времени первого курсора после границы запроса:
+        проверку и подключение выполняет базовый _cursor.
+        """
+        if self._in_use:
+            return super()._cursor(name)
+        started = time.perf_counter()
+        cursor = super()._cursor(name)
+        self._in_use = True
+        connection_stats.add_first_use(time.perf_counter() - started,
+                                       not self._connected)
+        return cursor
+
+    def close_if_health_check_failed(self):
+        checked = (self.connection is not None and self.health_check_enabled
+                   and not self.health_check_done)
+        super().close_if_health_check_failed()
+        if checked and self.connection is None:
+            connection_stats.add('health_check_failures')
+
+    def close_if_unusable_or_obsolete(self):
+        opened = self.connection is not None
+        super().close_if_unusable_or_obsolete()
+        self._release()
+        if opened and self.connection is None:
+            connection_stats.add('recycled')
+
+    def detach(self):
+        """Отказ от соединения без его закрытия."""
+        if self.connection is not None:
+            _inherited.append(self.connection)
+            self.connection = None
+            self._release()
+            connection_stats.add('inherited')
+
+
+def detach_inherited_connections():
+    for wrapper in list(_wrappers.values()):
+        wrapper.detach()
+
+
+os.register_at_fork(after_in_child=detach_inherited_connections)
@@ -0,0 +1,7 @@
+from django.db.backends.postgresql import base
+
+from recipebook.dbstats import TrackedConnectionMixin
+
+
+class DatabaseWrapper(TrackedConnectionMixin, base.DatabaseWrapper):
+    """PostgreSQL с учётом постоянных соединений."""
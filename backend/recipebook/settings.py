@@ -1,5 +1,6 @@
 import os
 
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -9,7 +10,7 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 SECRET_KEY = os.getenv('TOKEN', 'default-token')
 
-DEBUG = True
+DEBUG = os.getenv('DEBUG', 'True') == 'True'
 
 ALLOWED_HOSTS = ['yandex.foodgramhub.ddns.net',
                  '51.250.110.255',
@@ -43,6 +44,7 @@ INSTALLED_APPS = [
     'users.apps.UsersConfig',
     'recipes.apps.RecipesConfig',
     'api.apps.ApiConfig',
+    'tasks.apps.TasksConfig',
 ]
 
 MIDDLEWARE = [
@@ -80,17 +82,80 @@ WSGI_APPLICATION = 'recipebook.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
 
+# Соединения постоянные: по одному на поток воркера, живут
+# CONN_MAX_AGE секунд и проверяются при первом обращении в запросе.
+# Учёт соединений - recipebook.dbstats, метрики - /api/health/.
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': 'recipebook.postgresql',
         'NAME': os.getenv('POSTGRES_DB', 'postgres'),
         'USER': os.getenv('POSTGRES_USER', 'postgres'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', 'postgres'),
         'HOST': os.getenv('DB_HOST', 'db'),
-        'PORT': os.getenv('DB_PORT', 5432)
+        'PORT': os.getenv('DB_PORT', 5432),
+        'CONN_MAX_AGE': int(os.getenv('CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Read replicas
+# DB_REPLICA_HOSTS - хосты реплик через запятую с теми же учётными
+# данными. Безопасные запросы к API читают из реплик, пользователь
+# после записи читает из основной базы REPLICA_STICKY_SECONDS секунд.
+
+DATABASE_REPLICAS = []
+for number, host in enumerate(
+    filter(None, os.getenv('DB_REPLICA_HOSTS', '').split(',')), 1
+):
+    DATABASE_REPLICAS.append(f'replica{number}')
+    DATABASES[f'replica{number}'] = {
+        **DATABASES['default'],
+        'HOST': host.strip(),
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['api.replicas.ReplicaRouter']
+
+REPLICA_STICKY_SECONDS = int(os.getenv('REPLICA_STICKY_SECONDS', 5))
+
+# Async reads
+# Под ASGI независимые запросы к базе выполняются в общем пуле
+# из ASYNC_DB_THREADS потоков процесса: у каждого потока постоянное
+# соединение, поэтому соединений не больше размера пула.
+
+ASYNC_DB_THREADS = int(os.getenv('ASYNC_DB_THREADS', 4))
+
+# Cache
+# Фрагменты рецептов, версии справочников, токены и ход фоновых задач
+# общие для всех процессов (gunicorn, tasks, scores), поэтому
+# без DEBUG нужен Redis: локальный кэш процесса не запускается.
+
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+elif not DEBUG:
+    raise ImproperlyConfigured(
+        'REDIS_URL не задан: без DEBUG кэш должен быть общим '
+        'для всех процессов.'
+    )
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Background tasks
+# Очередь хранится в базе и выполняется командой run_tasks.
+# TASKS_EAGER=True выполняет задачи сразу, без воркера.
+
+TASKS_EAGER = os.getenv('TASKS_EAGER', 'False') == 'True'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -144,7 +209,11 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.AllowAny',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
+    ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     "PAGE_SIZE": 6,
@@ -1,13 +1,21 @@
 from django.contrib import admin
+from django.http import HttpResponse, StreamingHttpResponse
+from django.urls import path
 
+from api.analytics import active_carts, demand_rows, iter_csv
+from api.purge import RECIPES_PURGE, format_progress
+from api.tasks import schedule_recipe_deletion
 from recipes.models import (
     FavoriteRecipe,
+    FeedEntry,
     Ingredient,
     Recipe,
     RecipeIngredient,
+    RecipeScore,
     RecipeShoppingList,
     RecipeTag,
-    Tag
+    Tag,
+    Tombstone
 )
 
 
@@ -47,8 +55,10 @@ class RecipeAdmin(admin.ModelAdmin):
         'author',
         'pub_date',
         'elected',
+        'is_active',
+        'deletion',
     )
-    list_filter = ('name', 'author', 'tags',)
+    list_filter = ('is_active', 'name', 'author', 'tags',)
     readonly_fields = ('elected',)
     inlines = (RecipeIngredientsInline,)
     empty_value_display = '-пусто-'
@@ -59,22 +69,75 @@ class RecipeAdmin(admin.ModelAdmin):
         """
         return obj.elected.all().count()
 
+    @admin.display(description='Удаление')
+    def deletion(self, obj):
+        """Ход фонового удаления скрытого рецепта."""
+        if obj.is_active:
+            return None
+        return format_progress(RECIPES_PURGE, obj.pk)
+
+    def get_deleted_objects(self, objs, request):
+        """
+        Подтверждение удаления без обхода связей сборщиком ORM:
+        связанные строки удаляются в фоне.
+        """
+        return [str(obj) for obj in objs], {}, set(), []
+
+    def delete_model(self, request, obj):
+        schedule_recipe_deletion([obj.pk])
+
+    def delete_queryset(self, request, queryset):
+        schedule_recipe_deletion(queryset.values_list('id', flat=True))
+
 
 class FavoriteRecipeAdmin(admin.ModelAdmin):
     """
     Отображение модели избранных пользователем
     рецептов в админке.
     """
-    list_display = ('id', 'user', 'recipe',)
+    list_display = ('id', 'user', 'recipe', 'created',)
     empty_value_display = '-пусто-'
 
 
+def demand_response(carts):
+    """
+    CSV-файл спроса на ингредиенты по записям carts:
+    строки отдаются по одной, файл целиком в памяти не собирается.
+    """
+    response = StreamingHttpResponse(
+        iter_csv(demand_rows(carts)), content_type='text/csv'
+    )
+    response['Content-Disposition'] = (
+        'attachment; filename="ingredient_demand.csv"'
+    )
+    return response
+
+
 class RecipeShoppingListAdmin(admin.ModelAdmin):
     """
     Отображение модели рецептов из списка покупок в админке.
+    Спрос на ингредиенты по всем активным спискам - по адресу
+    demand/, по выбранным записям - действием.
     """
-    list_display = ('id', 'user', 'recipe',)
+    list_display = ('id', 'user', 'recipe', 'created',)
     empty_value_display = '-пусто-'
+    actions = ('download_demand',)
+
+    def get_urls(self):
+        return [
+            path('demand/', self.admin_site.admin_view(self.demand_view),
+                 name='recipes_recipeshoppinglist_demand'),
+            *super().get_urls(),
+        ]
+
+    def demand_view(self, request):
+        if not self.has_view_permission(request):
+            return HttpResponse(status=403)
+        return demand_response(active_carts())
+
+    @admin.action(description='Скачать спрос на ингредиенты')
+    def download_demand(self, request, queryset):
+        return demand_response(queryset)
 
 
 class RecipeIngredientsAdmin(admin.ModelAdmin):
@@ -95,6 +158,25 @@ class RecipeTagAdmin(admin.ModelAdmin):
     list_filter = ('recipe', 'tag',)
 
 
+class FeedEntryAdmin(admin.ModelAdmin):
+    """Отображение записей лент подписок в админке."""
+    list_display = ('id', 'user', 'recipe', 'pub_date',)
+    raw_id_fields = ('user', 'recipe',)
+
+
+class RecipeScoreAdmin(admin.ModelAdmin):
+    """Отображение предрассчитанных оценок рецептов в админке."""
+    list_display = ('recipe', 'popular', 'trending', 'refreshed_at',)
+    raw_id_fields = ('recipe',)
+    ordering = ('-popular',)
+
+
+class TombstoneAdmin(admin.ModelAdmin):
+    """Отображение записей об удалениях в админке."""
+    list_display = ('kind', 'object_id', 'deleted_at')
+    list_filter = ('kind',)
+
+
 admin.site.register(Tag, TagAdmin)
 admin.site.register(Ingredient, IngredientAdmin)
 admin.site.register(Recipe, RecipeAdmin)
@@ -102,3 +184,6 @@ admin.site.register(FavoriteRecipe, FavoriteRecipeAdmin)
 admin.site.register(RecipeShoppingList, RecipeShoppingListAdmin)
 admin.site.register(RecipeIngredient, RecipeIngredientsAdmin)
 admin.site.register(RecipeTag, RecipeTagAdmin)
+admin.site.register(FeedEntry, FeedEntryAdmin)
+admin.site.register(RecipeScore, RecipeScoreAdmin)
+admin.site.register(Tombstone, TombstoneAdmin)
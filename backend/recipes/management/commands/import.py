@@ -3,12 +3,18 @@ import csv
 from django.core.management import BaseCommand
 
 from django.conf import settings
+from api.snapshots import get_ingredient_snapshot
 from recipes.models import Ingredient, Tag
+from recipes.versions import INGREDIENTS, TAGS, bump_version
 
 MODELS_FILES = {
     Ingredient: 'ingredients.csv',
     Tag: 'tags.csv',
 }
+MODELS_VERSIONS = {
+    Ingredient: INGREDIENTS,
+    Tag: TAGS,
+}
 
 
 class Command(BaseCommand):
@@ -23,6 +29,8 @@ class Command(BaseCommand):
             ) as table:
                 reader = csv.DictReader(table)
                 model.objects.bulk_create(model(**data) for data in reader)
+            bump_version(MODELS_VERSIONS[model])
+        get_ingredient_snapshot()
 
         self.stdout.write(self.style.SUCCESS(
             'Данные успешно загружены')
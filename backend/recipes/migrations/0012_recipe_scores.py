@@ -0,0 +1,46 @@
+# Generated by Django 4.2.3 on 2026-10-19 09:35
+
+import datetime
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Время добавления существующих записей неизвестно: они не должны
+# попадать в популярное за неделю.
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0011_recipe_similarity_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='favoriterecipe',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, default=EPOCH, verbose_name='Дата добавления'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='recipeshoppinglist',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, default=EPOCH, verbose_name='Дата добавления'),
+            preserve_default=False,
+        ),
+        migrations.CreateModel(
+            name='RecipeScore',
+            fields=[
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='score', serialize=False, to='recipes.recipe', verbose_name='Рецепт')),
+                ('popular', models.FloatField(default=0, verbose_name='Популярность')),
+                ('trending', models.FloatField(default=0, verbose_name='Популярность за неделю')),
+                ('refreshed_at', models.DateTimeField(verbose_name='Дата расчёта')),
+            ],
+            options={
+                'verbose_name': 'Оценка рецепта',
+                'verbose_name_plural': 'Оценки рецептов',
+                'indexes': [models.Index(fields=['-popular', '-recipe'], name='recipe_score_popular_idx'), models.Index(fields=['-trending', '-recipe'], name='recipe_score_trending_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+from django.db import migrations
+from django.utils import timezone
+
+SCORE_BATCH_SIZE = 1000
+
+
+def create_missing_scores(apps, schema_editor):
+    """Нулевые оценки рецептам без строки в RecipeScore."""
+    Recipe = apps.get_model('recipes', 'Recipe')
+    RecipeScore = apps.get_model('recipes', 'RecipeScore')
+    now = timezone.now()
+    unscored = Recipe.all_objects.filter(score__isnull=True).values_list(
+        'id', flat=True
+    )
+    RecipeScore.objects.bulk_create(
+        (RecipeScore(recipe_id=recipe_id, refreshed_at=now)
+         for recipe_id in unscored.iterator()),
+        batch_size=SCORE_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0016_feed_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_missing_scores, migrations.RunPython.noop),
+    ]
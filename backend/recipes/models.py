@@ -22,6 +22,11 @@ class Tag(models.Model):
         verbose_name='Слаг',
         unique=True,
     )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        db_index=True,
+        verbose_name='Дата изменения'
+    )
 
     class Meta:
         ordering = ('name',)
@@ -49,6 +54,11 @@ class Ingredient(models.Model):
         verbose_name='Единица измерения',
         max_length=50,
     )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        db_index=True,
+        verbose_name='Дата изменения'
+    )
 
     class Meta:
         constraints = (
@@ -64,8 +74,19 @@ class Ingredient(models.Model):
         return f'{self.name} {self.unit}'
 
 
+class ActiveRecipeManager(models.Manager):
+    """Рецепты без ожидающих фонового удаления."""
+
+    def get_queryset(self):
+        return super().get_queryset().filter(is_active=True)
+
+
 class Recipe(models.Model):
-    """Модель рецепта."""
+    """
+    Модель рецепта. Удаляемый рецепт сначала помечается is_active=False
+    и пропадает из Recipe.objects, строки удаляются в фоне.
+    Все рецепты - в Recipe.all_objects.
+    """
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -110,9 +131,35 @@ class Recipe(models.Model):
         auto_now_add=True,
         verbose_name='Дата публикации'
     )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Дата изменения'
+    )
+    is_active = models.BooleanField(
+        default=True,
+        verbose_name='Активен'
+    )
+    views = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Просмотры'
+    )
+
+    objects = ActiveRecipeManager()
+    all_objects = models.Manager()
 
     class Meta:
+        default_manager_name = 'all_objects'
         ordering = ('-pub_date',)
+        indexes = (
+            models.Index(
+                fields=('updated_at', 'id'),
+                name='recipe_updated_at_id_idx',
+            ),
+            models.Index(
+                fields=('author', '-pub_date'),
+                name='recipe_author_pub_date_idx',
+            ),
+        )
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
 
@@ -202,6 +249,11 @@ class FavoriteRecipe(models.Model):
         verbose_name='Рецепт',
         related_name='elected',
     )
+    created = models.DateTimeField(
+        auto_now_add=True,
+        db_index=True,
+        verbose_name='Дата добавления'
+    )
 
     class Meta:
         constraints = (
@@ -235,6 +287,11 @@ class RecipeShoppingList(models.Model):
         verbose_name='Пользователь',
         related_name='shopping_user',
     )
+    created = models.DateTimeField(
+        auto_now_add=True,
+        db_index=True,
+        verbose_name='Дата добавления'
+    )
 
     class Meta:
         constraints = (
@@ -252,3 +309,164 @@ class RecipeShoppingList(models.Model):
             f'У пользователя {self.user} рецепт {self.recipe} '
             f'в списке покупок'
         )
+
+
+class FeedEntry(models.Model):
+    """
+    Модель записи в ленте подписок пользователя.
+    Заполняется при публикации рецепта автором, на которого
+    подписан пользователь.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Пользователь',
+        related_name='feed',
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        verbose_name='Рецепт',
+        related_name='feed_entries',
+    )
+    pub_date = models.DateTimeField(verbose_name='Дата публикации')
+
+    class Meta:
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'recipe',),
+                name='unique_feed_entry',
+            ),
+        )
+        indexes = (
+            models.Index(
+                fields=('user', '-pub_date', '-recipe'),
+                name='feed_user_pub_date_recipe_idx',
+            ),
+        )
+        ordering = ('-pub_date',)
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи лент'
+
+    def __str__(self):
+        return f'Рецепт {self.recipe} в ленте пользователя {self.user}'
+
+
+class RecipeSignature(models.Model):
+    """Модель MinHash-сигнатуры набора ингредиентов рецепта."""
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        verbose_name='Рецепт',
+        related_name='signature',
+    )
+    signature = models.BinaryField(verbose_name='Сигнатура')
+
+    class Meta:
+        verbose_name = 'Сигнатура рецепта'
+        verbose_name_plural = 'Сигнатуры рецептов'
+
+    def __str__(self):
+        return f'Сигнатура рецепта {self.recipe_id}'
+
+
+class RecipeBand(models.Model):
+    """Модель ключа полосы LSH-индекса похожих рецептов."""
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        verbose_name='Рецепт',
+        related_name='bands',
+    )
+    key = models.BigIntegerField(verbose_name='Ключ полосы')
+
+    class Meta:
+        indexes = (
+            models.Index(
+                fields=('key', 'recipe'),
+                name='recipe_band_key_idx',
+            ),
+        )
+        verbose_name = 'Полоса LSH-индекса'
+        verbose_name_plural = 'Полосы LSH-индекса'
+
+    def __str__(self):
+        return f'Полоса {self.key} рецепта {self.recipe_id}'
+
+
+class RecipeScore(models.Model):
+    """
+    Модель предрассчитанных оценок рецепта по добавлениям
+    в избранное и списки покупок: общей и с затуханием по времени.
+    Пересчитывается командой refresh_scores.
+    """
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        verbose_name='Рецепт',
+        related_name='score',
+    )
+    popular = models.FloatField(default=0, verbose_name='Популярность')
+    trending = models.FloatField(
+        default=0,
+        verbose_name='Популярность за неделю'
+    )
+    refreshed_at = models.DateTimeField(verbose_name='Дата расчёта')
+
+    class Meta:
+        indexes = (
+            models.Index(
+                fields=('-popular', '-recipe'),
+                name='recipe_score_popular_idx',
+            ),
+            models.Index(
+                fields=('-trending', '-recipe'),
+                name='recipe_score_trending_idx',
+            ),
+        )
+        verbose_name = 'Оценка рецепта'
+        verbose_name_plural = 'Оценки рецептов'
+
+    def __str__(self):
+        return f'Оценка рецепта {self.recipe_id}'
+
+
+class Tombstone(models.Model):
+    """
+    Модель удалённого объекта для дельта-синхронизации клиентов.
+    Записи старше срока хранения удаляются командой prune_tombstones.
+    """
+    RECIPE = 'recipe'
+    TAG = 'tag'
+    INGREDIENT = 'ingredient'
+    KINDS = (
+        (RECIPE, 'Рецепт'),
+        (TAG, 'Тег'),
+        (INGREDIENT, 'Ингредиент'),
+    )
+    kind = models.CharField(
+        max_length=16,
+        choices=KINDS,
+        verbose_name='Тип объекта'
+    )
+    object_id = models.BigIntegerField(verbose_name='id объекта')
+    deleted_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Дата удаления'
+    )
+
+    class Meta:
+        indexes = (
+            models.Index(
+                fields=('kind', 'deleted_at'),
+                name='tombstone_kind_deleted_idx',
+            ),
+        )
+        ordering = ('deleted_at',)
+        verbose_name = 'Удалённый объект'
+        verbose_name_plural = 'Удалённые объекты'
+
+    def __str__(self):
+        return f'{self.get_kind_display()} {self.object_id}'
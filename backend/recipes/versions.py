@@ -0,0 +1,42 @@
+import time
+
+from django.core.cache import cache
+
+TAGS = 'tags'
+INGREDIENTS = 'ingredients'
+RECIPES = 'recipes'
+SCORES = 'scores'
+VERSION_KEY = 'version:{}'
+
+
+def _now():
+    return int(time.time() * 1000)
+
+
+def get_versions(*names):
+    """
+    Версии справочников - время последнего изменения в миллисекундах.
+    При пустом кэше версия начинается с текущего времени,
+    поэтому не совпадает ни с одной из выданных ранее.
+    """
+    keys = {VERSION_KEY.format(name): name for name in names}
+    versions = {keys[key]: value
+                for key, value in cache.get_many(keys).items()}
+    for key, name in keys.items():
+        if name not in versions:
+            version = _now()
+            if not cache.add(key, version, None):
+                version = cache.get(key, version)
+            versions[name] = version
+    return versions
+
+
+def get_version(name):
+    return get_versions(name)[name]
+
+
+def bump_version(name):
+    """Новая версия справочника после его изменения."""
+    version = max(_now(), get_version(name) + 1)
+    cache.set(VERSION_KEY.format(name), version, None)
+    return version
@@ -0,0 +1,14 @@
+from django.contrib import admin
+
+from tasks.models import Task
+
+
+class TaskAdmin(admin.ModelAdmin):
+    """Отображение очереди фоновых задач в админке."""
+    list_display = ('id', 'name', 'status', 'attempts', 'run_at',
+                    'created',)
+    list_filter = ('status', 'name',)
+    readonly_fields = ('last_error',)
+
+
+admin.site.register(Task, TaskAdmin)
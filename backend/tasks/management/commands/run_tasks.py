@@ -0,0 +1,51 @@
+import multiprocessing
+import signal
+import threading
+
+from django.core.management import BaseCommand
+from django.db import connections
+
+from tasks.queue import work
+
+
+def run_worker(threads, burst):
+    """Воркер одного процесса, останавливается по SIGTERM и SIGINT."""
+    stop = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *args: stop.set())
+    work(threads, burst, stop)
+
+
+class Command(BaseCommand):
+    """
+    Воркер очереди фоновых задач: processes процессов
+    по threads потоков. Брокер не нужен - очередь хранится в базе.
+    """
+    help = 'Выполнение фоновых задач из очереди'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1)
+        parser.add_argument('--threads', type=int, default=4)
+        parser.add_argument(
+            '--burst', action='store_true',
+            help='Завершиться, когда очередь опустеет'
+        )
+
+    def handle(self, *args, **options):
+        threads, burst = options['threads'], options['burst']
+        if options['processes'] <= 1:
+            run_worker(threads, burst)
+            return
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        workers = [
+            context.Process(target=run_worker, args=(threads, burst))
+            for _ in range(options['processes'])
+        ]
+        for worker in workers:
+            worker.start()
+        signal.signal(signal.SIGTERM, lambda *args: [
+            worker.terminate() for worker in workers
+        ])
+        for worker in workers:
+            worker.join()
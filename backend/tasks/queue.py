@@ -0,0 +1,168 @@
+import logging
+import threading
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from tasks.models import Task
+
+logger = logging.getLogger(__name__)
+
+REGISTRY = {}
+RETRY_DELAY = timedelta(seconds=30)
+LOCK_TIMEOUT = timedelta(minutes=10)
+HEARTBEAT_INTERVAL = LOCK_TIMEOUT / 4
+POLL_INTERVAL = 1.0
+
+
+def task(func=None, *, max_attempts=3):
+    """
+    Регистрация функции как фоновой задачи под именем module.name.
+    Аргументы задачи должны сериализоваться в JSON.
+    Задача должна быть идемпотентной: после сбоя воркера
+    она может быть выполнена повторно.
+    """
+    def register(func):
+        func.task_name = f'{func.__module__}.{func.__name__}'
+        func.max_attempts = max_attempts
+        REGISTRY[func.task_name] = func
+        return func
+    return register(func) if func is not None else register
+
+
+def enqueue(func, *args, **kwargs):
+    """
+    Постановка задачи в очередь после коммита текущей транзакции:
+    воркер не увидит данных, которые ещё не записаны.
+    При TASKS_EAGER задача выполняется сразу в текущем процессе.
+    """
+    if getattr(settings, 'TASKS_EAGER', False):
+        return func(*args, **kwargs)
+    transaction.on_commit(lambda: Task.objects.create(
+        name=func.task_name, args=list(args), kwargs=kwargs,
+        max_attempts=func.max_attempts
+    ))
+
+
+def requeue_stale():
+    """
+    Возврат в очередь задач упавших воркеров, у которых остались
+    попытки; остальные помечаются FAILED.
+    Живой воркер продлевает locked_at своих задач в heartbeat.
+    """
+    stale = Task.objects.filter(
+        status=Task.RUNNING,
+        locked_at__lt=timezone.now() - LOCK_TIMEOUT
+    )
+    requeued = stale.filter(attempts__lt=F('max_attempts')).update(
+        status=Task.PENDING, locked_at=None
+    )
+    stale.update(
+        status=Task.FAILED, locked_at=None,
+        last_error='Воркер не завершил задачу за отведённые попытки'
+    )
+    return requeued
+
+
+def heartbeat(task_ids):
+    """Продление блокировки выполняемых задач."""
+    return Task.objects.filter(
+        id__in=task_ids, status=Task.RUNNING
+    ).update(locked_at=timezone.now())
+
+
+def claim(limit):
+    """
+    Захват до limit готовых к запуску задач.
+    На PostgreSQL строки блокируются с SKIP LOCKED, иначе каждая
+    задача захватывается условным UPDATE - выигрывает один воркер.
+    """
+    now = timezone.now()
+    ready = Task.objects.filter(
+        status=Task.PENDING, run_at__lte=now
+    ).order_by('run_at')
+    claimed = []
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            claimed = list(ready.select_for_update(
+                skip_locked=True
+            ).values_list('id', flat=True)[:limit])
+            Task.objects.filter(id__in=claimed).update(
+                status=Task.RUNNING, locked_at=now,
+                attempts=F('attempts') + 1
+            )
+    else:
+        for task_id in ready.values_list('id', flat=True)[:limit]:
+            if Task.objects.filter(
+                id=task_id, status=Task.PENDING
+            ).update(status=Task.RUNNING, locked_at=now,
+                     attempts=F('attempts') + 1):
+                claimed.append(task_id)
+    return list(Task.objects.filter(id__in=claimed))
+
+
+def execute(task):
+    """
+    Выполнение захваченной задачи. Упавшая задача повторяется
+    с экспоненциальной задержкой, после max_attempts - FAILED.
+    """
+    close_old_connections()
+    try:
+        func = REGISTRY.get(task.name)
+        if func is None:
+            raise LookupError(f'Неизвестная задача {task.name}')
+        func(*task.args, **task.kwargs)
+    except Exception:
+        logger.exception('Задача %s #%s упала', task.name, task.id)
+        failed = task.attempts >= task.max_attempts
+        Task.objects.filter(id=task.id).update(
+            status=Task.FAILED if failed else Task.PENDING,
+            run_at=timezone.now() + RETRY_DELAY * 2 ** (task.attempts - 1),
+            locked_at=None,
+            last_error=traceback.format_exc(),
+        )
+    else:
+        Task.objects.filter(id=task.id).delete()
+    finally:
+        close_old_connections()
+
+
+def work(threads=4, burst=False, stop=None, poll_interval=POLL_INTERVAL):
+    """
+    Цикл воркера: задачи выполняются в пуле из threads потоков,
+    новые захватываются по мере освобождения потоков.
+    Раз в HEARTBEAT_INTERVAL продлевается блокировка выполняемых задач.
+    В простое в очередь возвращаются задачи упавших воркеров.
+    С burst цикл завершается, когда очередь пуста.
+    Соединение цикла закрывается по CONN_MAX_AGE, как между запросами.
+    """
+    stop = stop or threading.Event()
+    running = {}
+    beat_at = timezone.now() + HEARTBEAT_INTERVAL
+    with ThreadPoolExecutor(threads) as pool:
+        while running or not stop.is_set():
+            close_old_connections()
+            free = threads - len(running)
+            if free and not stop.is_set():
+                running.update(
+                    (pool.submit(execute, task), task.id)
+                    for task in claim(free)
+                )
+            if not running:
+                if burst:
+                    break
+                requeue_stale()
+                stop.wait(poll_interval)
+                continue
+            if timezone.now() >= beat_at:
+                heartbeat(running.values())
+                beat_at = timezone.now() + HEARTBEAT_INTERVAL
+            done, _ = wait(running, timeout=poll_interval,
+                           return_when=FIRST_COMPLETED)
+            for future in done:
+                del running[future]
@@ -1,6 +1,8 @@
 from django.contrib import admin
 from django.contrib.auth import get_user_model
 
+from api.purge import USER_PURGE, format_progress
+from api.tasks import schedule_user_deletion
 from .models import Follow
 
 User = get_user_model()
@@ -8,12 +10,34 @@ User = get_user_model()
 
 class UserAdmin(admin.ModelAdmin):
     """Отображение модели пользователя в админке."""
-    list_display = ('pk', 'username', 'email', 'first_name', 'last_name')
-    list_filter = ('email', 'first_name')
+    list_display = ('pk', 'username', 'email', 'first_name', 'last_name',
+                    'is_active', 'deletion')
+    list_filter = ('is_active', 'email', 'first_name')
     search_fields = ('email', 'first_name')
     ordering = ('username',)
     empty_value_display = '-пусто-'
 
+    @admin.display(description='Удаление')
+    def deletion(self, obj):
+        """Ход фонового удаления деактивированного пользователя."""
+        if obj.is_active:
+            return None
+        return format_progress(USER_PURGE, obj.pk)
+
+    def get_deleted_objects(self, objs, request):
+        """
+        Подтверждение удаления без обхода связей сборщиком ORM:
+        рецепты, подписки и остальные данные удаляются в фоне.
+        """
+        return [str(obj) for obj in objs], {}, set(), []
+
+    def delete_model(self, request, obj):
+        schedule_user_deletion(obj)
+
+    def delete_queryset(self, request, queryset):
+        for user in queryset:
+            schedule_user_deletion(user)
+
 
 class FollowAdmin(admin.ModelAdmin):
     """Отображение модели подписок в админке."""